@@ -2,7 +2,7 @@
 import logging
 import sys
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
 import engine.use_cases.parsing
 from engine.config import (
@@ -12,20 +12,31 @@ from engine.config import (
     delete_config_file,
     show_config_file,
 )
-from engine.exceptions import DatamapNotCSVException
-from engine.repository.datamap import InMemorySingleDatamapRepository
+from engine.domain.datamap import KeyFilter
+from engine.exceptions import DatamapNotCSVException, NoKeysSelectedError
+from engine.repository.datamap import (
+    InMemorySingleDatamapRepository,
+    compile_datamap,
+)
 from engine.repository.master import MasterOutputRepository, ValidationOnlyRepository
+from engine.repository.structure import check_datamap_against_template
 from engine.repository.templates import (
     InMemoryPopulatedTemplatesRepository,
     InMemoryPopulatedTemplatesZip,
     MultipleTemplatesWriteRepo,
 )
+from engine.use_cases.batch import BatchCreateMastersUseCase, BatchJob
 from engine.use_cases.output import WriteMasterToTemplates
 from engine.use_cases.parsing import (
+    CreateMastersForDatamapsUseCase,
     CreateMasterUseCase,
     CreateMasterUseCaseWithValidation,
 )
-from engine.utils.extraction import data_validation_report, datamap_reader
+from engine.use_cases.watch import WatchAndCreateMasterUseCase
+from engine.utils.cancellation import CancellationToken, RunStatus
+from engine.utils.concurrency import parse_memory_size
+from engine.utils.extraction import data_validation_report, datamap_cells
+from engine.utils.watching import directory_watcher
 from openpyxl import load_workbook
 
 logging.basicConfig(
@@ -58,12 +69,18 @@ def check_aux_files(config: Config):
         sys.exit(0)
     # if we get this far, there is a datamap file, so we can run this
     dm_name = config.config_parser["DEFAULT"]["datamap file name"]
-    if datamap_reader(config.PLATFORM_DOCS_DIR / "input" / dm_name):
+    dm_lines = compile_datamap(config.PLATFORM_DOCS_DIR / "input" / dm_name).lines
+    if not dm_lines:
+        logger.critical("Datamap tests failed")
+        return
+    if not check_datamap_against_template(
+        config.PLATFORM_DOCS_DIR / "input" / blank_t[1], dm_lines
+    ):
+        logger.critical(f"Datamap does not match blank template {blank_t[1]}.")
+    else:
         logger.info(
             "Datamap file passes tests. Check any WARNING messages. Ok to proceed."
         )
-    else:
-        logger.critical("Datamap tests failed")
 
 
 def report_data_validations_in_file(file: Path) -> List[str]:
@@ -87,76 +104,307 @@ def report_data_validations_in_file(file: Path) -> List[str]:
 
 
 def write_master_to_templates(
-    blank_template: Path, datamap: Path, master: Path
+    blank_template: Path, datamap: Path, master: Path, token=None, max_memory=None
 ) -> None:
-    output_repo = MultipleTemplatesWriteRepo(blank_template)
-    uc = WriteMasterToTemplates(output_repo, datamap, master, blank_template)
+    if max_memory:
+        Config.MAX_MEMORY = parse_memory_size(max_memory)
+    output_repo = MultipleTemplatesWriteRepo(blank_template, token=token)
+    uc = WriteMasterToTemplates(
+        output_repo, datamap, master, blank_template, token=token
+    )
     uc.execute()
 
 
+def _token_from_kwargs(kwargs) -> Optional[CancellationToken]:
+    """Return the CancellationToken passed in kwargs, or one created from a timeout."""
+    if kwargs.get("token"):
+        return kwargs.get("token")
+    if kwargs.get("timeout"):
+        return CancellationToken(
+            timeout=float(kwargs.get("timeout")),
+            best_effort=bool(kwargs.get("besteffort")),
+        )
+    return None
+
+
 def import_and_create_master(echo_funcs, datamap=None, **kwargs):
     """Import all spreadsheet files from input directory and process with datamap.
 
     echo_func - a function sent from the front-end interface allowing for suitable output (stdout, etc)
     echo_func_params - parameters to be used with echo_func
+    resume - checkpoint the import until the master is written, and skip files already extracted by a previous, interrupted import of the same input with resume; not with keys selected
+    token - a CancellationToken which can be used to stop the import
+    timeout - seconds after which the import is cancelled (if no token is given)
+    besteffort - with timeout, write a master from whatever was imported before the deadline
+    maxmemory - memory extraction may use, e.g. "4G"; files are extracted only while they fit
+    outofcore - keep extracted data in shards on disk, rather than in memory, until needed
+    nocache - extract every file, rather than using data cached by previous imports
+    incremental - reuse master columns from the previous run for templates which have not changed
+    latestreport - write the validation report to validation_report.csv, replacing the last one
+    keys - a list of datamap keys; if given (or keyglob or keyregex), only these keys are imported
+    keyglob - a list of glob patterns, such as "*RAG*", selecting datamap keys to import
+    keyregex - a regular expression selecting datamap keys to import
 
-    Create master spreadsheet immediately.
+    Create master spreadsheet immediately. If keys are selected, only the sheets and
+    cells they refer to are read from the templates, and the master is named with
+    "_selected" after the master file name in the config file, so as not to replace
+    a full master.
     """
-    # patch ECHO_FUNC for datamap creation - hack!
-    setattr(engine.use_cases.parsing, "ECHO_FUNC_GREEN", echo_funcs["click_echo_green"])
-    setattr(engine.use_cases.parsing, "ECHO_FUNC_RED", echo_funcs["click_echo_red"])
-    setattr(
-        engine.use_cases.parsing, "ECHO_FUNC_YELLOW", echo_funcs["click_echo_yellow"]
-    )
-    setattr(engine.use_cases.parsing, "ECHO_FUNC_WHITE", echo_funcs["click_echo_white"])
-
+    _apply_import_options(echo_funcs, kwargs)
     master_fn = Config.config_parser["DEFAULT"]["master file name"]
-    if kwargs.get("rowlimit"):
-        Config.TEMPLATE_ROW_LIMIT = kwargs.get("rowlimit")
-
-    if kwargs.get("inputdir"):
-        inputdir = kwargs.get("inputdir")
-    else:
-        inputdir = Config.PLATFORM_DOCS_DIR / "input"
     if kwargs.get("validationonly"):
         output_repo = ValidationOnlyRepository
         master_fn = ""
     else:
         output_repo = MasterOutputRepository
 
-    if kwargs.get("zipinput"):
-        tmpl_repo = InMemoryPopulatedTemplatesZip(kwargs.get("zipinput"))
-    else:
-        tmpl_repo = InMemoryPopulatedTemplatesRepository(inputdir)
-
-    if Config.TEMPLATE_ROW_LIMIT < 50:
-        logger.warning(
-            f"Row limit is set to {Config.TEMPLATE_ROW_LIMIT} (default is 500). This may be unintentionally low. Check datamaps import templates --help"
-        )
-    else:
-        logger.info(f"Row limit is set to {Config.TEMPLATE_ROW_LIMIT}.")
+    use_cache = not kwargs.get("nocache")
+    token = _token_from_kwargs(kwargs)
+    tmpl_repo = _template_repo(kwargs, token)
 
     if datamap:
         dm_fn = datamap
     else:
         dm_fn = Config.config_parser["DEFAULT"]["datamap file name"]
     dm = Path(tmpl_repo.directory_path) / dm_fn
-    dm_repo = InMemorySingleDatamapRepository(dm)
+    key_filter = _key_filter_from_kwargs(kwargs)
+    _check_resumable(kwargs, key_filter)
+    dm_repo = InMemorySingleDatamapRepository(dm, key_filter=key_filter)
+    if key_filter is not None:
+        tmpl_repo.cells = datamap_cells([dm_repo.compiled])
+        if master_fn:
+            master = Path(master_fn)
+            master_fn = f"{master.stem}_selected{master.suffix}"
+    incremental = bool(kwargs.get("incremental"))
     if dm_repo.is_typed:
-        uc = CreateMasterUseCaseWithValidation(dm_repo, tmpl_repo, output_repo)
+        uc = CreateMasterUseCaseWithValidation(
+            dm_repo,
+            tmpl_repo,
+            output_repo,
+            token=token,
+            incremental=incremental,
+            timestamp_report=not kwargs.get("latestreport"),
+        )
     else:
         if output_repo == ValidationOnlyRepository:
             logger.critical(
                 "Cannot validate data. The datamap needs to have a 'type' column."
             )
             sys.exit(1)
-        uc = CreateMasterUseCase(dm_repo, tmpl_repo, output_repo)
+        uc = CreateMasterUseCase(
+            dm_repo, tmpl_repo, output_repo, token=token, incremental=incremental
+        )
     try:
         uc.execute(master_fn)
     except FileNotFoundError as e:
         raise FileNotFoundError(e)
     except DatamapNotCSVException:
         raise
+    if uc.status == RunStatus.PARTIAL:
+        logger.warning(
+            "Deadline reached before all files were imported. Master contains partial results."
+        )
+    if use_cache:
+        _report_cache_use(tmpl_repo)
+    return uc.status
+
+
+def _apply_import_options(echo_funcs, kwargs) -> None:
+    "Set up the front-end's echo functions and the import options in kwargs which live in Config."
+    # patch ECHO_FUNC for datamap creation - hack!
+    setattr(engine.use_cases.parsing, "ECHO_FUNC_GREEN", echo_funcs["click_echo_green"])
+    setattr(engine.use_cases.parsing, "ECHO_FUNC_RED", echo_funcs["click_echo_red"])
+    setattr(
+        engine.use_cases.parsing, "ECHO_FUNC_YELLOW", echo_funcs["click_echo_yellow"]
+    )
+    setattr(engine.use_cases.parsing, "ECHO_FUNC_WHITE", echo_funcs["click_echo_white"])
+    if kwargs.get("rowlimit"):
+        Config.TEMPLATE_ROW_LIMIT = kwargs.get("rowlimit")
+    if kwargs.get("maxmemory"):
+        Config.MAX_MEMORY = parse_memory_size(kwargs.get("maxmemory"))
+    if Config.TEMPLATE_ROW_LIMIT < 50:
+        logger.warning(
+            f"Row limit is set to {Config.TEMPLATE_ROW_LIMIT} (default is 500). This may be unintentionally low. Check datamaps import templates --help"
+        )
+    else:
+        logger.info(f"Row limit is set to {Config.TEMPLATE_ROW_LIMIT}.")
+
+
+def _check_resumable(kwargs, key_filter: Optional[KeyFilter]) -> None:
+    "Exit if resume is asked for with keys selected, as only complete templates are checkpointed."
+    if kwargs.get("resume") and key_filter is not None:
+        logger.critical(
+            "Cannot resume an import of selected keys. Import all keys to use resume."
+        )
+        sys.exit(1)
+
+
+def _key_filter_from_kwargs(kwargs) -> Optional[KeyFilter]:
+    "Return a KeyFilter for the keys, keyglob and keyregex options, or None if none are given."
+    keys, globs = kwargs.get("keys"), kwargs.get("keyglob")
+    if not (keys or globs or kwargs.get("keyregex")):
+        return None
+    return KeyFilter(
+        [keys] if isinstance(keys, str) else keys,
+        [globs] if isinstance(globs, str) else globs,
+        kwargs.get("keyregex"),
+    )
+
+
+def _template_repo(kwargs, token):
+    "The repository of the templates to be imported, as set by the options in kwargs."
+    options = dict(
+        resume=bool(kwargs.get("resume")),
+        token=token,
+        out_of_core=bool(kwargs.get("outofcore")),
+        use_cache=not kwargs.get("nocache"),
+    )
+    if kwargs.get("zipinput"):
+        return InMemoryPopulatedTemplatesZip(kwargs.get("zipinput"), **options)
+    if kwargs.get("inputdir"):
+        inputdir = kwargs.get("inputdir")
+    else:
+        inputdir = Config.PLATFORM_DOCS_DIR / "input"
+    return InMemoryPopulatedTemplatesRepository(inputdir, **options)
+
+
+def import_and_create_masters_for_datamaps(echo_funcs, datamaps, **kwargs):
+    """Import the templates once, and create a master from them for each of datamaps.
+
+    datamaps - the datamap files, each a file name in the input directory or a path elsewhere
+
+    Each master is named after the master file name in the config file and its
+    datamap: master.xlsx and finance.csv give master_finance.xlsx. Accepts the
+    options of import_and_create_master; keys selected apply to every datamap. With
+    nocache (unless resume is given), or if keys are selected, only the cells
+    referred to by the datamaps are read from the templates. Otherwise the templates
+    are read in full, so that they can be kept in the extraction cache for later
+    imports with any datamap, and, with resume, checkpointed to the run journal.
+    Returns a dict mapping the path of each datamap to its RunStatus.
+    """
+    _apply_import_options(echo_funcs, kwargs)
+    master = Path(Config.config_parser["DEFAULT"]["master file name"])
+    if kwargs.get("validationonly"):
+        output_repo = ValidationOnlyRepository
+    else:
+        output_repo = MasterOutputRepository
+    use_cache = not kwargs.get("nocache")
+    token = _token_from_kwargs(kwargs)
+    tmpl_repo = _template_repo(kwargs, token)
+    key_filter = _key_filter_from_kwargs(kwargs)
+    _check_resumable(kwargs, key_filter)
+    dm_repos = []
+    for dm in datamaps:
+        try:
+            dm_repos.append(
+                InMemorySingleDatamapRepository(
+                    Path(tmpl_repo.directory_path) / dm, key_filter=key_filter
+                )
+            )
+        except NoKeysSelectedError as e:
+            logger.warning(f"{e} No master will be created from it.")
+    # templates read in part are neither cached nor checkpointed for resume
+    if key_filter is not None or not (use_cache or kwargs.get("resume")):
+        tmpl_repo.cells = datamap_cells(dm_repo.compiled for dm_repo in dm_repos)
+    jobs = []
+    for dm_repo in dm_repos:
+        if kwargs.get("validationonly"):
+            master_fn = ""
+        else:
+            dm_stem = Path(dm_repo.datamap_path).stem
+            master_fn = f"{master.stem}_{dm_stem}{master.suffix}"
+        jobs.append((dm_repo, master_fn))
+    uc = CreateMastersForDatamapsUseCase(
+        jobs,
+        tmpl_repo,
+        output_repo,
+        token=token,
+        incremental=bool(kwargs.get("incremental")),
+        timestamp_report=not kwargs.get("latestreport"),
+    )
+    status = uc.execute()
+    if use_cache:
+        _report_cache_use(tmpl_repo)
+    return status
+
+
+def _report_cache_use(tmpl_repo) -> None:
+    if tmpl_repo.cache_misses:
+        logger.info(
+            f"{len(tmpl_repo.cache_misses)} templates parsed (not in extraction cache): "
+            + ", ".join(Path(f).name for f in tmpl_repo.cache_misses)
+        )
+    else:
+        logger.info(
+            f"All {tmpl_repo.cache_hits} templates taken from extraction cache. "
+            "No templates were parsed."
+        )
+
+
+def watch_and_create_master(echo_funcs, datamap=None, **kwargs):
+    """Create a master from the input directory, and again whenever templates change.
+
+    Runs until interrupted, or until token is cancelled. Each time the master is
+    created, only templates which are new or have changed since the last time are
+    parsed and have the datamap applied, and the master and validation report are
+    replaced once they have been written in full.
+
+    Accepts the options of import_and_create_master (other than zipinput, resume,
+    timeout and besteffort), and:
+
+    debounce - seconds for which the input directory must be unchanged before the master is created
+    pollinterval - list the input directory every pollinterval seconds rather than using inotify
+    """
+    if kwargs.get("inputdir"):
+        inputdir = kwargs.get("inputdir")
+    else:
+        inputdir = Config.PLATFORM_DOCS_DIR / "input"
+    token = kwargs.get("token")
+    create_kwargs = {
+        k: v
+        for k, v in kwargs.items()
+        if k not in ("zipinput", "resume", "token", "timeout", "besteffort")
+    }
+    create_kwargs.update(inputdir=inputdir, incremental=True, latestreport=True)
+
+    def create_master():
+        import_and_create_master(echo_funcs, datamap, **create_kwargs)
+
+    poll = kwargs.get("pollinterval")
+    debounce = kwargs.get("debounce")
+    uc = WatchAndCreateMasterUseCase(
+        directory_watcher(inputdir, float(poll) if poll else None),
+        create_master,
+        debounce=float(debounce) if debounce else None,
+        token=token,
+    )
+    logger.info(f"Watching {inputdir} for changes. Press Ctrl-C to stop.")
+    try:
+        uc.execute()
+    except KeyboardInterrupt:
+        logger.info("Watch interrupted.")
+
+
+def import_and_create_masters(jobs: List[BatchJob], **kwargs):
+    """Create a master for each of several projects in a single run.
+
+    jobs - a list of BatchJob(inputdir, datamap, output_file_name)
+
+    Accepts the rowlimit, maxmemory, resume, nocache, token, timeout and besteffort
+    options of import_and_create_master. Returns a dict mapping each job to its RunStatus.
+    """
+    if kwargs.get("rowlimit"):
+        Config.TEMPLATE_ROW_LIMIT = kwargs.get("rowlimit")
+    if kwargs.get("maxmemory"):
+        Config.MAX_MEMORY = parse_memory_size(kwargs.get("maxmemory"))
+    uc = BatchCreateMastersUseCase(
+        jobs,
+        MasterOutputRepository,
+        resume=bool(kwargs.get("resume")),
+        token=_token_from_kwargs(kwargs),
+        use_cache=not kwargs.get("nocache"),
+    )
+    return uc.execute()
 
 
 def delete_config(config) -> None:
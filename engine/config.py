@@ -46,6 +46,12 @@ class Config:
     FULL_PATH_OUTPUT = Path(PLATFORM_DOCS_DIR) / "output"
     ACCEPTABLE_VALIDATION_TYPES = ["TEXT", "NUMBER", "DATE"]
     TEMPLATE_ROW_LIMIT = 500
+    # bytes of memory spreadsheet extraction and writing may use; None for no limit
+    MAX_MEMORY = None
+    # bytes the persistent extraction cache may use before old entries are removed
+    CACHE_MAX_SIZE = 512 * 1024 * 1024
+    # set if DATAMAPS_LIBRARY_DATA_DIR is on a network share used by several machines
+    CACHE_ON_NETWORK_SHARE = False
     config_parser = ConfigParser()
     base_config = textwrap.dedent(
         """\
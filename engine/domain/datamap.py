@@ -1,9 +1,12 @@
 "Entities relating to the datamap."
+import codecs
+import fnmatch
+import re
 from enum import Enum, auto
 from pathlib import Path
 
 # pylint: disable=R0903,R0913;
-from typing import IO, Dict, Optional, Union
+from typing import IO, Any, Dict, Iterable, List, Optional, Tuple, Union
 
 from engine.exceptions import DatamapNotCSVException
 
@@ -24,8 +27,13 @@ class DatamapLine:
     """The core data structure that is configured by the user datamap.csv.
 
     Data structure representing all cell data extracted from templates/spreadsheets.
+
+    A line's fields can also be read by name, as line["key"], so that code written
+    for the dicts produced by DatamapEncoder works with DatamapLine objects too.
     """
 
+    __slots__ = ("key", "sheet", "cellref", "data_type", "filename")
+
     def __init__(
         self,
         key: str,
@@ -40,6 +48,12 @@ class DatamapLine:
         self.data_type = data_type
         self.filename = filename
 
+    def __getitem__(self, name: str) -> Optional[str]:
+        try:
+            return getattr(self, name)
+        except (AttributeError, TypeError):
+            raise KeyError(name)
+
     def to_dict(self) -> Dict[str, Optional[str]]:
         "Return the attributes as a dictionary."
         return {
@@ -51,11 +65,167 @@ class DatamapLine:
         }
 
 
+class CompiledDatamap:
+    """A datamap file which has been read, checked and indexed.
+
+    Holds the header mapping found by datamap_check(), the DatamapLine objects
+    read from the file and indexes of them by sheet and by key, so that nothing
+    about the datamap needs to be worked out again. warnings holds the messages
+    about lines skipped when the file was read.
+
+    The indexes are:
+        line_for_key - key to the line for it (the first, if the key appears twice)
+        lines_by_sheet - sheet to the lines for cells on it, in datamap order
+        cellref_for - (key, sheet) to the cellref of the line for the key on that sheet
+        key_at - (sheet, cellref) to the key of the line for that cell
+    """
+
+    def __init__(
+        self,
+        source: str,
+        source_hash: str,
+        headers: Dict[str, Optional[str]],
+        lines: List[DatamapLine],
+        warnings: Optional[List[str]] = None,
+    ) -> None:
+        self.source = source
+        self.source_hash = source_hash
+        self.headers = headers
+        self.lines = lines
+        self.warnings = warnings or []
+        self.cellrefs_by_sheet: Dict[str, List[str]] = {}
+        self.lines_by_sheet: Dict[str, List[DatamapLine]] = {}
+        self.line_for_key: Dict[str, DatamapLine] = {}
+        self.cellref_for: Dict[Tuple[str, str], str] = {}
+        self.key_at: Dict[Tuple[str, str], str] = {}
+        for line in lines:
+            self.cellrefs_by_sheet.setdefault(line.sheet, []).append(line.cellref)
+            self.lines_by_sheet.setdefault(line.sheet, []).append(line)
+            # where a key or a cell appears twice, the first line wins
+            self.line_for_key.setdefault(line.key, line)
+            self.cellref_for.setdefault((line.key, line.sheet), line.cellref)
+            self.key_at.setdefault((line.sheet, line.cellref), line.key)
+        self.keys = set(self.line_for_key)
+        self.sheets = set(self.cellrefs_by_sheet)
+
+    @property
+    def is_typed(self) -> bool:
+        return self.headers["type"] is not None
+
+    def to_dict(self) -> Dict[str, Any]:
+        "Return the datamap as a dictionary which can be serialised as JSON."
+        return {
+            "source": self.source,
+            "source_hash": self.source_hash,
+            "headers": self.headers,
+            "lines": [line.to_dict() for line in self.lines],
+            "warnings": self.warnings,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CompiledDatamap":
+        "Return the datamap from a dictionary made by to_dict()."
+        return cls(
+            data["source"],
+            data["source_hash"],
+            data["headers"],
+            [DatamapLine(**line) for line in data["lines"]],
+            data["warnings"],
+        )
+
+    def select(self, key_filter: "KeyFilter") -> "CompiledDatamap":
+        "Return a datamap of only the lines whose keys are selected by key_filter."
+        return CompiledDatamap(
+            self.source,
+            self.source_hash,
+            self.headers,
+            [line for line in self.lines if key_filter(line.key)],
+            self.warnings,
+        )
+
+
+class KeyFilter:
+    """Selects datamap keys by name, glob pattern or regular expression.
+
+    A key is selected if it is one of keys, matches any of globs (case sensitively,
+    as fnmatch.fnmatchcase()) or matches regex anywhere in it (as re.search()).
+    Raises ValueError if regex is not a valid regular expression.
+    """
+
+    def __init__(
+        self,
+        keys: Optional[Iterable[str]] = None,
+        globs: Optional[Iterable[str]] = None,
+        regex: Optional[str] = None,
+    ) -> None:
+        self.keys = set(keys or [])
+        self.globs = list(globs or [])
+        try:
+            self.regex = re.compile(regex) if regex else None
+        except re.error as e:
+            raise ValueError(f"Invalid key pattern {regex!r}: {e}")
+
+    def __call__(self, key: str) -> bool:
+        if key in self.keys:
+            return True
+        if any(fnmatch.fnmatchcase(key, glob) for glob in self.globs):
+            return True
+        return self.regex is not None and self.regex.search(key) is not None
+
+    def __str__(self) -> str:
+        parts = sorted(self.keys) + self.globs
+        if self.regex is not None:
+            parts.append(f"/{self.regex.pattern}/")
+        return ", ".join(parts)
+
+
+# bytes read from the start of a datamap file to decide its encoding
+ENCODING_SNIFF_SIZE = 64 * 1024
+
+
+def _latin1_fallback(error: UnicodeError) -> Tuple[str, int]:
+    "Decode bytes which are not UTF-8 as latin1, rather than failing."
+    return error.object[error.start : error.end].decode("latin1"), error.end  # type: ignore
+
+
+def _latin1_fallback_errors() -> str:
+    """Return the name of an error handler decoding bytes which are not UTF-8 as latin1.
+
+    The handler is registered when a datamap is first read, rather than whenever
+    this module is imported.
+    """
+    try:
+        codecs.lookup_error("datamap_latin1")
+    except LookupError:
+        codecs.register_error("datamap_latin1", _latin1_fallback)
+    return "datamap_latin1"
+
+
+def sniff_encoding(filepath: Union[Path, str]) -> str:
+    """Return "utf-8" if the start of the file at filepath is UTF-8, otherwise "latin1".
+
+    Only the first ENCODING_SNIFF_SIZE bytes are read.
+    """
+    with open(filepath, "rb") as f:
+        prefix = f.read(ENCODING_SNIFF_SIZE)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        # a character may be cut in two at the end of the prefix
+        decoder.decode(prefix, final=len(prefix) < ENCODING_SNIFF_SIZE)
+    except UnicodeDecodeError:
+        return "latin1"
+    return "utf-8"
+
+
 class DatamapFile:
     """A context manager that represents the datamap file.
 
     Having a context manager means we can more elegantly capture the
     exception with the file isn't found.
+
+    The file is read as UTF-8 if the start of it is UTF-8 (see sniff_encoding()),
+    and as latin1 otherwise. Any bytes further into a UTF-8 file which are not
+    UTF-8 are read as latin1.
     """
 
     def __init__(self, filepath: Union[Path, str]) -> None:
@@ -72,17 +242,19 @@ class DatamapFile:
                 _ext = self.filepath.suffix  # type: ignore
             if _ext != ".csv":
                 raise DatamapNotCSVException("Given datamap file is not in CSV format.")
-            self.f_obj = open(self.filepath, "r", encoding="utf-8")
-            self.f_obj.read()
-            self.f_obj.seek(0)
+            encoding = sniff_encoding(self.filepath)
+            self.f_obj = open(
+                self.filepath,
+                "r",
+                encoding=encoding,
+                errors=_latin1_fallback_errors() if encoding == "utf-8" else "strict",
+                newline="",
+            )
             return self.f_obj
         except DatamapNotCSVException:
             raise
         except FileNotFoundError:
             raise FileNotFoundError("Cannot find {}".format(self.filepath))
-        except UnicodeDecodeError:
-            self.f_obj = open(self.filepath, "r", encoding="latin1")
-            return self.f_obj
 
     def __exit__(self, mytype, value, traceback):  # type: ignore
         self.f_obj.close()
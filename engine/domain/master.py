@@ -0,0 +1,38 @@
+"The domain object representing the data in a master"
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+class MasterData:
+    """The data for a master, held by column.
+
+    keys holds the datamap keys which label the rows of the master, in order, and
+    is shared by every column. columns maps the file name of each template to its
+    values, one for each key, in the order in which the columns appear in the master.
+    """
+
+    def __init__(
+        self, keys: List[str], columns: Optional[Dict[str, List[Any]]] = None
+    ) -> None:
+        self.keys = keys
+        self.columns: Dict[str, List[Any]] = {}
+        for file_name, values in (columns or {}).items():
+            self.add_column(file_name, values)
+
+    def __len__(self) -> int:
+        return len(self.columns)
+
+    def add_column(self, file_name: str, values: List[Any]) -> None:
+        "Add the column for file_name. Raises ValueError unless there is a value for each key."
+        if len(values) != len(self.keys):
+            raise ValueError(
+                f"Column for {file_name} has {len(values)} values for {len(self.keys)} keys."
+            )
+        self.columns[file_name] = values
+
+    def rows(self) -> Iterator[Tuple[Any, ...]]:
+        "Yield each key followed by its value in every column."
+        return zip(self.keys, *self.columns.values())
+
+    def column_items(self, file_name: str) -> List[Tuple[str, Any]]:
+        "Return the (key, value) pairs of the column for file_name."
+        return list(zip(self.keys, self.columns[file_name]))
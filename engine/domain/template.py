@@ -1,7 +1,9 @@
-"The domain object representing a populated template"
-from typing import Dict
+"The domain objects representing populated and blank templates"
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 
-from .datamap import DatamapLineValueType  # noqa
+from openpyxl.utils.cell import coordinate_to_tuple, range_boundaries
+
+from .datamap import DatamapLine, DatamapLineValueType  # noqa
 
 
 class TemplateCell:
@@ -30,3 +32,163 @@ class TemplateCell:
             "value": self.value,
             "data_type": self.data_type.name,
         }
+
+
+# the type of data allowed by an Excel data validation, by its type attribute
+_VALIDATION_VALUE_TYPES = {
+    "whole": DatamapLineValueType.NUMBER,
+    "decimal": DatamapLineValueType.NUMBER,
+    "date": DatamapLineValueType.DATE,
+    "textLength": DatamapLineValueType.TEXT,
+}
+
+
+class StructureProblem(NamedTuple):
+    """A datamap line which does not fit the blank template.
+
+    fatal is True where writing a value to the cell would fail.
+    """
+
+    key: str
+    message: str
+    fatal: bool
+
+
+class SheetStructure:
+    """The layout of one worksheet in a blank template.
+
+    dimensions is the range of cells in use, merged_ranges the ranges of merged cells
+    and data_validations a (type, range) pair for each data validation.
+    """
+
+    def __init__(
+        self,
+        dimensions: str,
+        merged_ranges: List[str],
+        data_validations: List[Tuple[str, str]],
+    ) -> None:
+        self.dimensions = dimensions
+        self.merged_ranges = merged_ranges
+        self.data_validations = data_validations
+        # every cell in a merged range other than its top-left cell, which holds the value
+        self._merged: Dict[Tuple[int, int], str] = {}
+        for merged in merged_ranges:
+            min_col, min_row, max_col, max_row = range_boundaries(merged)
+            for row in range(min_row, max_row + 1):
+                for col in range(min_col, max_col + 1):
+                    if (row, col) != (min_row, min_col):
+                        self._merged[(row, col)] = merged
+        # for each column, the (first row, last row, type) of each validation applied in it
+        self._validations: Dict[int, List[Tuple[int, int, str]]] = {}
+        for dv_type, sqref in data_validations:
+            for cell_range in sqref.split():
+                min_col, min_row, max_col, max_row = range_boundaries(cell_range)
+                for col in range(min_col, max_col + 1):
+                    self._validations.setdefault(col, []).append(
+                        (min_row, max_row, dv_type)
+                    )
+
+    def to_dict(self) -> Dict[str, Any]:
+        "Return the layout as a dictionary which can be serialised as JSON."
+        return {
+            "dimensions": self.dimensions,
+            "merged_ranges": self.merged_ranges,
+            "data_validations": self.data_validations,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SheetStructure":
+        "Return the layout from a dictionary made by to_dict()."
+        return cls(
+            data["dimensions"],
+            data["merged_ranges"],
+            [(dv_type, sqref) for dv_type, sqref in data["data_validations"]],
+        )
+
+    def merged_range_covering(self, row: int, col: int) -> Optional[str]:
+        "The merged range in which the cell at row, col is hidden, if any."
+        return self._merged.get((row, col))
+
+    def validation_type(self, row: int, col: int) -> Optional[str]:
+        "The type of the data validation applied to the cell at row, col, if any."
+        for min_row, max_row, dv_type in self._validations.get(col, ()):
+            if min_row <= row <= max_row:
+                return dv_type
+        return None
+
+
+class TemplateStructure:
+    """The sheets of a blank template and the layout of each, as found by template_structure().
+
+    Used to check that every line of a datamap refers to a cell which can be
+    written to in the template, without opening the template.
+    """
+
+    def __init__(
+        self, source: str, checksum: str, sheets: Dict[str, SheetStructure]
+    ) -> None:
+        self.source = source
+        self.checksum = checksum
+        self.sheets = sheets
+
+    def to_dict(self) -> Dict[str, Any]:
+        "Return the structure as a dictionary which can be serialised as JSON."
+        return {
+            "source": self.source,
+            "checksum": self.checksum,
+            "sheets": {title: sheet.to_dict() for title, sheet in self.sheets.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "TemplateStructure":
+        "Return the structure from a dictionary made by to_dict()."
+        return cls(
+            data["source"],
+            data["checksum"],
+            {
+                title: SheetStructure.from_dict(sheet)
+                for title, sheet in data["sheets"].items()
+            },
+        )
+
+    def check_line(self, line: DatamapLine) -> Optional[StructureProblem]:
+        "Return the problem with line, or None if it fits the template."
+        sheet = self.sheets.get(line.sheet)
+        if sheet is None:
+            return StructureProblem(
+                line.key, f"Sheet '{line.sheet}' is not in the blank template.", False
+            )
+        if not line.cellref:
+            return StructureProblem(line.key, "No cellref in datamap.", False)
+        try:
+            row, col = coordinate_to_tuple(line.cellref)
+        except (ValueError, TypeError):
+            return StructureProblem(
+                line.key, f"'{line.cellref}' is not a valid cell reference.", True
+            )
+        merged = sheet.merged_range_covering(row, col)
+        if merged is not None:
+            return StructureProblem(
+                line.key,
+                f"{line.sheet}!{line.cellref} is inside merged cells {merged} "
+                "and cannot hold a value.",
+                True,
+            )
+        dv_type = sheet.validation_type(row, col)
+        wanted = _VALIDATION_VALUE_TYPES.get(dv_type) if dv_type else None
+        if wanted is not None and line.data_type and line.data_type != wanted.name:
+            return StructureProblem(
+                line.key,
+                f"{line.sheet}!{line.cellref} has a data validation allowing "
+                f"{wanted.name} but the datamap gives type {line.data_type}.",
+                False,
+            )
+        return None
+
+    def check_datamap(self, lines: List[DatamapLine]) -> List[StructureProblem]:
+        "Return the problems with each line of a datamap which does not fit the template."
+        return [
+            problem
+            for problem in (self.check_line(line) for line in lines)
+            if problem is not None
+        ]
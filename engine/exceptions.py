@@ -32,3 +32,18 @@ class DatamapFileEncodingError(Exception):
 
 class MissingLineError(Exception):
     pass
+
+
+class NoKeysSelectedError(Exception):
+    pass
+
+
+class OperationCancelledError(Exception):
+    """Raised when a use case is cancelled, or overruns its deadline.
+
+    Any results completed before the cancellation are available as partial.
+    """
+
+    def __init__(self, msg, partial=None):
+        super().__init__(msg)
+        self.partial = partial
@@ -9,27 +9,40 @@ from pathlib import Path
 from typing import List
 
 from engine.config import Config
+from engine.utils.locking import atomic_write
 from engine.utils.validation import ValidationCheck
 
 
 class ValidationReportCSV:
     """
     Writes a CSV output for validation_data at
-    Config.FULL_PATH_OUTPUT/validation_report.csv
+    Config.FULL_PATH_OUTPUT/<prefix>_<timestamp>.csv, or at
+    Config.FULL_PATH_OUTPUT/<prefix>.csv if timestamped is False, replacing
+    the previous report.
     """
 
-    def __init__(self, validation_data: List[ValidationCheck]):
+    def __init__(
+        self,
+        validation_data: List[ValidationCheck],
+        prefix: str = "validation_report",
+        timestamped: bool = True,
+    ):
         self.data = validation_data
+        self.prefix = prefix
+        self.timestamped = timestamped
 
     def write(self) -> Path:
-        timestamp = (
-            datetime.datetime.today()
-            .isoformat(timespec="seconds")
-            .replace(":", "_")
-            .replace("-", "_")
-        )
-        out_file = Config.FULL_PATH_OUTPUT / f"validation_report_{timestamp}.csv"
-        with open(out_file, "w", newline="") as csvfile:
+        if self.timestamped:
+            timestamp = (
+                datetime.datetime.today()
+                .isoformat(timespec="seconds")
+                .replace(":", "_")
+                .replace("-", "_")
+            )
+            out_file = Config.FULL_PATH_OUTPUT / f"{self.prefix}_{timestamp}.csv"
+        else:
+            out_file = Config.FULL_PATH_OUTPUT / f"{self.prefix}.csv"
+        with atomic_write(out_file, newline="") as csvfile:
             fieldnames = [
                 "Pass Status",
                 "Filename",
@@ -0,0 +1,402 @@
+# repository/cache.py
+#
+# A persistent cache of extracted template data, held in a SQLite database in
+# the library data directory. Entries are keyed by the checksum of the file
+# and the version of the extraction that produced them, so a file is only
+# parsed again if its contents, or the way data is extracted, have changed.
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from engine.config import Config
+from engine.utils.extraction import DAT_DATA, FILE_DATA
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s: %(levelname)s - %(message)s",
+    datefmt="%d-%b-%y %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+# increment when template_reader() changes what it extracts
+EXTRACTION_FORMAT_VERSION = 1
+# seconds after which a claim to be extracting a file is assumed to be abandoned
+CLAIM_TIMEOUT = 15 * 60
+# seconds between checks on a file being extracted by another run
+CLAIM_POLL_INTERVAL = 1.0
+# fraction of max_size to which eviction reduces the cache, so that entries are
+# removed in batches rather than one at a time as each new entry is stored
+EVICTION_TARGET = 0.9
+# number of cache hits whose last_used time is held back before being written
+TOUCH_BATCH_SIZE = 100
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS extractions (
+    checksum TEXT NOT NULL,
+    version TEXT NOT NULL,
+    data TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (checksum, version)
+);
+CREATE INDEX IF NOT EXISTS extractions_last_used ON extractions (last_used);
+CREATE TABLE IF NOT EXISTS claims (
+    checksum TEXT NOT NULL,
+    version TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (checksum, version)
+);
+CREATE TABLE IF NOT EXISTS sheets (
+    checksum TEXT NOT NULL,
+    version TEXT NOT NULL,
+    title TEXT NOT NULL,
+    signature TEXT NOT NULL,
+    PRIMARY KEY (checksum, version, title)
+);
+CREATE INDEX IF NOT EXISTS sheets_signature ON sheets (signature, version);
+CREATE TABLE IF NOT EXISTS validations (
+    checksum TEXT NOT NULL,
+    key TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (checksum, key)
+);
+"""
+
+
+def extraction_version(row_limit: Optional[int] = None) -> str:
+    """Identify the options which affect the data extracted from a template."""
+    if row_limit is None:
+        row_limit = Config.TEMPLATE_ROW_LIMIT
+    return f"{EXTRACTION_FORMAT_VERSION}:rows={int(row_limit)}"
+
+
+def _relocate(file_data: FILE_DATA, template_file: Union[Path, str]) -> FILE_DATA:
+    """Point each cell in file_data at template_file, as template_reader() would have."""
+    file_name = (
+        template_file.as_posix() if isinstance(template_file, Path) else template_file
+    )
+    for sheet in file_data["data"].values():  # type: ignore
+        for cell in sheet.values():
+            cell["file_name"] = file_name
+    return file_data
+
+
+class ExtractionCache:
+    """Persistent store of the data extracted from templates, keyed by file checksum.
+
+    Templates with the same contents share an entry, whatever they are called or
+    wherever they are. When the entries take up more than max_size bytes, those
+    least recently used are removed. hits counts the lookups answered by the cache,
+    and misses lists the files which were not in it.
+
+    The results of validating each file are also kept, and removed along with the
+    file's extracted data.
+
+    If the signature of each worksheet in a file is stored with its data (see
+    sheet_signatures()), a worksheet unchanged since a file was cached can be
+    taken from the cache when another version of the file is extracted, so that
+    only the worksheets which have changed are read (see reusable_sheets()).
+
+    The cache may be shared by several runs at once, in other processes or on other
+    machines. Each entry is published in a single transaction. A run about to
+    extract a file claims its checksum first (see claim()), so that other runs
+    wait for the result rather than extracting the same file themselves. If
+    Config.CACHE_ON_NETWORK_SHARE is False the database uses write-ahead logging,
+    so that readers are not blocked by a writer; this does not work over a network
+    file system, where the default rollback journal is used instead.
+
+    So that lookups do not need the write lock, the time each entry is used is
+    recorded in batches, when an entry is stored, on eviction, on close(), or
+    after TOUCH_BATCH_SIZE hits. The size of the cache is counted as entries are
+    stored, and only summed again once it appears to exceed max_size.
+    """
+
+    def __init__(
+        self,
+        path: Optional[Union[Path, str]] = None,
+        max_size: Optional[int] = None,
+        version: Optional[str] = None,
+    ) -> None:
+        if path is None:
+            path = Path(Config.DATAMAPS_LIBRARY_DATA_DIR) / "extraction_cache.sqlite3"
+        self.path = Path(path)
+        self.max_size = max_size if max_size is not None else Config.CACHE_MAX_SIZE
+        self.version = version if version is not None else extraction_version()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        # take the write lock when a transaction starts, rather than on its first write
+        self._conn = sqlite3.connect(
+            str(self.path), timeout=60, isolation_level="IMMEDIATE"
+        )
+        if not Config.CACHE_ON_NETWORK_SHARE:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.executescript(_SCHEMA)
+        self.hits = 0
+        self.misses: List[Union[Path, str]] = []
+        self._touched: Dict[Tuple[str, str], float] = {}
+        self._size: Optional[int] = None
+
+    def __len__(self) -> int:
+        (count,) = self._conn.execute(
+            "SELECT COUNT(*) FROM extractions WHERE version = ?", (self.version,)
+        ).fetchone()
+        return count
+
+    @property
+    def size(self) -> int:
+        "Total size in bytes of all entries, of every version."
+        (size,) = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM extractions"
+        ).fetchone()
+        return size
+
+    def get(self, template_file: Union[Path, str], checksum: str) -> Optional[DAT_DATA]:
+        """Return the data for template_file as template_reader() would, or None if not cached."""
+        file_data = self.lookup(template_file, checksum)
+        if file_data is None:
+            self.misses.append(template_file)
+            logger.info(f"Cache miss: {Path(template_file).name} will be parsed.")
+        return file_data
+
+    def lookup(
+        self, template_file: Union[Path, str], checksum: str
+    ) -> Optional[DAT_DATA]:
+        """As get(), but a file not in the cache is not counted as a miss."""
+        row = self._conn.execute(
+            "SELECT data FROM extractions WHERE checksum = ? AND version = ?",
+            (checksum, self.version),
+        ).fetchone()
+        if row is None:
+            return None
+        self.hits += 1
+        self._touched[(checksum, self.version)] = time.time()
+        if len(self._touched) >= TOUCH_BATCH_SIZE:
+            with self._conn:
+                self._write_touched()
+        return {Path(template_file).name: _relocate(json.loads(row[0]), template_file)}
+
+    def put(
+        self,
+        file_data: DAT_DATA,
+        signatures: Optional[Dict[str, Dict[str, str]]] = None,
+    ) -> None:
+        """Store the result of template_reader() for one or more files.
+
+        signatures may map the checksum of a file to the signatures of its
+        worksheets, as returned by sheet_signatures().
+        """
+        if self._size is None:
+            self._size = self.size
+        with self._conn:
+            self._write_touched()
+            for inner in file_data.values():
+                data = json.dumps(inner)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO extractions VALUES (?, ?, ?, ?, ?)",
+                    (
+                        inner["checksum"],
+                        self.version,
+                        data,
+                        len(data),
+                        time.time(),
+                    ),
+                )
+                # an entry replaced is counted twice, until the size is next summed
+                self._size += len(data)
+                self._conn.execute(
+                    "DELETE FROM claims WHERE checksum = ? AND version = ?",
+                    (inner["checksum"], self.version),
+                )
+                if signatures and inner["checksum"] in signatures:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO sheets VALUES (?, ?, ?, ?)",
+                        [
+                            (inner["checksum"], self.version, title, signature)
+                            for title, signature in signatures[
+                                inner["checksum"]  # type: ignore
+                            ].items()
+                        ],
+                    )
+        if self._size > self.max_size:
+            self.evict()
+
+    def reusable_sheets(
+        self, template_file: Union[Path, str], signatures: Dict[str, str]
+    ) -> Dict[str, Dict[str, Dict[str, str]]]:
+        """Return the cached data for each worksheet with one of signatures, keyed by title.
+
+        The data is as template_reader() would extract for the worksheet in
+        template_file, and can be passed to it as reuse.
+        """
+        sources: Dict[str, Dict[str, str]] = {}
+        for title, signature in signatures.items():
+            row = self._conn.execute(
+                "SELECT checksum, title FROM sheets WHERE signature = ? AND version = ? LIMIT 1",
+                (signature, self.version),
+            ).fetchone()
+            if row is not None:
+                sources.setdefault(row[0], {})[title] = row[1]
+        reuse = {}
+        for checksum, titles in sources.items():
+            row = self._conn.execute(
+                "SELECT data FROM extractions WHERE checksum = ? AND version = ?",
+                (checksum, self.version),
+            ).fetchone()
+            if row is None:
+                continue
+            cached = _relocate(json.loads(row[0]), template_file)
+            for title, cached_title in titles.items():
+                sheet = cached["data"].get(cached_title)  # type: ignore
+                if sheet is not None:
+                    reuse[title] = {
+                        cellref: dict(cell, sheet_name=title)
+                        for cellref, cell in sheet.items()
+                    }
+        return reuse
+
+    def _write_touched(self) -> None:
+        """Record when the entries looked up since last called were used.
+
+        Must be called within a transaction.
+        """
+        self._conn.executemany(
+            "UPDATE extractions SET last_used = ? WHERE checksum = ? AND version = ?",
+            [
+                (used, checksum, version)
+                for (checksum, version), used in self._touched.items()
+            ],
+        )
+        self._touched.clear()
+
+    def evict(self) -> None:
+        """Remove the least recently used entries if the cache is bigger than max_size.
+
+        Entries are removed until the cache is within EVICTION_TARGET of max_size.
+        """
+        with self._conn:
+            self._write_touched()
+            self._size = self.size
+            if self._size <= self.max_size:
+                return
+            excess = self._size - int(self.max_size * EVICTION_TARGET)
+            rows = self._conn.execute(
+                "SELECT checksum, version, size FROM extractions ORDER BY last_used"
+            )
+            doomed = []
+            for checksum, version, size in rows:
+                if excess <= 0:
+                    break
+                doomed.append((checksum, version))
+                excess -= size
+                self._size -= size
+            self._conn.executemany(
+                "DELETE FROM extractions WHERE checksum = ? AND version = ?", doomed
+            )
+            self._conn.execute(
+                "DELETE FROM validations WHERE checksum NOT IN "
+                "(SELECT checksum FROM extractions)"
+            )
+            self._conn.execute(
+                "DELETE FROM sheets WHERE (checksum, version) NOT IN "
+                "(SELECT checksum, version FROM extractions)"
+            )
+        logger.info(f"Removed {len(doomed)} entries from extraction cache {self.path}.")
+
+    def claim(self, checksum: str) -> bool:
+        """Claim the right to extract the file with checksum, returning True if granted.
+
+        The claim is refused if the file is already in the cache, or another run
+        holds an unexpired claim on it. A claim is released when the file's data is
+        put() in the cache, or by release_claims().
+        """
+        now = time.time()
+        with self._conn:
+            if self._conn.execute(
+                "SELECT 1 FROM extractions WHERE checksum = ? AND version = ?",
+                (checksum, self.version),
+            ).fetchone():
+                return False
+            row = self._conn.execute(
+                "SELECT owner, expires FROM claims WHERE checksum = ? AND version = ?",
+                (checksum, self.version),
+            ).fetchone()
+            if row is not None and row[0] != self.owner and row[1] > now:
+                return False
+            self._conn.execute(
+                "INSERT OR REPLACE INTO claims VALUES (?, ?, ?, ?)",
+                (checksum, self.version, self.owner, now + CLAIM_TIMEOUT),
+            )
+        return True
+
+    def release_claims(self) -> None:
+        """Release every claim held by this cache object."""
+        with self._conn:
+            self._conn.execute("DELETE FROM claims WHERE owner = ?", (self.owner,))
+
+    def get_validation(self, checksum: str, key: str) -> Optional[List]:
+        """Return the validation checks stored for a file and validation key, or None."""
+        row = self._conn.execute(
+            "SELECT data FROM validations WHERE checksum = ? AND key = ?",
+            (checksum, key),
+        ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put_validation(self, checksum: str, key: str, checks: List) -> None:
+        """Store the validation checks for a file, as made by validation_checker()."""
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO validations VALUES (?, ?, ?)",
+                (checksum, key, json.dumps(checks)),
+            )
+
+    def import_data_file(self, data_file: Union[Path, str]) -> int:
+        """Add the entries in a JSON data file, such as extracted_data.dat, to the cache.
+
+        Returns the number of files imported.
+        """
+        with open(data_file, encoding="utf-8") as f:
+            data: DAT_DATA = json.load(f)
+        self.put(data)
+        return len(data)
+
+    def clear(self) -> None:
+        """Remove every entry from the cache."""
+        with self._conn:
+            self._conn.execute("DELETE FROM extractions")
+            self._conn.execute("DELETE FROM claims")
+            self._conn.execute("DELETE FROM sheets")
+            self._conn.execute("DELETE FROM validations")
+        self._touched.clear()
+        self._size = 0
+
+    def close(self) -> None:
+        if self._touched:
+            with self._conn:
+                self._write_touched()
+        self._conn.close()
+
+
+def import_legacy_data_file() -> None:
+    """Move data from extracted_data.dat in the library data directory into the cache.
+
+    The data file is renamed once imported, so it is only read once.
+    """
+    data_file = os.path.join(Config.DATAMAPS_LIBRARY_DATA_DIR, "extracted_data.dat")
+    if not os.path.isfile(data_file):
+        return
+    cache = ExtractionCache()
+    try:
+        count = cache.import_data_file(data_file)
+    finally:
+        cache.close()
+    os.replace(data_file, f"{data_file}.imported")
+    logger.info(f"Imported {count} files from {data_file} into extraction cache.")
@@ -1,31 +1,177 @@
+import hashlib
 import json
+import logging
+import os
+import re
 from pathlib import Path
-from typing import Dict, List, Union
+from typing import Dict, List, Optional, Union
 
-from engine.utils.extraction import datamap_check, datamap_reader
+from engine.config import Config
+from engine.utils import extraction
+from engine.utils.extraction import read_datamap
+from engine.utils.locking import atomic_write
 
-from ..domain.datamap import DatamapLine
-from ..exceptions import DatamapNotCSVException
+from ..domain.datamap import CompiledDatamap, DatamapLine, KeyFilter
+from ..exceptions import DatamapNotCSVException, NoKeysSelectedError
 from ..serializers.datamap import DatamapEncoder
 
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s: %(levelname)s - %(message)s",
+    datefmt="%d-%b-%y %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+# increment when CompiledDatamap or read_datamap() change
+COMPILED_DATAMAP_VERSION = 3
+# most compiled datamaps kept on disk; beyond it, the least recently used are removed
+COMPILED_DATAMAP_LIMIT = 64
+
+# compiled datamap files of any version, but not those still being written
+_COMPILED_NAME = re.compile(r"^[0-9a-f]{32}\.v(\d+)\.(json|pickle)$")
+
+_COMPILED: Dict[str, CompiledDatamap] = {}
+
+
+def _compiled_path(source_hash: str) -> Path:
+    return (
+        Path(Config.DATAMAPS_LIBRARY_DATA_DIR)
+        / "datamaps"
+        / f"{source_hash}.v{COMPILED_DATAMAP_VERSION}.json"
+    )
+
+
+def _prune_compiled(directory: Path) -> None:
+    """Remove compiled datamaps of earlier versions, and all but the most recently used."""
+    current = []
+    for entry in os.scandir(directory):
+        match = _COMPILED_NAME.match(entry.name)
+        if match is None:
+            continue
+        if int(match.group(1)) == COMPILED_DATAMAP_VERSION and match.group(2) == "json":
+            try:
+                current.append((entry.stat().st_mtime_ns, entry.path))
+            except FileNotFoundError:
+                pass
+        else:
+            _remove_compiled(entry.path)
+    current.sort(reverse=True)
+    for _, path in current[COMPILED_DATAMAP_LIMIT:]:
+        _remove_compiled(path)
+
+
+def _remove_compiled(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        # removed by another run
+        pass
+
+
+def _compile(datamap_path: Union[Path, str], source_hash: str) -> CompiledDatamap:
+    skipped: List[str] = []
+    headers, lines = read_datamap(datamap_path, skipped=skipped)
+    return CompiledDatamap(
+        str(datamap_path), source_hash, headers, list(lines), skipped
+    )
+
+
+def compile_datamap(datamap_path: Union[Path, str]) -> CompiledDatamap:
+    """Read, check and index the datamap at datamap_path.
+
+    The result is kept in memory and on disk, as JSON, keyed by a hash of the
+    datamap's path and contents, so a datamap is only read from its csv file once
+    for as long as it is unchanged. Only the COMPILED_DATAMAP_LIMIT most recently
+    used are kept on disk. Raises the same exceptions as read_datamap().
+    """
+    try:
+        with open(datamap_path, "rb") as datamap_file:
+            contents = datamap_file.read()
+    except OSError:
+        # let read_datamap() raise the usual exception
+        return _compile(datamap_path, "")
+    source_hash = hashlib.md5(
+        os.path.abspath(datamap_path).encode("utf-8") + b"\0" + contents
+    ).hexdigest()
+    compiled = _COMPILED.get(source_hash)
+    if compiled is not None:
+        _report_checked(compiled)
+        return compiled
+    compiled_path = _compiled_path(source_hash)
+    try:
+        with open(compiled_path, encoding="utf-8") as compiled_file:
+            compiled = CompiledDatamap.from_dict(json.load(compiled_file))
+    except FileNotFoundError:
+        compiled = None
+    except (ValueError, TypeError, KeyError, AttributeError):
+        # an unreadable file is no worse than a missing one
+        logger.warning(f"Ignoring unreadable compiled datamap {compiled_path}.")
+        compiled = None
+    if compiled is None:
+        compiled = _compile(datamap_path, source_hash)
+        with atomic_write(compiled_path) as compiled_file:
+            json.dump(compiled.to_dict(), compiled_file)
+        _prune_compiled(compiled_path.parent)
+    else:
+        _report_checked(compiled)
+        try:
+            # mark it as recently used
+            os.utime(compiled_path)
+        except OSError:
+            pass
+    _COMPILED[source_hash] = compiled
+    return compiled
+
+
+def _report_checked(compiled: CompiledDatamap) -> None:
+    "Report a datamap taken from the cache as read_datamap() does when it reads one."
+    if extraction.ECHO_FUNC_YELLOW is not None:
+        extraction.ECHO_FUNC_YELLOW(
+            "Checking datamap file {}\n".format(compiled.source)
+        )
+    if extraction.ECHO_FUNC_GREEN is not None:
+        extraction.ECHO_FUNC_GREEN("{} checked ok\n".format(compiled.source))
+    for msg in compiled.warnings:
+        logger.warning(msg)
+
 
 class InMemorySingleDatamapRepository:
-    def __init__(self, datamap_path: Union[Path, str]) -> None:
+    """A datamap read from a single csv file.
+
+    The file is compiled once (see compile_datamap()), so a repository can be shared
+    by any number of use cases without the datamap being read again.
+
+    If a KeyFilter is given, the repository holds only the lines for the keys it
+    selects. Raises NoKeysSelectedError if it selects none.
+    """
+
+    def __init__(
+        self, datamap_path: Union[Path, str], key_filter: Optional[KeyFilter] = None
+    ) -> None:
         self.datamap_path = datamap_path
-        self.headers = datamap_check(datamap_path)
-        if self.headers["type"] is not None:
-            self.is_typed = True
-        else:
-            self.is_typed = False
+        self.compiled = compile_datamap(datamap_path)
+        if key_filter is not None:
+            self.compiled = self.compiled.select(key_filter)
+            if not self.compiled.lines:
+                raise NoKeysSelectedError(
+                    f"No keys in {datamap_path} match {key_filter}."
+                )
+            logger.info(
+                f"Using {len(self.compiled.lines)} lines of {datamap_path} "
+                f"with keys matching {key_filter}."
+            )
+        self.headers = self.compiled.headers
+        self.is_typed = self.compiled.is_typed
 
     def list_as_json(self) -> str:
         """Return list of DatamapLine objects parsed from filepath as json."""
         try:
-            lst_of_objs = datamap_reader(self.datamap_path)
+            lst_of_objs = self.list_as_objs()
         except DatamapNotCSVException:
             raise
         return json.dumps(lst_of_objs, cls=DatamapEncoder)
 
     def list_as_objs(self) -> List[DatamapLine]:
         """Return list of DatamapLine objects parsed from filepath."""
-        return datamap_reader(self.datamap_path)
+        # a copy, as the compiled datamap is shared by every repository using it
+        return list(self.compiled.lines)
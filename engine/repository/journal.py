@@ -0,0 +1,128 @@
+# repository/journal.py
+#
+# A run journal records the result of every template extracted during an
+# import, so that an interrupted import can be resumed without re-parsing
+# the files it had already completed. A journal is only kept for imports
+# which ask to be resumable, and is removed once their master is written.
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+from engine.config import Config
+from engine.utils.extraction import DAT_DATA
+from engine.utils.locking import locked
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s: %(levelname)s - %(message)s",
+    datefmt="%d-%b-%y %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+
+class RunJournal:
+    """Append-only record of completed template extractions for one input source.
+
+    Each line in the journal file is a JSON object holding the file name, its
+    checksum and the data returned by template_reader(). Entries are flushed
+    to disk as soon as they are recorded, so a journal survives the process
+    being killed part-way through an import. Only the position of each entry
+    in the file is held in memory; its data is read when it is asked for.
+
+    Entries left by a previous run over the same source are loaded, so that
+    it can be resumed. Several runs may share a journal; if one of them
+    removes it, the files it recorded are simply extracted again by the others.
+    """
+
+    def __init__(self, source: Union[Path, str]) -> None:
+        self.source = str(source)
+        _name = hashlib.md5(os.path.abspath(self.source).encode("utf-8")).hexdigest()
+        self.path = (
+            Path(Config.DATAMAPS_LIBRARY_DATA_DIR) / "journals" / f"{_name}.journal"
+        )
+        self._lock_path = self.path.with_suffix(".lock")
+        self._completed: Dict[Tuple[str, str], int] = {}
+        self._load()
+
+    def _load(self) -> None:
+        with locked(self._lock_path):
+            self._load_locked()
+
+    def _load_locked(self) -> None:
+        offset = 0
+        try:
+            with open(self.path, "rb") as journal_file:
+                for line in journal_file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # the last line may be incomplete if the run was killed mid-write
+                        logger.warning(f"Ignoring incomplete entry in {self.path}.")
+                        break
+                    self._completed[(entry["file_name"], entry["checksum"])] = offset
+                    offset += len(line)
+        except FileNotFoundError:
+            logger.info(f"No previous run to resume for {self.source}.")
+            return
+        # drop any incomplete entry so that new entries start on a line of their own
+        os.truncate(self.path, offset)
+        logger.info(
+            f"Resuming import of {self.source}: {len(self._completed)} files already extracted."
+        )
+
+    def __len__(self) -> int:
+        return len(self._completed)
+
+    def completed(
+        self, file_path: Union[Path, str], checksum: str
+    ) -> Optional[DAT_DATA]:
+        """Return the recorded extraction for file_path, or None if it must be extracted.
+
+        A recorded entry is only returned if the file's checksum is unchanged.
+        """
+        file_name = Path(file_path).name
+        offset = self._completed.get((file_name, checksum))
+        if offset is None:
+            return None
+        try:
+            with open(self.path, "rb") as journal_file:
+                journal_file.seek(offset)
+                entry = json.loads(journal_file.readline())
+        except (FileNotFoundError, ValueError):
+            # removed, and perhaps started again, by another run
+            return None
+        if (entry.get("file_name"), entry.get("checksum")) != (file_name, checksum):
+            return None
+        return entry["data"]
+
+    def record(self, file_data: DAT_DATA) -> None:
+        """Record the result of template_reader() for a single file."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        for file_name, inner in file_data.items():
+            checksum = inner["checksum"]  # type: ignore
+            entry = json.dumps(
+                {
+                    "file_name": file_name,
+                    "checksum": checksum,
+                    "data": {file_name: inner},
+                }
+            )
+            # other runs over the same source may be appending at the same time
+            with locked(self._lock_path):
+                with open(self.path, "a", encoding="utf-8") as journal_file:
+                    journal_file.write(entry + "\n")
+                    journal_file.flush()
+                    os.fsync(journal_file.fileno())
+
+    def remove(self) -> None:
+        """Discard the journal and everything recorded in it, once it is no longer needed."""
+        self._completed = {}
+        with locked(self._lock_path):
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,122 @@
+# repository/manifest.py
+#
+# A manifest of the files in an input directory, recording the size,
+# modification time, change time, inode and checksum of each. A file is only
+# hashed again when one of these changes, so finding the changes in a large
+# input directory costs one stat() per file. The change time is included as,
+# unlike the modification time, it cannot be set back by copying a file over
+# another with its times preserved (cp -p, shutil.copy2). The templates in a
+# zip file are recorded by name, against the stat of the zip file itself.
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Tuple, Union
+
+from engine.config import Config
+from engine.utils.extraction import _hash_files
+from engine.utils.locking import atomic_write
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s: %(levelname)s - %(message)s",
+    datefmt="%d-%b-%y %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+
+class ManifestEntry(NamedTuple):
+    size: int
+    mtime_ns: int
+    ctime_ns: int
+    inode: int
+    checksum: str
+
+
+class InputManifest:
+    """Record of the files last seen in an input source, and their checksums.
+
+    After scan(), changed lists the files which are new or have changed since
+    the previous scan, and removed lists the paths of files no longer present.
+    """
+
+    def __init__(self, source: Union[Path, str]) -> None:
+        self.source = str(source)
+        _name = hashlib.md5(os.path.abspath(self.source).encode("utf-8")).hexdigest()
+        self.path = (
+            Path(Config.DATAMAPS_LIBRARY_DATA_DIR) / "manifests" / f"{_name}.json"
+        )
+        self.entries: Dict[str, ManifestEntry] = {}
+        self.changed: List[Path] = []
+        self.removed: List[str] = []
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, encoding="utf-8") as manifest_file:
+                self.entries = {
+                    path: ManifestEntry(*entry)
+                    for path, entry in json.load(manifest_file).items()
+                }
+        except FileNotFoundError:
+            pass
+        except (ValueError, TypeError):
+            logger.warning(f"Ignoring unreadable manifest {self.path}.")
+
+    def save(self) -> None:
+        with atomic_write(self.path) as manifest_file:
+            json.dump(
+                {path: list(entry) for path, entry in self.entries.items()},
+                manifest_file,
+            )
+
+    def scan(self, files: List[Path]) -> Dict[Path, str]:
+        """Return the checksum of each of files, hashing only those which have changed.
+
+        The manifest is updated to hold exactly files, and saved.
+        """
+        stats = {}
+        for f in files:
+            st = os.stat(f)
+            stats[f] = (st.st_size, st.st_mtime_ns, st.st_ctime_ns, st.st_ino)
+        return self._update({f: str(f) for f in files}, stats)
+
+    def scan_archive(self, files: List[Path]) -> Dict[Path, str]:
+        """As scan(), for files unpacked from the zip file which is the manifest's source.
+
+        The files are unpacked afresh on each run, so their own paths and times are
+        of no use. Each is recorded by its name in the archive, with the size, times
+        and inode of the archive, so that none is hashed again until it changes.
+        """
+        st = os.stat(self.source)
+        stat = (st.st_size, st.st_mtime_ns, st.st_ctime_ns, st.st_ino)
+        return self._update({f: Path(f).name for f in files}, {f: stat for f in files})
+
+    def _update(
+        self, keys: Dict[Path, str], stats: Dict[Path, Tuple[int, int, int, int]]
+    ) -> Dict[Path, str]:
+        """Return the checksum of each file in keys, stored under its key, and save the manifest."""
+        self.changed = []
+        checksums: Dict[Path, str] = {}
+        for f, stat in stats.items():
+            previous = self.entries.get(keys[f])
+            if previous is not None and tuple(previous[:4]) == stat:
+                checksums[f] = previous.checksum
+            else:
+                self.changed.append(f)
+        checksums.update(_hash_files(self.changed))
+        current = set(keys.values())
+        self.removed = [path for path in self.entries if path not in current]
+        self.entries = {
+            key: ManifestEntry(*stats[f], checksums[f])  # type: ignore
+            for f, key in keys.items()
+        }
+        self.save()
+        if self.changed or self.removed:
+            logger.info(
+                f"{len(self.changed)} new or changed and {len(self.removed)} removed "
+                f"files in {self.source}."
+            )
+        return checksums
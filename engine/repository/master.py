@@ -1,10 +1,18 @@
 # repository/master.py
+import hashlib
+import json
 import logging
 from pathlib import Path
+from typing import Any, Dict, List
 
 from openpyxl import Workbook
 
 from engine.config import Config
+from engine.domain.datamap import DatamapLine
+from engine.domain.master import MasterData
+from engine.repository.cache import extraction_version
+from engine.serializers.datamap import DatamapEncoder
+from engine.utils.locking import atomic_write
 
 logging.basicConfig(
     level=logging.INFO,
@@ -13,6 +21,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# increment when the format of the columns stored by MasterColumnsSidecar changes
+MASTER_COLUMNS_VERSION = 2
+
 
 class ValidationOnlyRepository:
     def __init__(self, data, output_file_name=None):
@@ -24,7 +35,9 @@ class ValidationOnlyRepository:
 
 
 class MasterOutputRepository:
-    def __init__(self, data, output_file_name):
+    """Write a master from a MasterData: the keys in column A, then a column per template."""
+
+    def __init__(self, data: MasterData, output_file_name):
         self.data = data
         self.output_filename = output_file_name
 
@@ -33,23 +46,88 @@ class MasterOutputRepository:
             "return reference name"
         ]
         output_path = Path(Config.PLATFORM_DOCS_DIR) / "output"
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Master"
-        ws["A1"].value = _master_return_reference
-        _keys = [x[0] for x in list(self.data[0].values())[0]]
-        # col A
-        for i, k in enumerate(_keys, start=2):
-            ws.cell(column=1, row=i, value=k)
-        # other cols
-        for counter, file_data in enumerate(self.data, start=2):
-            ws.cell(
-                column=counter, row=1, value=list(file_data.keys())[0].split(".")[0]
-            )
-            _key_value_lst = list(file_data.values())[0]
-            for idx, tup in enumerate(_key_value_lst, start=2):
-                ws.cell(column=counter, row=idx, value=tup[1])
-        wb.save(output_path / self.output_filename)
+        # a write-only workbook is streamed a row at a time, rather than built cell by cell
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Master")
+        ws.append(
+            [_master_return_reference]
+            + [file_name.split(".")[0] for file_name in self.data.columns]
+        )
+        for row in self.data.rows():
+            ws.append(row)
+        # readers of the master, such as a previous version open in Excel, never see it half written
+        with atomic_write(output_path / self.output_filename, "wb") as master_file:
+            wb.save(master_file)
         logger.info(
             "{} successfully created in {}\n".format(self.output_filename, output_path)
         )
+
+
+class MasterColumnsSidecar:
+    """The column data of a master, kept in a file alongside it.
+
+    Each column is stored with the checksum of the template it came from, and the
+    whole file with a hash of the datamap used. When the master is next created,
+    columns for templates which are unchanged, under the same datamap, can be
+    reused rather than calculated again. Columns are stored as values only, in
+    the order of the datamap's keys.
+    """
+
+    def __init__(self, output_file_name) -> None:
+        output_path = Path(Config.PLATFORM_DOCS_DIR) / "output" / output_file_name
+        self.path = output_path.with_name(f".{output_path.name}.columns.json")
+        self._pending: Dict = {}
+
+    @staticmethod
+    def datamap_hash(datamap_data: List[DatamapLine]) -> str:
+        "Identify the datamap, and the extraction options, used to create the columns."
+        return hashlib.md5(
+            json.dumps(
+                [extraction_version(), datamap_data], sort_keys=True, cls=DatamapEncoder
+            ).encode("utf-8")
+        ).hexdigest()
+
+    def reusable_columns(
+        self, datamap_data: List[DatamapLine], checksums: Dict[str, str]
+    ) -> Dict[str, List[Any]]:
+        """Return the stored column for each file in checksums whose checksum is unchanged."""
+        try:
+            with open(self.path, encoding="utf-8") as sidecar:
+                stored = json.load(sidecar)
+        except (FileNotFoundError, ValueError):
+            return {}
+        if stored.get("version") != MASTER_COLUMNS_VERSION:
+            return {}
+        if stored.get("datamap") != self.datamap_hash(datamap_data):
+            logger.info(
+                "Datamap has changed since master was last created. "
+                "Applying it to all templates."
+            )
+            return {}
+        return {
+            file_name: column["values"]
+            for file_name, column in stored["columns"].items()
+            if checksums.get(file_name) == column["checksum"]
+        }
+
+    def update(
+        self,
+        datamap_data: List[DatamapLine],
+        checksums: Dict[str, str],
+        data_for_master: MasterData,
+    ) -> None:
+        """Set the columns to be stored by save()."""
+        columns = {
+            file_name: {"checksum": checksums[file_name], "values": values}
+            for file_name, values in data_for_master.columns.items()
+        }
+        self._pending = {
+            "version": MASTER_COLUMNS_VERSION,
+            "datamap": self.datamap_hash(datamap_data),
+            "columns": columns,
+        }
+
+    def save(self) -> None:
+        """Write the columns set by update(), replacing those stored before."""
+        with atomic_write(self.path) as sidecar:
+            json.dump(self._pending, sidecar)
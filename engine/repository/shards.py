@@ -0,0 +1,126 @@
+# repository/shards.py
+#
+# Out-of-core storage for extracted template data. Rather than returning the
+# data for each template to the parent process, workers write it to a shard
+# file in a scratch directory. The parent is given a mapping which reads each
+# shard only when it is asked for, so at most one file's data is held in
+# memory at any time.
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import weakref
+from collections.abc import MutableMapping
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple, Union
+
+from engine.utils.extraction import CELL_FILTER, DAT_DATA, FILE_DATA, template_reader
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s: %(levelname)s - %(message)s",
+    datefmt="%d-%b-%y %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+
+def write_shard(file_data: DAT_DATA, shard_dir: Union[Path, str]) -> Tuple[str, str]:
+    """Write the data for a single file to a shard in shard_dir.
+
+    Returns the file name and the path of the shard.
+    """
+    file_name = list(file_data.keys())[0]
+    fd, shard_path = tempfile.mkstemp(suffix=".json", dir=shard_dir)
+    with os.fdopen(fd, "w", encoding="utf-8") as shard:
+        json.dump(file_data[file_name], shard)
+    return file_name, shard_path
+
+
+def template_reader_to_shard(
+    template_file: Union[Path, str],
+    shard_dir: Union[Path, str],
+    reuse: Optional[Dict[str, Dict[str, Dict[str, str]]]] = None,
+    cells: Optional[CELL_FILTER] = None,
+) -> Tuple[str, str]:
+    """Extract data from template_file to a shard in shard_dir, in a worker process.
+
+    Returns the file name and the path of the shard, rather than the data. reuse
+    and cells are as for template_reader().
+    """
+    return write_shard(template_reader(template_file, reuse, cells), shard_dir)
+
+
+class _ShardStore:
+    """Owns a scratch directory of shards, removing it when no longer referenced."""
+
+    def __init__(self, scratch_dir: Optional[Union[Path, str]] = None) -> None:
+        self.path = tempfile.mkdtemp(prefix="datamaps-shards-", dir=scratch_dir)
+        self._finalizer = weakref.finalize(
+            self, shutil.rmtree, self.path, ignore_errors=True
+        )
+
+    def cleanup(self) -> None:
+        self._finalizer()
+
+
+class ShardedTemplateData(MutableMapping):
+    """A mapping of file name to extracted file data, read from shards on demand.
+
+    Behaves like the dictionary returned by extract_from_multiple_xlsx_files(). The
+    most recently read file is kept, so repeated lookups in the same file are cheap.
+    Removing a file from the mapping does not delete its shard, so copies made with
+    copy() are unaffected. The shards are deleted when the mapping and all its
+    copies have gone.
+    """
+
+    def __init__(self, store: Optional[_ShardStore] = None) -> None:
+        self.store = store if store is not None else _ShardStore()
+        self._index: Dict[str, str] = {}
+        self._last: Optional[Tuple[str, FILE_DATA]] = None
+
+    @property
+    def shard_dir(self) -> str:
+        return self.store.path
+
+    def add_shard(self, file_name: str, shard_path: str) -> None:
+        self._index[file_name] = shard_path
+
+    def __getitem__(self, file_name: str) -> FILE_DATA:
+        if self._last is not None and self._last[0] == file_name:
+            return self._last[1]
+        with open(self._index[file_name], encoding="utf-8") as shard:
+            data = json.load(shard)
+        self._last = (file_name, data)
+        return data
+
+    def __setitem__(self, file_name: str, file_data: FILE_DATA) -> None:
+        _, shard_path = write_shard({file_name: file_data}, self.shard_dir)
+        self._index[file_name] = shard_path
+        self._last = None
+
+    def __delitem__(self, file_name: str) -> None:
+        del self._index[file_name]
+        if self._last is not None and self._last[0] == file_name:
+            self._last = None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._index))
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, file_name: object) -> bool:
+        return file_name in self._index
+
+    def copy(self) -> "ShardedTemplateData":
+        other = ShardedTemplateData(self.store)
+        other._index = dict(self._index)
+        return other
+
+    def cleanup(self) -> None:
+        """Delete the shards now, rather than waiting for the mapping to go."""
+        self._index = {}
+        self._last = None
+        self.store.cleanup()
@@ -0,0 +1,108 @@
+# repository/structure.py
+#
+# The structure of a blank template - its sheets, and the dimensions, merged
+# cells and data validations of each - read once and kept, as JSON, keyed by a
+# hash of the template, so that datamaps can be checked against it without
+# opening the template again.
+
+import json
+import logging
+import warnings
+from pathlib import Path
+from typing import Dict, List, Union
+
+from openpyxl import load_workbook
+
+from engine.config import Config
+from engine.utils.extraction import _hash_single_file
+from engine.utils.locking import atomic_write
+
+from ..domain.datamap import DatamapLine
+from ..domain.template import SheetStructure, TemplateStructure
+
+warnings.filterwarnings("ignore", ".*Conditional Formatting*.")
+warnings.filterwarnings("ignore", ".*Data Validation extension*.")
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s: %(levelname)s - %(message)s",
+    datefmt="%d-%b-%y %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+# increment when TemplateStructure or _read_structure() change
+TEMPLATE_STRUCTURE_VERSION = 2
+
+_STRUCTURES: Dict[str, TemplateStructure] = {}
+
+
+def _structure_path(checksum: str) -> Path:
+    return (
+        Path(Config.DATAMAPS_LIBRARY_DATA_DIR)
+        / "templates"
+        / f"{checksum}.v{TEMPLATE_STRUCTURE_VERSION}.json"
+    )
+
+
+def _read_structure(
+    template_path: Union[Path, str], checksum: str
+) -> TemplateStructure:
+    logger.info(f"Reading structure of {template_path}.")
+    workbook = load_workbook(template_path, keep_vba=False)
+    sheets = {}
+    for ws in workbook.worksheets:
+        sheets[ws.title] = SheetStructure(
+            ws.dimensions,
+            [str(merged) for merged in ws.merged_cells.ranges],
+            [
+                (dv.type or "any", str(dv.sqref))
+                for dv in ws.data_validations.dataValidation
+            ],
+        )
+    return TemplateStructure(str(template_path), checksum, sheets)
+
+
+def template_structure(template_path: Union[Path, str]) -> TemplateStructure:
+    """Return the structure of the blank template at template_path.
+
+    The structure is kept in memory and on disk, keyed by a hash of the template's
+    contents, so a template is only opened once for as long as it is unchanged.
+    Raises FileNotFoundError if there is no file at template_path.
+    """
+    checksum = _hash_single_file(Path(template_path))
+    structure = _STRUCTURES.get(checksum)
+    if structure is not None:
+        return structure
+    structure_path = _structure_path(checksum)
+    try:
+        with open(structure_path, encoding="utf-8") as structure_file:
+            structure = TemplateStructure.from_dict(json.load(structure_file))
+    except FileNotFoundError:
+        structure = None
+    except (ValueError, TypeError, KeyError, AttributeError):
+        # an unreadable file is no worse than a missing one
+        logger.warning(f"Ignoring unreadable template structure {structure_path}.")
+        structure = None
+    if structure is None:
+        structure = _read_structure(template_path, checksum)
+        with atomic_write(structure_path) as structure_file:
+            json.dump(structure.to_dict(), structure_file)
+    _STRUCTURES[checksum] = structure
+    return structure
+
+
+def check_datamap_against_template(
+    template_path: Union[Path, str], lines: List[DatamapLine]
+) -> bool:
+    """Check the datamap lines against the blank template at template_path, logging each problem.
+
+    Returns False if any line has a fatal problem - one which would stop a value
+    being written to the template.
+    """
+    problems = template_structure(template_path).check_datamap(lines)
+    for problem in problems:
+        if problem.fatal:
+            logger.critical(f"Datamap key {problem.key}: {problem.message}")
+        else:
+            logger.warning(f"Datamap key {problem.key}: {problem.message}")
+    return not any(problem.fatal for problem in problems)
@@ -2,16 +2,22 @@ import json
 import logging
 import os
 import shutil
+from concurrent import futures
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
+from engine.repository.cache import ExtractionCache, import_legacy_data_file
+from engine.repository.journal import RunJournal
+from engine.repository.manifest import InputManifest
 from engine.use_cases.parsing import extract_from_multiple_xlsx_files as extract
 from engine.use_cases.typing import MASTER_COL_DATA, MASTER_DATA_FOR_FILE
 from engine.utils.extraction import (
     ALL_IMPORT_DATA,
+    CELL_FILTER,
     extract_zip_file_to_tmpdir,
     get_xlsx_files,
 )
+from engine.utils.concurrency import MemoryBudget, completed_within_budget
 from openpyxl import Workbook, load_workbook
 
 from ..config import Config
@@ -33,11 +39,12 @@ class MultipleTemplatesWriteRepo:
     which by default is in "User/Documents/bcompiler/output."
     """
 
-    def __init__(self, blank_template: Path):
+    def __init__(self, blank_template: Path, token=None):
         """directory_path is the directory in which to write the files."""
         self.output_path = Config.PLATFORM_DOCS_DIR / "output"
         self.blank_template = blank_template
-        self.unsaved_workbooks: List[Tuple[str, Workbook]] = []
+        self.token = token
+        self.saved_files: List[Path] = []
 
     def _populate_workbook(
         self, workbook: Workbook, file_data: MASTER_COL_DATA
@@ -70,87 +77,254 @@ class MultipleTemplatesWriteRepo:
 
         data: list of ColData tuples, which contains the key, sheet and value
         file_name: file name to be appended to output path
+
+        Each workbook is saved as soon as it is populated. If the repository's
+        CancellationToken is cancelled, no further workbooks are started.
+
+        If Config.MAX_MEMORY is set, workbooks are written in parallel, as many at
+        a time as fit within it.
         """
 
         logger.info(
             "Preparing to populate blank templates - this can take a few minutes depending on size of master."
         )
+        if Config.MAX_MEMORY:
+            self._write_within_budget(data)
+            return
         for file_data in data:
-            try:
-                blank_workbook: Workbook = load_workbook(
-                    self.blank_template, read_only=False, keep_vba=True
+            if self.token is not None and self.token.cancelled:
+                self.token.stop(
+                    f"Writing templates stopped after {len(self.saved_files)} of {len(data)} files.",
+                    partial=self.saved_files,
                 )
-            except FileNotFoundError as e:
-                raise FileNotFoundError(
-                    f"Cannot find file {e.filename}. Do you have "
-                    "file set correctly in config file, or is file missing?"
-                )
-            file_name = file_data[0].file_name
-            logger.info("Populating {}".format(file_name))
-            _wb = self._populate_workbook(blank_workbook, file_data)
-            output_file_name: str = ".".join([file_name, "xlsm"])
-            self.unsaved_workbooks.append((output_file_name, _wb))
-        self._write_each_workbook()
+                break
+            self.write_file(file_data)
+
+    def write_file(self, file_data: MASTER_COL_DATA) -> Path:
+        """Populate a single blank template with file_data and save it. Returns its path."""
+        try:
+            blank_workbook: Workbook = load_workbook(
+                self.blank_template, read_only=False, keep_vba=True
+            )
+        except FileNotFoundError as e:
+            raise FileNotFoundError(
+                f"Cannot find file {e.filename}. Do you have "
+                "file set correctly in config file, or is file missing?"
+            )
+        file_name = file_data[0].file_name
+        logger.info("Populating {}".format(file_name))
+        _wb = self._populate_workbook(blank_workbook, file_data)
+        output_file_name: str = ".".join([file_name, "xlsm"])
+        self._save_workbook((output_file_name, _wb))
+        return self.saved_files[-1]
+
+    def _write_within_budget(self, data: MASTER_DATA_FOR_FILE) -> None:
+        budget = MemoryBudget(Config.MAX_MEMORY)  # type: ignore
+        calls = [
+            (
+                idx,
+                self.blank_template,
+                write_template,
+                (self.blank_template, self.output_path, file_data),
+            )
+            for idx, file_data in enumerate(data)
+        ]
+        with futures.ProcessPoolExecutor() as pool:
+            for _, path in completed_within_budget(pool, calls, budget, self.token):
+                self.saved_files.append(path)
+        if len(self.saved_files) < len(data):
+            msg = f"Writing templates stopped after {len(self.saved_files)} of {len(data)} files."
+            if self.token is not None:
+                self.token.stop(msg, partial=self.saved_files)
+            else:
+                logger.critical(msg)
 
     def _save_workbook(self, wb_t: Tuple[str, Workbook]) -> None:
+        """Save the workbook so that an interrupted save never leaves a partial file."""
         _wb = wb_t[1]
         _output_file_name = wb_t[0]
         logger.info("Saving {}".format(_output_file_name))
-        _wb.save(filename=Config.PLATFORM_DOCS_DIR / "output" / _output_file_name)
+        target = Path(self.output_path) / _output_file_name
+        tmp_target = target.with_name(f".{_output_file_name}.tmp")
+        try:
+            _wb.save(filename=tmp_target)
+            os.replace(tmp_target, target)
+        finally:
+            if tmp_target.exists():
+                tmp_target.unlink()
+        self.saved_files.append(target)
 
-    def _write_each_workbook(self) -> None:
-        for _ in map(self._save_workbook, self.unsaved_workbooks):
-            pass
+
+def write_template(
+    blank_template: Path, output_path: Path, file_data: MASTER_COL_DATA
+) -> Path:
+    """Populate blank_template with file_data and save it in output_path.
+
+    A module-level function so that it can be run in a worker process.
+    """
+    repo = MultipleTemplatesWriteRepo(blank_template)
+    repo.output_path = output_path
+    return repo.write_file(file_data)
 
 
 class FSPopulatedTemplatesRepo:
-    """A repo that is based on a single data file in the .bcompiler-engine directory."""
+    """A repo based on the persistent extraction cache in the .bcompiler-engine directory.
+
+    Data for templates in directory_path whose contents are already in the cache
+    is taken from it; only the others are extracted, and then added to it. Data
+    in an extracted_data.dat file left by earlier versions is moved into the cache.
+    """
 
     def __init__(self, directory_path: str):
         self.directory_path = directory_path
 
-    def list_as_json(self) -> str:
-        """Try to open the data file containing populated data as json."""
+    def list_as_objs(self) -> ALL_IMPORT_DATA:
+        import_legacy_data_file()
+        cache = ExtractionCache()
         try:
-            with open(
-                os.path.join(Config.DATAMAPS_LIBRARY_DATA_DIR, "extracted_data.dat")
-            ) as data_file:
-                return data_file.read()
-        except FileNotFoundError:
-            raise FileNotFoundError("Cannot find file.")
+            return extract(get_xlsx_files(Path(self.directory_path)), cache=cache)
+        finally:
+            cache.close()
+
+    def list_as_json(self) -> str:
+        """Return data from a directory of populated templates as json."""
+        return json.dumps(self.list_as_objs())
+
+
+def _extract_with_cache(
+    repo, excel_files: List[Path], token=None, completed=None, executor=None
+) -> ALL_IMPORT_DATA:
+    """Extract excel_files with the journal, cache and options of an in-memory repo.
+
+    A RunJournal is only kept if the repo is resumable; it is left in repo.journal,
+    to be removed once a master has been written from the data. token, if given,
+    is used in place of the repo's. completed and executor are as for
+    extract_from_multiple_xlsx_files().
+    """
+    journal = RunJournal(repo.directory_path) if repo.resume else None
+    repo.journal = journal
+    cache = ExtractionCache() if repo.use_cache else None
+    checksums = None
+    if cache is not None or repo.resume:
+        manifest = InputManifest(repo.directory_path)
+        if isinstance(repo, InMemoryPopulatedTemplatesZip):
+            checksums = manifest.scan_archive(excel_files)
+        else:
+            checksums = manifest.scan(excel_files)
+    try:
+        return extract(
+            excel_files,
+            journal=journal,
+            token=token if token is not None else repo.token,
+            out_of_core=repo.out_of_core,
+            cache=cache,
+            checksums=checksums,
+            cells=repo.cells,
+            completed=completed,
+            executor=executor,
+        )
+    finally:
+        if cache is not None:
+            repo.cache_hits = cache.hits
+            repo.cache_misses = cache.misses
+            cache.close()
 
 
 class InMemoryPopulatedTemplatesRepository:
-    """A repo that does no data file reading or writing - just parsing from excel files."""
+    """A repo of the templates in a directory, parsed from the excel files.
+
+    The repo reads and writes files in the data directory as well as reading
+    the templates. If use_cache is True (the default), templates whose contents
+    are in the persistent ExtractionCache are not extracted again, and those
+    parsed are added to it; an InputManifest of the directory is kept, so that
+    unchanged files are not hashed again. After extraction, cache_hits is the
+    number of templates taken from the cache and cache_misses lists those parsed.
+    If resume is True, progress is checkpointed to a RunJournal as each file is
+    extracted, and files completed by a previous, interrupted run with resume are
+    not extracted again. The journal is kept in journal until it is removed, once
+    a master has been written.
+    If a CancellationToken is given, extraction stops when it is cancelled.
+    If out_of_core is True, extracted data is kept in shards on disk rather than in
+    memory (see engine.repository.shards); use list_as_objs() rather than
+    list_as_json() to benefit from this.
+    If cells is given (see datamap_cells()), only those cells are read from the
+    templates parsed.
+    """
 
-    def __init__(self, directory_path: str) -> None:
+    def __init__(
+        self,
+        directory_path: str,
+        resume: bool = False,
+        token=None,
+        out_of_core: bool = False,
+        use_cache: bool = True,
+        cells: Optional[CELL_FILTER] = None,
+    ) -> None:
         self.directory_path = directory_path
-        self.state: ALL_IMPORT_DATA = {}
+        self.resume = resume
+        self.token = token
+        self.out_of_core = out_of_core
+        self.use_cache = use_cache
+        self.cells = cells
+        self.cache_hits = 0
+        self.cache_misses: List[Path] = []
+        self.journal: Optional[RunJournal] = None
+        # None until extracted, as a directory with no templates gives {}
+        self.state: Optional[ALL_IMPORT_DATA] = None
+
+    def list_as_objs(self) -> ALL_IMPORT_DATA:
+        """Return data from a directory of populated templates."""
+        if self.state is None:
+            excel_files = get_xlsx_files(Path(self.directory_path))
+            self.state = _extract_with_cache(self, excel_files)
+        return self.state
 
     def list_as_json(self) -> str:
         """Return data from a directory of populated templates as json."""
-        excel_files = get_xlsx_files(Path(self.directory_path))
-        if not self.state:
-            self.state = extract(excel_files)
-            return json.dumps(self.state)
-        else:
-            return json.dumps(self.state)
+        return json.dumps(dict(self.list_as_objs()))
 
 
 class InMemoryPopulatedTemplatesZip:
-    def __init__(self, zip_path: str) -> None:
+    def __init__(
+        self,
+        zip_path: str,
+        resume: bool = False,
+        token=None,
+        out_of_core: bool = False,
+        use_cache: bool = True,
+        cells: Optional[CELL_FILTER] = None,
+    ) -> None:
         self.directory_path = zip_path
-        self.state: ALL_IMPORT_DATA = {}
+        self.resume = resume
+        self.token = token
+        self.out_of_core = out_of_core
+        self.use_cache = use_cache
+        self.cells = cells
+        self.cache_hits = 0
+        self.cache_misses: List[Path] = []
+        self.journal: Optional[RunJournal] = None
+        self.state: Optional[ALL_IMPORT_DATA] = None
 
-    def list_as_json(self) -> str:
-        """Return data from a zip file of populated templates as json."""
+    def template_files(self) -> Tuple[str, List[Path]]:
+        """Extract the templates to a temporary directory. Returns it and the template paths.
+
+        The caller is responsible for removing the temporary directory.
+        """
         d, excel_files = extract_zip_file_to_tmpdir(self.directory_path)
-        excel_files = excel_files[1:]
-        if not self.state:
-            self.state = extract(excel_files)
+        return d, excel_files[1:]
+
+    def list_as_objs(self) -> ALL_IMPORT_DATA:
+        """Return data from a zip file of populated templates."""
+        if self.state is not None:
+            return self.state
+        d, excel_files = self.template_files()
+        try:
+            self.state = _extract_with_cache(self, excel_files)
+        finally:
             logger.info(f"Removing temporary directory {d}.")
             shutil.rmtree(d)
-            return json.dumps(self.state)
-        else:
-            shutil.rmtree(d)
-            return json.dumps(self.state)
+        return self.state
+
+    def list_as_json(self) -> str:
+        """Return data from a zip file of populated templates as json."""
+        return json.dumps(dict(self.list_as_objs()))
@@ -0,0 +1,266 @@
+"""
+Asyncio variants of the use cases, for embedding the engine in an async application.
+
+CPU-heavy work is kept off the event loop, so that it is never blocked and one
+loop can drive many jobs at once. Templates are read and written in the process
+pool returned by shared_process_pool(), which all jobs share; extraction is
+driven from a thread by the same code as the synchronous use cases. Each use
+case has a stream() method, an async iterator which yields a result for each
+file as soon as it is ready, and an execute() method which runs the whole job.
+
+Cancelling the asyncio task running a use case cancels any files not yet started.
+A CancellationToken given to the template repository (or to
+AsyncWriteMasterToTemplates) is honoured in the same way as by the synchronous
+use cases.
+"""
+
+import asyncio
+import logging
+import shutil
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from engine.exceptions import OperationCancelledError
+from engine.repository.templates import (
+    InMemoryPopulatedTemplatesZip,
+    _extract_with_cache,
+    write_template,
+)
+from engine.use_cases.output import WriteMasterToTemplates
+from engine.use_cases.parsing import (
+    CreateMasterUseCase,
+    CreateMasterUseCaseWithValidation,
+    shared_process_pool,
+)
+from engine.utils.cancellation import CancellationToken, RunStatus, poll_interval
+from engine.utils.extraction import ALL_IMPORT_DATA, DAT_DATA, get_xlsx_files
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s: %(levelname)s - %(message)s",
+    datefmt="%d-%b-%y %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+
+async def _completed_in_pool(
+    calls: Dict[Any, Tuple], token=None, describe: str = "files"
+) -> AsyncIterator[Tuple[Any, Any]]:
+    """Run each call in the shared process pool, yielding (key, result) as each completes.
+
+    calls maps a key to a tuple of a function and its arguments.
+    """
+    loop = asyncio.get_running_loop()
+    pool = shared_process_pool()
+    tasks = {
+        asyncio.ensure_future(loop.run_in_executor(pool, *call)): key
+        for key, call in calls.items()
+    }
+    not_done = set(tasks)
+    completed = 0
+    try:
+        while not_done:
+            if token is not None and token.cancelled:
+                token.stop(f"Stopped after {completed} of {len(tasks)} {describe}.")
+                return
+            done, not_done = await asyncio.wait(
+                not_done,
+                timeout=poll_interval(token),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            for task in done:
+                completed += 1
+                yield tasks[task], task.result()
+    finally:
+        for task in not_done:
+            task.cancel()
+
+
+class _TaskToken(CancellationToken):
+    """A token cancelled by cancel(), or when the token it follows is cancelled.
+
+    Lets the asyncio task running a use case stop work started for it, whether or
+    not the repository was given a CancellationToken. Work cut short is reported
+    to the followed token, if there is one.
+    """
+
+    def __init__(self, token: Optional[CancellationToken]) -> None:
+        super().__init__()
+        self._token = token
+        if token is not None:
+            self.deadline = token.deadline
+            self.best_effort = token.best_effort
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set() or (
+            self._token is not None and self._token.cancelled
+        )
+
+    def stop(self, msg: str, partial: Any = None) -> Any:
+        if self._token is not None:
+            return self._token.stop(msg, partial)
+        return super().stop(msg, partial)
+
+
+class AsyncParsePopulatedTemplatesUseCase:
+    """Extract data from the templates in a template repository.
+
+    The templates are extracted just as by the repository's list_as_objs(), with
+    its extraction cache, journal and options, and Config.MAX_MEMORY. When
+    complete, the extracted data is stored in the repository, so that it can be
+    passed to the synchronous use cases without extracting it again.
+    """
+
+    def __init__(self, repo) -> None:
+        self.repo = repo
+
+    async def stream(self) -> AsyncIterator[DAT_DATA]:
+        """Yield the data from each template as soon as it is available."""
+        loop = asyncio.get_running_loop()
+        tmp_dir, xlsx_files = await loop.run_in_executor(None, self._template_files)
+        token = _TaskToken(getattr(self.repo, "token", None))
+        queue: asyncio.Queue = asyncio.Queue()
+
+        def _completed(idx: int, file_data: DAT_DATA) -> None:
+            loop.call_soon_threadsafe(queue.put_nowait, file_data)
+
+        def _extract() -> ALL_IMPORT_DATA:
+            try:
+                return _extract_with_cache(
+                    self.repo,
+                    xlsx_files,
+                    token=token,
+                    completed=_completed,
+                    executor=shared_process_pool(),
+                )
+            finally:
+                if tmp_dir is not None:
+                    logger.info(f"Removing temporary directory {tmp_dir}.")
+                    shutil.rmtree(tmp_dir)
+
+        extraction = loop.run_in_executor(None, _extract)
+        # the files completed are all queued before the extraction is done
+        extraction.add_done_callback(lambda _: queue.put_nowait(None))
+        try:
+            while True:
+                file_data = await queue.get()
+                if file_data is None:
+                    break
+                yield file_data
+            self.repo.state = await extraction
+        finally:
+            if not extraction.done():
+                token.cancel()
+
+    async def execute(self) -> ALL_IMPORT_DATA:
+        async for _ in self.stream():
+            pass
+        return self.repo.state
+
+    def _template_files(self) -> Tuple[Optional[str], List[Path]]:
+        if isinstance(self.repo, InMemoryPopulatedTemplatesZip):
+            return self.repo.template_files()
+        return None, get_xlsx_files(Path(self.repo.directory_path))
+
+
+class AsyncCreateMasterUseCase:
+    """Create a master document from a set of input files.
+
+    If validation is True, behaves as CreateMasterUseCaseWithValidation, and the
+    validation checks are available as final_validation_checks when complete.
+    """
+
+    def __init__(
+        self, datamap_repo, template_repo, output_repository, validation=False
+    ) -> None:
+        self.datamap_repo = datamap_repo
+        self.template_repo = template_repo
+        self.output_repository = output_repository
+        self.validation = validation
+        self.status = RunStatus.COMPLETE
+        self.final_validation_checks: List = []
+
+    async def stream(self, output_file_name: str) -> AsyncIterator[DAT_DATA]:
+        """Yield the data from each template as it is extracted, then write the master."""
+        parse_uc = AsyncParsePopulatedTemplatesUseCase(self.template_repo)
+        async for file_data in parse_uc.stream():
+            yield file_data
+        token = getattr(self.template_repo, "token", None)
+        if self.validation:
+            uc = CreateMasterUseCaseWithValidation(
+                self.datamap_repo, self.template_repo, self.output_repository, token
+            )
+        else:
+            uc = CreateMasterUseCase(
+                self.datamap_repo, self.template_repo, self.output_repository, token
+            )
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, uc.execute, output_file_name)
+        finally:
+            self.status = uc.status
+        if self.validation:
+            self.final_validation_checks = uc.final_validation_checks
+
+    async def execute(self, output_file_name: str) -> None:
+        async for _ in self.stream(output_file_name):
+            pass
+
+
+class AsyncWriteMasterToTemplates:
+    """Write data from a master to a blank template for each column in the master.
+
+    Templates are written in the shared process pool, and their paths are
+    added to output_repo.saved_files as each one is saved.
+    """
+
+    def __init__(
+        self, output_repo, datamap: Path, master: Path, blank_template: Path, token=None
+    ) -> None:
+        self.output_repo = output_repo
+        self._datamap = datamap
+        self._master = master
+        self._blank_template = blank_template
+        self.token = token
+        self.status = RunStatus.COMPLETE
+
+    async def stream(self) -> AsyncIterator[Path]:
+        """Yield the path of each template as soon as it has been written."""
+        loop = asyncio.get_running_loop()
+        uc = await loop.run_in_executor(
+            None,
+            WriteMasterToTemplates,
+            self.output_repo,
+            self._datamap,
+            self._master,
+            self._blank_template,
+            self.token,
+        )
+        master_data = await loop.run_in_executor(None, uc.read_master)
+        logger.info(
+            "Preparing to populate blank templates - this can take a few minutes depending on size of master."
+        )
+        calls = {
+            idx: (
+                write_template,
+                self._blank_template,
+                self.output_repo.output_path,
+                file_data,
+            )
+            for idx, file_data in enumerate(master_data)
+        }
+        try:
+            async for _, path in _completed_in_pool(calls, self.token, "templates"):
+                self.output_repo.saved_files.append(path)
+                yield path
+        except (OperationCancelledError, asyncio.CancelledError):
+            self.status = RunStatus.CANCELLED
+            raise
+        if self.token is not None:
+            self.status = self.token.status
+
+    async def execute(self) -> List[Path]:
+        async for _ in self.stream():
+            pass
+        return self.output_repo.saved_files
@@ -0,0 +1,204 @@
+"""
+Create masters for several projects in a single run.
+
+Each project (a BatchJob) has its own input directory, datamap and master file.
+The templates of all projects are extracted together by
+extract_from_multiple_xlsx_files(), taking files from each project in turn, so
+that no project waits for another to finish and the pool is kept busy until the
+last file is done. The extraction cache, input manifests, memory budget
+(Config.MAX_MEMORY) and, with resume, a run journal are used just as when
+creating a single master. A project's master is written as soon as all its
+templates have been extracted.
+"""
+
+import logging
+import os
+from itertools import zip_longest
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+from engine.repository.cache import ExtractionCache
+from engine.repository.datamap import InMemorySingleDatamapRepository
+from engine.repository.journal import RunJournal
+from engine.repository.manifest import InputManifest
+from engine.repository.templates import InMemoryPopulatedTemplatesRepository
+from engine.use_cases.parsing import (
+    CreateMasterUseCase,
+    CreateMasterUseCaseWithValidation,
+    extract_from_multiple_xlsx_files,
+)
+from engine.utils.cancellation import RunStatus
+from engine.utils.extraction import ALL_IMPORT_DATA, DAT_DATA, get_xlsx_files
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s: %(levelname)s - %(message)s",
+    datefmt="%d-%b-%y %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+
+class BatchJob(NamedTuple):
+    """A single project in a batch.
+
+    datamap may be a file name in inputdir, or a path elsewhere. output_file_name
+    may be a file name in the output directory, or an absolute path.
+    """
+
+    inputdir: Union[Path, str]
+    datamap: Union[Path, str]
+    output_file_name: Union[Path, str]
+
+
+class _JobState:
+    def __init__(self, job: BatchJob, dm_repo) -> None:
+        self.job = job
+        self.dm_repo = dm_repo
+        self.files = get_xlsx_files(Path(job.inputdir))
+        self.results: Dict[int, DAT_DATA] = {}
+        self.outstanding = len(self.files)
+
+    def data(self) -> ALL_IMPORT_DATA:
+        data: ALL_IMPORT_DATA = {}
+        for idx in sorted(self.results):
+            data.update(self.results[idx])  # type: ignore
+        return data
+
+
+class BatchCreateMastersUseCase:
+    """Create a master for each BatchJob, extracting all their templates together.
+
+    A datamap used by more than one job is only read once, and a template in the
+    input directory of more than one job is only extracted once. Masters for jobs
+    whose datamap has a type column are created with validation, each with its
+    own validation report. A failure in one job, including a missing or invalid
+    datamap or a template which cannot be extracted, is logged and does not stop
+    the others. After execute(),
+    status maps each job to its RunStatus.
+
+    If use_cache is True, templates in the ExtractionCache are not extracted
+    again, and validation checks are kept in it. If resume is True, the run is checkpointed to a RunJournal, and files
+    extracted by a previous, interrupted run of the same projects are not
+    extracted again; the journal is removed once every master is written.
+    """
+
+    def __init__(
+        self,
+        jobs: List[BatchJob],
+        output_repository,
+        resume: bool = False,
+        token=None,
+        use_cache: bool = True,
+    ) -> None:
+        self.jobs = jobs
+        self.output_repository = output_repository
+        self.resume = resume
+        self.token = token
+        self.use_cache = use_cache
+        self.status: Dict[BatchJob, RunStatus] = {}
+        self.errors: Dict[BatchJob, Exception] = {}
+
+    def execute(self) -> Dict[BatchJob, RunStatus]:
+        datamaps: Dict[Path, InMemorySingleDatamapRepository] = {}
+        states = []
+        for job in self.jobs:
+            dm_path = Path(job.inputdir) / job.datamap
+            try:
+                if dm_path not in datamaps:
+                    datamaps[dm_path] = InMemorySingleDatamapRepository(dm_path)
+                states.append(_JobState(job, datamaps[dm_path]))
+            except Exception as e:
+                self._fail(job, e)
+        for state in states:
+            if state.outstanding == 0:
+                self._create_master(state)
+
+        # take one file from each job in turn, noting every job which has each file
+        owners: Dict[Path, List[Tuple[_JobState, int]]] = {}
+        for round_ in zip_longest(*[list(enumerate(s.files)) for s in states]):
+            for state, entry in zip(states, round_):
+                if entry is not None:
+                    idx, xlsx_file = entry
+                    owners.setdefault(xlsx_file, []).append((state, idx))
+        xlsx_files = list(owners)
+
+        checksums: Optional[Dict[Path, str]] = None
+        if self.use_cache or self.resume:
+            checksums = {}
+            for state in states:
+                checksums.update(InputManifest(state.job.inputdir).scan(state.files))
+        journal = RunJournal(self._journal_source()) if self.resume else None
+        cache = ExtractionCache() if self.use_cache else None
+
+        def _completed(position: int, file_data: DAT_DATA) -> None:
+            for state, idx in owners[xlsx_files[position]]:
+                state.results[idx] = file_data
+                self._file_done(state)
+
+        def _failed(position: int, error: Exception) -> None:
+            for state, _ in owners[xlsx_files[position]]:
+                self._fail(state.job, error)
+                self._file_done(state)
+
+        try:
+            extract_from_multiple_xlsx_files(
+                xlsx_files,
+                journal=journal,
+                token=self.token,
+                cache=cache,
+                checksums=checksums,
+                completed=_completed,
+                failed=_failed,
+            )
+        finally:
+            if cache is not None:
+                cache.close()
+            for state in states:
+                if state.job not in self.status:
+                    self.status[state.job] = RunStatus.CANCELLED
+        if journal is not None and all(
+            status == RunStatus.COMPLETE for status in self.status.values()
+        ):
+            journal.remove()
+        return self.status
+
+    def _journal_source(self) -> str:
+        "The journal of a batch is shared by runs over the same input directories."
+        return os.pathsep.join(
+            sorted({os.path.abspath(job.inputdir) for job in self.jobs})
+        )
+
+    def _file_done(self, state: _JobState) -> None:
+        state.outstanding -= 1
+        if state.outstanding == 0 and state.job not in self.status:
+            self._create_master(state)
+
+    def _create_master(self, state: _JobState) -> None:
+        job = state.job
+        logger.info(f"All templates in {job.inputdir} extracted. Creating master.")
+        tmpl_repo = InMemoryPopulatedTemplatesRepository(
+            str(job.inputdir), use_cache=self.use_cache
+        )
+        tmpl_repo.state = state.data()
+        if state.dm_repo.is_typed:
+            uc = CreateMasterUseCaseWithValidation(
+                state.dm_repo,
+                tmpl_repo,
+                self.output_repository,
+                report_prefix=f"validation_report_{Path(job.output_file_name).stem}",
+            )
+        else:
+            uc = CreateMasterUseCase(state.dm_repo, tmpl_repo, self.output_repository)
+        try:
+            uc.execute(job.output_file_name)
+        except Exception as e:
+            self._fail(job, e)
+            return
+        self.status[job] = RunStatus.COMPLETE
+
+    def _fail(self, job: BatchJob, error: Exception) -> None:
+        if job in self.status:
+            return
+        logger.critical(f"Unable to create master for {job.inputdir}: {error}")
+        self.errors[job] = error
+        self.status[job] = RunStatus.CANCELLED
@@ -9,9 +9,12 @@ from typing import List
 
 from openpyxl import load_workbook
 
+from engine.exceptions import OperationCancelledError
 from engine.repository.datamap import InMemorySingleDatamapRepository
+from engine.repository.structure import check_datamap_against_template
 from engine.use_cases.parsing import ParseDatamapUseCase
 from engine.use_cases.typing import MASTER_DATA_FOR_FILE, ColData
+from engine.utils.cancellation import RunStatus
 
 warnings.filterwarnings("ignore", ".*Conditional Formatting*.")
 warnings.filterwarnings("ignore", ".*Sparkline Group*.")
@@ -30,10 +33,17 @@ class WriteMasterToTemplates:
 
     Writes data from a given master to a blank template and saves each file according
     to each relevant column in the master.
+
+    If a CancellationToken is given, writing stops when it is cancelled. Templates
+    already written are left in place and are listed in output_repo.saved_files.
     """
 
-    def __init__(self, output_repo, datamap: Path, master: Path, blank_template: Path):
+    def __init__(
+        self, output_repo, datamap: Path, master: Path, blank_template: Path, token=None
+    ):
         self.output_repo = output_repo
+        self.token = token
+        self.status = RunStatus.COMPLETE
         self._datamap = datamap
         self._master_path = master
         self._master_sheet = load_workbook(master).active
@@ -58,12 +68,35 @@ class WriteMasterToTemplates:
         master_keys_s = set(self._col_a_vals)
         return list(dm_keys_s - master_keys_s)
 
+    def _check_datamap_matches_blank_template(self) -> None:
+        """Raise RuntimeError if the datamap refers to cells which cannot be written to.
+
+        Found before any template is written, rather than part-way through.
+        """
+        if not check_datamap_against_template(
+            self._blank_template, self.parse_dm_repo.list_as_objs()
+        ):
+            raise RuntimeError(
+                "Not continuing. Ensure every cellref in the datamap can be written "
+                "to in the blank template."
+            )
+
     def execute(self) -> None:
         """
         Writes a master file to multiple templates using blank_template,
         based on the blank_template and the datamap.
         """
+        master_data = self.read_master()
+        try:
+            self.output_repo.write(master_data, from_json=False)
+        except OperationCancelledError:
+            self.status = RunStatus.CANCELLED
+            raise
+        if self.token is not None:
+            self.status = self.token.status
 
+    def read_master(self) -> MASTER_DATA_FOR_FILE:
+        """Read the data for each template from the master, checking it against the datamap."""
         master_data: MASTER_DATA_FOR_FILE = []
 
         self.parse_dm_repo = InMemorySingleDatamapRepository(str(self._datamap))
@@ -79,8 +112,13 @@ class WriteMasterToTemplates:
                 raise RuntimeError(
                     "Not continuing. Ensure all keys from datamap are in the master."
                 )
+        self._check_datamap_matches_blank_template()
         cola = [x.value for x in list(self._master_sheet.columns)[0]][1:]
         for col in list(self._master_sheet.columns)[1:]:
+            if self.token is not None:
+                self.token.raise_if_cancelled(
+                    "Operation cancelled while reading master. No templates written."
+                )
             tups = []
             try:
                 file_name = col[0].value.split(".")[0]
@@ -115,5 +153,4 @@ class WriteMasterToTemplates:
                 )
                 tups.append(cd)
             master_data.append(tups)
-
-        self.output_repo.write(master_data, from_json=False)
+        return master_data
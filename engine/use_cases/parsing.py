@@ -33,26 +33,43 @@ objects - will return a dict of the form:
         }
     }
 """
-import json
+
 import logging
+import time
 import warnings
 from concurrent import futures
-from typing import Dict, List, Tuple
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from engine.config import Config
+from engine.domain.datamap import CompiledDatamap
+from engine.domain.master import MasterData
 from engine.exceptions import (
     DatamapNotCSVException,
     NoApplicableSheetsInTemplateFiles,
+    OperationCancelledError,
     RemoveFileWithNoSheetRequiredByDatamap,
 )
 from engine.reports.validation import ValidationCheck, ValidationReportCSV
+from engine.repository.cache import CLAIM_POLL_INTERVAL, ExtractionCache
+from engine.repository.master import MasterColumnsSidecar
+from engine.repository.shards import (
+    ShardedTemplateData,
+    template_reader_to_shard,
+    write_shard,
+)
+from engine.utils.cancellation import RunStatus
+from engine.utils.concurrency import MemoryBudget, completed_within_budget
 from engine.utils.extraction import (
     ALL_IMPORT_DATA,
+    _hash_files,
+    _hash_single_file,
     check_datamap_sheets,
     remove_failing_files,
+    sheet_signatures,
     template_reader,
 )
-from engine.utils.validation import validation_checker
+from engine.utils.validation import ValidationCollector
 
 # pylint: disable=R0903,R0913;
 
@@ -73,41 +90,48 @@ class ParsePopulatedTemplatesUseCase:
     def __init__(self, repo):
         self.repo = repo
 
-    def execute(self) -> str:
+    def execute(self, obj=False):
+        if obj:
+            return self.repo.list_as_objs()  # type: ignore
         return self.repo.list_as_json()  # type: ignore
 
 
-class ApplyDatamapToExtractionUseCaseWithValidation:
-    """Extract data from a bunch of spreadsheets, but filter based on a datamap."""
+class ApplyDatamapToExtractionUseCase:
+    """Extract data from a bunch of spreadsheets, but filter based on a datamap.
 
-    def __init__(self, datamap_repo, template_repo) -> None:
+    If validate is True, the cell referred to by each datamap line is also validated
+    in every file, and the checks are in validation_checks after execute(). The
+    sheet check, the validation and the data for the master are all produced in a
+    single pass over the files and datamap lines, so validating costs little more.
+    """
+
+    def __init__(self, datamap_repo, template_repo, validate=False) -> None:
         self._datamap_repo = datamap_repo
         self._template_repo = template_repo
+        self.validate = validate
+        self.validation_checks: List[ValidationCheck] = []
         self._template_data_dict: ALL_IMPORT_DATA = {}
-        self._datamap_data_dict: List[Dict[str, str]] = []
-        self.data_for_master: List[ALL_IMPORT_DATA] = []
-        self._datamap_data_json: str = ""
-        self._template_data_json: str = ""
+        self._datamap = CompiledDatamap("", "", {}, [])
+        self.data_for_master = MasterData([])
+        self._template_data: ALL_IMPORT_DATA = {}
 
     def _get_value_of_cell_referred_by_key(
         self, filename: str, key: str, sheet: str
     ) -> str:
-        """Given a filename, a template_data json str, a datamap_data dict, key and sheet, returns
-        the value in the spreadsheet at given datamap key.
+        """Given a filename, key and sheet, returns the value in the spreadsheet at
+        given datamap key.
 
         Throws KeyError if the datamap refers to a sheet/cellref combo in the target file that does not exist.
         """
         output = ""
-        if key not in [x["key"] for x in self._datamap_data_dict]:
+        if key not in self._datamap.line_for_key:
             raise KeyError('No key "{}" in datamap'.format(key))
-        if sheet not in [x["sheet"] for x in self._datamap_data_dict]:
+        if sheet not in self._datamap.lines_by_sheet:
             raise KeyError('No sheet "{}" in datamap'.format(sheet))
-        _target_cellref = [
-            x["cellref"]
-            for x in self._datamap_data_dict
-            if x["key"] == key and x["sheet"] == sheet
-        ]
-        _cellref = _target_cellref[0]
+        try:
+            _cellref = self._datamap.cellref_for[(key, sheet)]
+        except KeyError:
+            raise KeyError('No key "{}" on sheet "{}" in datamap'.format(key, sheet))
         try:
             output = self._template_data_dict[filename]["data"][sheet][_cellref][
                 "value"
@@ -127,39 +151,86 @@ class ApplyDatamapToExtractionUseCaseWithValidation:
         return output
 
     def _set_datamap_and_template_data(self) -> None:
-        """Does the work of creating the template_data and datamap_data attributes"""
+        """Does the work of creating the template_data and datamap attributes.
+
+        Both are taken from the repositories as objects; nothing is serialised.
+        """
         t_uc = ParsePopulatedTemplatesUseCase(self._template_repo)
-        d_uc = ParseDatamapUseCase(self._datamap_repo)
-        try:
-            self._datamap_data_json = d_uc.execute()
-        except DatamapNotCSVException:
-            raise
-        self._template_data_json = t_uc.execute()
+        self._datamap = self._datamap_repo.compiled
+        self._template_data = t_uc.execute(obj=True)
 
     def get_values(self):
         for _file_name in self._template_data_dict:
-            for _dml in self._datamap_data_dict:
-                val = self.query_key(_file_name, _dml["key"], _dml["sheet"])
-                yield {(_file_name, _dml["key"], _dml["sheet"], _dml["cellref"]): val}
+            for _dml in self._datamap.lines:
+                val = self.query_key(_file_name, _dml.key, _dml.sheet)
+                yield {(_file_name, _dml.key, _dml.sheet, _dml.cellref): val}
 
-    def execute(self, as_obj=False, for_master=False):
-        if self._template_data_dict is not True and self._datamap_data_dict is not True:
-            try:
-                self._set_datamap_and_template_data()
-            except DatamapNotCSVException:
-                raise
-        self._datamap_data_dict = json.loads(self._datamap_data_json)
-        self._template_data_dict = json.loads(self._template_data_json)
+    def execute(self, as_obj=False, for_master=False, sidecar=None):
+        try:
+            self._set_datamap_and_template_data()
+        except DatamapNotCSVException:
+            raise
+        # remove_failing_files() removes files from this, so leave the repo's data alone
+        self._template_data_dict = self._template_data.copy()
+        logger.info("Checking template data.")
 
-        self.validation_checks = validation_checker(
-            self._datamap_data_dict, self._template_data_dict
+        checks = check_datamap_sheets(self._datamap.lines, self._template_data_dict)
+        failing = set(checks.missing_sheets)
+        checksums: Dict[str, str] = {}
+        reuse: Dict[str, List[Any]] = {}
+        if for_master and sidecar is not None:
+            checksums = {
+                f: self._template_data_dict[f]["checksum"]  # type: ignore
+                for f in self._template_data_dict
+                if f not in failing
+            }
+            reuse = sidecar.reusable_columns(self._datamap.lines, checksums)
+            logger.info(
+                f"Reusing master columns for {len(reuse)} unchanged files. "
+                f"{len(checksums) - len(reuse)} files to process."
+            )
+        # reuse the checks for unchanged files where the template repo uses the cache
+        cache = (
+            ExtractionCache()
+            if self.validate and getattr(self._template_repo, "use_cache", False)
+            else None
         )
+        validation = (
+            ValidationCollector(self._datamap.lines, cache) if self.validate else None
+        )
+        master = MasterData([_dml.key for _dml in self._datamap.lines])
+        not_formatted = failing | set(reuse)
+        try:
+            # each file's data is fetched once, as it may have to be read from disk
+            for _file_name in self._template_data_dict:
+                file_data = self._template_data_dict[_file_name]
+                sheets = file_data["data"]
+                validating = validation is not None and not validation.from_cache(
+                    file_data["checksum"], sheets  # type: ignore
+                )
+                if for_master and _file_name not in not_formatted:
+                    master.add_column(
+                        _file_name,
+                        self._values_for_file(
+                            _file_name, sheets, validation if validating else None
+                        ),
+                    )
+                else:
+                    if validating:
+                        validation.check_file(sheets)  # type: ignore
+                    if _file_name in reuse:
+                        master.add_column(_file_name, reuse[_file_name])
+                if validating:
+                    validation.end_file(file_data["checksum"])  # type: ignore
+        finally:
+            if cache is not None:
+                cache.close()
+        if validation is not None:
+            self.validation_checks = validation.checks
 
-        checks = check_datamap_sheets(self._datamap_data_dict, self._template_data_dict)
         # TODO -reintroduce SKIP_MISSING_SHEETS check here
         # We set a config variable to choose whether we
         # throw out files with a single missing sheet
-        logger.info("Checking template data.")
         try:
             self._template_data_dict = remove_failing_files(
                 checks, self._template_data_dict
@@ -177,14 +248,16 @@ class ApplyDatamapToExtractionUseCaseWithValidation:
             raise
         # TODO - we have to do something when SKIP_MISSING_SHEETS is True here
         if for_master:
-            self._format_data_for_master()
+            self.data_for_master = master
+            if sidecar is not None:
+                sidecar.update(self._datamap.lines, checksums, master)
 
     def query_key(self, filename, key, sheet):
         """Given a filename, key and sheet, raises the value in the spreadsheet.
 
         Raises KeyError if any of filename, key and sheet are not in the datamap.
         """
-        if not bool(self._template_data_dict) and bool(self._datamap_data_dict):
+        if not bool(self._template_data_dict) and bool(self._datamap.lines):
             self._set_datamap_and_template_data()
         try:
             return self._get_value_of_cell_referred_by_key(filename, key, sheet)
@@ -194,170 +267,64 @@ class ApplyDatamapToExtractionUseCaseWithValidation:
             )
             raise
 
-    def _format_data_for_master(self):
-        output = [{fname: []} for fname in self._template_data_dict]
-        f_data = self._template_data_dict
-        dm_data = self._datamap_data_dict
-        for _file_name in f_data:
-            for _dml in dm_data:
-                val = self.query_key(_file_name, _dml["key"], _dml["sheet"])
-                _col_dict = [d for d in output if list(d.keys())[0] == _file_name][0]
-                _col_dict[_file_name].append((_dml["key"], val))
-        self.data_for_master = output
-
-
-class ApplyDatamapToExtractionUseCase:
-    """Extract data from a bunch of spreadsheets, but filter based on a datamap."""
-
-    def __init__(self, datamap_repo, template_repo) -> None:
-        self._datamap_repo = datamap_repo
-        self._template_repo = template_repo
-        self._template_data_dict: ALL_IMPORT_DATA = {}
-        self._datamap_data_dict: List[Dict[str, str]] = []
-        self.data_for_master: List[ALL_IMPORT_DATA] = []
-        self._datamap_data_json: str = ""
-        self._template_data_json: str = ""
-
-    def _get_value_of_cell_referred_by_key(
-        self, filename: str, key: str, sheet: str
-    ) -> str:
-        """Given a filename, a template_data json str, a datamap_data dict, key and sheet, returns
-        the value in the spreadsheet at given datamap key.
+    def _values_for_file(self, file_name: str, sheets, validation=None) -> List[Any]:
+        """The value of the cell referred to by each datamap line in file_name, in datamap order.
 
-        Throws KeyError if the datamap refers to a sheet/cellref combo in the target file that does not exist.
+        sheets is the file's data. If a ValidationCollector is given, each cell is
+        validated as its value is taken. Raises KeyError if the file has no sheet
+        referred to by the datamap.
         """
-        output = ""
-        if key not in [x["key"] for x in self._datamap_data_dict]:
-            raise KeyError('No key "{}" in datamap'.format(key))
-        if sheet not in [x["sheet"] for x in self._datamap_data_dict]:
-            raise KeyError('No sheet "{}" in datamap'.format(sheet))
-        _target_cellref = [
-            x["cellref"]
-            for x in self._datamap_data_dict
-            if x["key"] == key and x["sheet"] == sheet
-        ]
-        _cellref = _target_cellref[0]
-        try:
-            output = self._template_data_dict[filename]["data"][sheet][_cellref][
-                "value"
-            ]
-        except KeyError as e:
-            if e.args[0] == sheet:
-                logger.critical(
-                    "No sheet named {} in {}. Unable to process.".format(
-                        sheet, filename
-                    )
-                )
-                raise KeyError(
-                    "No sheet named {} in {}. Unable to process.".format(
-                        sheet, filename
-                    )
-                )
-        return output
-
-    def _set_datamap_and_template_data(self) -> None:
-        """Does the work of creating the template_data and datamap_data attributes"""
-        t_uc = ParsePopulatedTemplatesUseCase(self._template_repo)
-        d_uc = ParseDatamapUseCase(self._datamap_repo)
-        try:
-            self._datamap_data_json = d_uc.execute()
-        except DatamapNotCSVException:
-            raise
-        self._template_data_json = t_uc.execute()
-
-    def get_values(self):
-        for _file_name in self._template_data_dict:
-            for _dml in self._datamap_data_dict:
-                val = self.query_key(_file_name, _dml["key"], _dml["sheet"])
-                yield {(_file_name, _dml["key"], _dml["sheet"], _dml["cellref"]): val}
-
-    def execute(self, as_obj=False, for_master=False):
-        if self._template_data_dict is not True and self._datamap_data_dict is not True:
+        values = []
+        for idx, _dml in enumerate(self._datamap.lines):
             try:
-                self._set_datamap_and_template_data()
-            except DatamapNotCSVException:
-                raise
-        self._datamap_data_dict = json.loads(self._datamap_data_json)
-        self._template_data_dict = json.loads(self._template_data_json)
-        logger.info("Checking template data.")
-
-        checks = check_datamap_sheets(self._datamap_data_dict, self._template_data_dict)
-        # TODO -reintroduce SKIP_MISSING_SHEETS check here
-        # We set a config variable to choose whether we
-        # throw out files with a single missing sheet
-        try:
-            self._template_data_dict = remove_failing_files(
-                checks, self._template_data_dict
-            )
-        except NoApplicableSheetsInTemplateFiles:
-            # TODO add log message here
-            # for now...
-            # logger.critical("There are no files containing sheets declared in datamap. Quitting.")
-            raise
-        except RemoveFileWithNoSheetRequiredByDatamap as e:
-            logging.warning(
-                f"{e.args[0][0]} does not contain the sheets required by datamap (eg. {e.args[0][1]}). Not set to "
-                f"skip sheets so omitting from master. "
-            )
-            raise
-        # TODO - we have to do something when SKIP_MISSING_SHEETS is True here
-        if for_master:
-            self._format_data_for_master()
+                sheet_data = sheets[_dml.sheet]
+            except KeyError:
+                msg = "No sheet named {} in {}. Unable to process.".format(
+                    _dml.sheet, file_name
+                )
+                logger.critical(msg)
+                raise KeyError(msg)
+            # where a key appears twice on a sheet, the cell of its first line is used
+            cell = sheet_data.get(self._datamap.cellref_for[(_dml.key, _dml.sheet)])
+            values.append(cell["value"] if cell is not None else "")
+            if validation is not None and sheet_data:
+                validation.check(idx, _dml, sheet_data)
+        return values
 
-    def query_key(self, filename, key, sheet):
-        """Given a filename, key and sheet, raises the value in the spreadsheet.
 
-        Raises KeyError if any of filename, key and sheet are not in the datamap.
-        """
-        if not bool(self._template_data_dict) and bool(self._datamap_data_dict):
-            self._set_datamap_and_template_data()
-        try:
-            return self._get_value_of_cell_referred_by_key(filename, key, sheet)
-        except KeyError:
-            logger.critical(
-                "Unable to process datamapline due to problem with sheet/cellref referred to by datamap"
-            )
-            raise
+class ApplyDatamapToExtractionUseCaseWithValidation(ApplyDatamapToExtractionUseCase):
+    """ApplyDatamapToExtractionUseCase, validating the data as the datamap is applied."""
 
-    def _format_data_for_master(self):
-        output = [{fname: []} for fname in self._template_data_dict]
-        f_data = self._template_data_dict
-        dm_data = self._datamap_data_dict
-        for _file_name in f_data:
-            for _dml in dm_data:
-                val = self.query_key(_file_name, _dml["key"], _dml["sheet"])
-                _col_dict = [d for d in output if list(d.keys())[0] == _file_name][0]
-                _col_dict[_file_name].append((_dml["key"], val))
-        self.data_for_master = output
-
-
-# We have created a new CreateMasterUseCaseWithValidation class
-# the test is at tests.use_cases.test_template_parser_use_cases.test_create_master_spreadsheet_with_validation
-# Also created is a new ApplyDatamapToExtractionUseCaseWithValidation which
-# does the work of the validation (line 155 or thereabouts), which will be a list
-# of some sort of Check object, populated with data created by comparing
-# the datamap and template data structures for their cell type attributes.
-# The task where we left it was to find a way to populate the self.validation_checks list
-# on CreateMasterUseCaseWithValidation. This is used in the adapters.import_and_create_master
-# function, where we would use a validation=True/False flag to select either the
-# CreateMasterUseCase or CreateMasterUseCaseWithValidation use case class, depending upon
-# what we want. There is nothing yet decided about how we present this to the user
-# but this is probably best coordinated by the adapter and sent back out.
-
-# At this point, to ensure we have an ApplyDatamapToExtractionUseCaseWithValidation,
-# we have simply copied ApplyDatamapToExtractionUseCase!! This is obviously horrendous.
+    def __init__(self, datamap_repo, template_repo) -> None:
+        super().__init__(datamap_repo, template_repo, validate=True)
 
 
 class CreateMasterUseCaseWithValidation:
     """
     CreateMasterUseCaseWithValidation is used to create a master document
     from a set of input files, and apply type validation to the result.
+    See CreateMasterUseCase for incremental. If timestamp_report is False, the
+    validation report replaces the one written by the previous run.
     """
 
-    def __init__(self, datamap_repo, template_repo, output_repo):
+    def __init__(
+        self,
+        datamap_repo,
+        template_repo,
+        output_repo,
+        token=None,
+        report_prefix="validation_report",
+        incremental=False,
+        timestamp_report=True,
+    ):
         self.datamap_repo = datamap_repo
         self.template_repo = template_repo
         self.output_repository = output_repo
+        self.token = token
+        self.report_prefix = report_prefix
+        self.incremental = incremental
+        self.timestamp_report = timestamp_report
+        self.status = RunStatus.COMPLETE
         self.initial_validation_checks = []
         self.final_validation_checks = []
 
@@ -365,35 +332,180 @@ class CreateMasterUseCaseWithValidation:
         uc = ApplyDatamapToExtractionUseCaseWithValidation(
             self.datamap_repo, self.template_repo
         )
+        sidecar = _sidecar_for(output_file_name) if self.incremental else None
         try:
-            uc.execute(for_master=True)
+            uc.execute(for_master=True, sidecar=sidecar)
+            _check_token_before_output(self.token)
             self.initial_validation_checks = uc.validation_checks
             # default is to filter out dmls that do not have type declared in dm
             self.final_validation_checks = [
                 x for x in self.initial_validation_checks if x.wanted is not None
             ]
-            pth = ValidationReportCSV(self.final_validation_checks).write()
+            pth = ValidationReportCSV(
+                self.final_validation_checks,
+                prefix=self.report_prefix,
+                timestamped=self.timestamp_report,
+            ).write()
             logger.info(f"Validation report written to {pth}.")
         except DatamapNotCSVException:
             raise
+        except OperationCancelledError:
+            self.status = RunStatus.CANCELLED
+            raise
+        if self.token is not None:
+            self.status = self.token.status
         output_repo = self.output_repository(uc.data_for_master, output_file_name)
         output_repo.save()
+        if sidecar is not None:
+            sidecar.save()
+        if self.status == RunStatus.COMPLETE:
+            _remove_journal(self.template_repo)
 
 
 class CreateMasterUseCase:
-    def __init__(self, datamap_repo, template_repo, output_repository):
+    """Create a master document from a set of input files.
+
+    If a CancellationToken is given, the master is not written if the token
+    is cancelled, unless the token is in best effort mode, in which case a master
+    is written from the files extracted before cancellation and status is
+    RunStatus.PARTIAL.
+
+    If incremental is True, the columns of the master are also saved alongside it
+    (see MasterColumnsSidecar), and when the master is next created, columns for
+    templates which have not changed are taken from there.
+    """
+
+    def __init__(
+        self,
+        datamap_repo,
+        template_repo,
+        output_repository,
+        token=None,
+        incremental=False,
+    ):
         self.datamap_repo = datamap_repo
         self.template_repo = template_repo
         self.output_repository = output_repository
+        self.token = token
+        self.incremental = incremental
+        self.status = RunStatus.COMPLETE
 
     def execute(self, output_file_name):
         uc = ApplyDatamapToExtractionUseCase(self.datamap_repo, self.template_repo)
+        sidecar = _sidecar_for(output_file_name) if self.incremental else None
         try:
-            uc.execute(for_master=True)
+            uc.execute(for_master=True, sidecar=sidecar)
+            _check_token_before_output(self.token)
         except DatamapNotCSVException:
             raise
+        except OperationCancelledError:
+            self.status = RunStatus.CANCELLED
+            raise
+        if self.token is not None:
+            self.status = self.token.status
         output_repo = self.output_repository(uc.data_for_master, output_file_name)
         output_repo.save()
+        if sidecar is not None:
+            sidecar.save()
+        if self.status == RunStatus.COMPLETE:
+            _remove_journal(self.template_repo)
+
+
+class CreateMastersForDatamapsUseCase:
+    """Create a master for each of several datamaps from a single extraction of the templates.
+
+    datamaps is a list of (datamap_repo, output_file_name). The templates are
+    extracted once and their data shared by every datamap; template_repo may be
+    created with cells=datamap_cells(...) so that only the cells the datamaps
+    refer to are read. Masters for datamaps with a type column are created with
+    validation, each with a validation report named after its datamap. A failure
+    with one datamap is logged and does not stop the others.
+
+    After execute(), status maps the path of each datamap to its RunStatus, and
+    errors to the exception raised for any which failed.
+    """
+
+    def __init__(
+        self,
+        datamaps,
+        template_repo,
+        output_repository,
+        token=None,
+        incremental=False,
+        timestamp_report=True,
+    ):
+        self.datamaps = datamaps
+        self.template_repo = template_repo
+        self.output_repository = output_repository
+        self.token = token
+        self.incremental = incremental
+        self.timestamp_report = timestamp_report
+        self.status: Dict[str, RunStatus] = {}
+        self.errors: Dict[str, Exception] = {}
+
+    def execute(self) -> Dict[str, RunStatus]:
+        # the repository keeps what it extracts, for the use case of each datamap
+        self.template_repo.list_as_objs()
+        # keep the journal of a resumable extraction until every master is written
+        journal = getattr(self.template_repo, "journal", None)
+        if journal is not None:
+            self.template_repo.journal = None
+        for dm_repo, output_file_name in self.datamaps:
+            dm_path = str(dm_repo.datamap_path)
+            if dm_repo.is_typed:
+                uc = CreateMasterUseCaseWithValidation(
+                    dm_repo,
+                    self.template_repo,
+                    self.output_repository,
+                    token=self.token,
+                    report_prefix=f"validation_report_{Path(dm_path).stem}",
+                    incremental=self.incremental,
+                    timestamp_report=self.timestamp_report,
+                )
+            else:
+                uc = CreateMasterUseCase(
+                    dm_repo,
+                    self.template_repo,
+                    self.output_repository,
+                    token=self.token,
+                    incremental=self.incremental,
+                )
+            try:
+                uc.execute(output_file_name)
+            except OperationCancelledError:
+                raise
+            except Exception as e:
+                logger.critical(f"Unable to create master for {dm_path}: {e}")
+                self.errors[dm_path] = e
+                self.status[dm_path] = RunStatus.CANCELLED
+                continue
+            self.status[dm_path] = uc.status
+        if journal is not None and all(
+            status == RunStatus.COMPLETE for status in self.status.values()
+        ):
+            journal.remove()
+        return self.status
+
+
+def _sidecar_for(output_file_name) -> Optional[MasterColumnsSidecar]:
+    "The sidecar for the master output_file_name, or None if no master is written."
+    if not output_file_name:
+        return None
+    return MasterColumnsSidecar(output_file_name)
+
+
+def _remove_journal(template_repo) -> None:
+    "Remove the RunJournal of template_repo's extraction, once a master is written from it."
+    journal = getattr(template_repo, "journal", None)
+    if journal is not None:
+        journal.remove()
+        template_repo.journal = None
+
+
+def _check_token_before_output(token) -> None:
+    "Raise OperationCancelledError if token is cancelled, unless it is in best effort mode."
+    if token is not None and not token.best_effort:
+        token.raise_if_cancelled("Operation cancelled. No output written.")
 
 
 class ParseDatamapUseCase:
@@ -418,10 +530,286 @@ class ParseDatamapUseCase:
 #    return data
 
 
-def extract_from_multiple_xlsx_files(xlsx_files) -> ALL_IMPORT_DATA:
-    """Extract raw data from list of paths to excel files. Return as complex dictionary."""
-    data = {}
-    with futures.ProcessPoolExecutor() as pool:
-        for file in pool.map(template_reader, xlsx_files):
-            data.update(file)
+_SHARED_POOL: Optional[futures.ProcessPoolExecutor] = None
+
+
+def shared_process_pool() -> futures.ProcessPoolExecutor:
+    """Return a process pool shared by all callers in this process, creating it if needed.
+
+    Used where many jobs are driven at once (the async use cases, for example),
+    so that they do not each pay for starting their own pool.
+    """
+    global _SHARED_POOL
+    if _SHARED_POOL is None:
+        _SHARED_POOL = futures.ProcessPoolExecutor()
+    return _SHARED_POOL
+
+
+def _split_completed_files(
+    xlsx_files, journal=None, shard_dir=None, cache=None, checksums=None
+) -> Tuple[Dict[int, Any], List[Tuple[int, Path]]]:
+    """Separate files already recorded in journal or cache from those still to be extracted.
+
+    Returns the recorded results, keyed by the position of the file in xlsx_files,
+    and a list of (position, file) for the files remaining. If shard_dir is given,
+    each recorded result is written to a shard there as it is read, and the
+    (file name, shard path) is returned in its place. checksums may map each
+    file to its checksum, if already known.
+    """
+    results: Dict[int, Any] = {}
+    pending = []
+    cached = 0
+    use_journal = journal is not None and len(journal) > 0
+    for idx, xlsx_file in enumerate(xlsx_files):
+        if use_journal or cache is not None:
+            if checksums is not None and xlsx_file in checksums:
+                checksum = checksums[xlsx_file]
+            else:
+                checksum = _hash_single_file(xlsx_file)
+            previous = journal.completed(xlsx_file, checksum) if use_journal else None
+            if previous is None and cache is not None:
+                previous = cache.get(xlsx_file, checksum)
+                cached += previous is not None
+            if previous is not None:
+                if shard_dir is not None:
+                    previous = write_shard(previous, shard_dir)
+                results[idx] = previous
+                continue
+        pending.append((idx, xlsx_file))
+    if cached:
+        logger.info(f"Using cached data for {cached} unchanged files.")
+    if len(results) > cached:
+        logger.info(
+            f"Skipping {len(results) - cached} files already extracted in previous run."
+        )
+    if results:
+        logger.info(f"{len(pending)} files remaining.")
+    return results, pending
+
+
+def _claim_files(
+    pending, deferred, cache, checksums, results, shard_dir=None
+) -> Tuple[List[Tuple[int, Path]], List[Tuple[int, Path]]]:
+    """Claim files in cache before extracting them, so that other runs do not.
+
+    Files in pending are claimed. Files in deferred, which are being extracted by
+    another run, are looked for in the cache, and added to results if found, or
+    claimed if the other run has given up. If none of deferred could be resolved,
+    waits before returning. Returns the files claimed, which are to be extracted,
+    and those still being extracted elsewhere.
+    """
+    claimed = []
+    waiting = []
+    for idx, xlsx_file in deferred:
+        file_data = cache.lookup(xlsx_file, checksums[xlsx_file])
+        if file_data is not None:
+            logger.info(f"{Path(xlsx_file).name} extracted by another run.")
+            if shard_dir is not None:
+                file_data = write_shard(file_data, shard_dir)
+            results[idx] = file_data
+        elif cache.claim(checksums[xlsx_file]):
+            claimed.append((idx, xlsx_file))
+        else:
+            waiting.append((idx, xlsx_file))
+    for idx, xlsx_file in pending:
+        if cache.claim(checksums[xlsx_file]):
+            claimed.append((idx, xlsx_file))
+        else:
+            logger.info(
+                f"{Path(xlsx_file).name} is being extracted by another run. Waiting for it."
+            )
+            waiting.append((idx, xlsx_file))
+    if deferred and not claimed and len(waiting) == len(deferred):
+        time.sleep(CLAIM_POLL_INTERVAL)
+    return claimed, waiting
+
+
+def _reusable_sheets(cache, xlsx_file, checksums, signatures) -> Optional[Dict]:
+    """Return the worksheets of xlsx_file which can be taken from cache rather than read.
+
+    The signatures of the worksheets are added to signatures, to be stored in the
+    cache with the file's data.
+    """
+    sheets = sheet_signatures(xlsx_file)
+    if not sheets:
+        return None
+    signatures[checksums[xlsx_file]] = sheets
+    reuse = cache.reusable_sheets(xlsx_file, sheets)
+    if reuse:
+        logger.info(
+            f"{len(reuse)} of {len(sheets)} sheets in {Path(xlsx_file).name} "
+            "are unchanged and will be taken from the cache."
+        )
+    return reuse or None
+
+
+def _terminate_pool(pool: futures.ProcessPoolExecutor) -> None:
+    """Stop the worker processes of pool without waiting for their current tasks."""
+    pool.shutdown(wait=False)
+    # ProcessPoolExecutor offers no public way to stop a running worker before Python 3.14
+    for process in list((getattr(pool, "_processes", None) or {}).values()):
+        process.terminate()
+
+
+def extract_from_multiple_xlsx_files(
+    xlsx_files,
+    journal=None,
+    token=None,
+    out_of_core=False,
+    cache=None,
+    checksums=None,
+    cells=None,
+    completed=None,
+    failed=None,
+    executor=None,
+) -> ALL_IMPORT_DATA:
+    """Extract raw data from list of paths to excel files. Return as complex dictionary.
+
+    If a RunJournal is given, files already recorded in it (with an unchanged
+    checksum) are not extracted again, and each newly extracted file is
+    recorded in the journal as soon as it completes.
+
+    If an ExtractionCache is given, files whose contents are in it are not
+    extracted again, and each newly extracted file is added to it. checksums may
+    map each file to its checksum (see InputManifest.scan()) to save hashing it.
+    Files which another run using the same cache is already extracting are not
+    extracted again; their data is taken from the cache once it is ready.
+
+    If a CancellationToken is given and it is cancelled (or its deadline passes)
+    before all files are extracted, files not yet extracted are abandoned and the
+    worker processes are stopped. See CancellationToken.stop() for what is returned.
+
+    If Config.MAX_MEMORY is set, files are only extracted while the memory they are
+    projected to need stays within it. See engine.utils.concurrency.MemoryBudget.
+
+    If out_of_core is True, the workers write the data for each file to a shard on
+    disk and a ShardedTemplateData is returned in place of the dictionary, so that
+    only one file's data is held in memory at a time.
+
+    If cells is given (see datamap_cells()), only those cells are read from the
+    files extracted. Their data is incomplete, so it is not recorded in the
+    journal or added to the cache, though complete data found in either is used.
+
+    If completed is given, it is called with the position of each file in
+    xlsx_files and its data as soon as the data is available, whether extracted
+    or taken from the journal or cache (with out_of_core, it is read back from
+    its shard).
+    If failed is given, a file which cannot be extracted is left out of the data
+    returned, and failed is called with its position and the exception raised,
+    rather than the exception being raised.
+
+    If executor is given (shared_process_pool(), for example), files are extracted
+    in it rather than in a process pool started for the call. It is left running
+    afterwards; if extraction is cancelled, only files not yet started are abandoned.
+    """
+    sharded = ShardedTemplateData() if out_of_core else None
+    shard_dir = sharded.shard_dir if sharded is not None else None
+    if cache is not None and checksums is None:
+        checksums = _hash_files(xlsx_files)
+    results, pending = _split_completed_files(
+        xlsx_files, journal, shard_dir, cache, checksums
+    )
+    failures: Dict[int, Exception] = {}
+    reported: Set[int] = set()
+
+    def _report_completed() -> None:
+        if completed is not None:
+            for idx in sorted(results.keys() - reported):
+                reported.add(idx)
+                if sharded is not None:
+                    file_name, shard_path = results[idx]  # type: ignore
+                    sharded.add_shard(file_name, shard_path)
+                    completed(idx, {file_name: sharded[file_name]})
+                else:
+                    completed(idx, results[idx])
+
+    deferred: List[Tuple[int, Path]] = []
+    if cache is not None:
+        pending, deferred = _claim_files(
+            pending, [], cache, checksums, results, shard_dir
+        )
+    _report_completed()
+    # the signatures of the worksheets in each file extracted, by checksum
+    signatures: Dict[str, Dict[str, str]] = {}
+    budget = MemoryBudget(Config.MAX_MEMORY) if Config.MAX_MEMORY else None
+    cancelled = False
+    if pending or deferred:
+        pool = executor if executor is not None else futures.ProcessPoolExecutor()
+        try:
+            while pending or deferred:
+                calls = []
+                for idx, xlsx_file in pending:
+                    reuse = None
+                    if cache is not None:
+                        reuse = _reusable_sheets(
+                            cache, xlsx_file, checksums, signatures
+                        )
+                    if sharded is not None:
+                        calls.append(
+                            (
+                                idx,
+                                xlsx_file,
+                                template_reader_to_shard,
+                                (xlsx_file, shard_dir, reuse, cells),
+                            )
+                        )
+                    elif reuse or cells is not None:
+                        calls.append(
+                            (idx, xlsx_file, template_reader, (xlsx_file, reuse, cells))
+                        )
+                    else:
+                        calls.append((idx, xlsx_file, template_reader, (xlsx_file,)))
+                for idx, file in completed_within_budget(
+                    pool, calls, budget, token, return_exceptions=failed is not None
+                ):
+                    if isinstance(file, Exception):
+                        logger.critical(
+                            f"Unable to extract {Path(xlsx_files[idx]).name}: {file}"
+                        )
+                        failures[idx] = file
+                        failed(idx, file)
+                        continue
+                    if cells is None and (journal is not None or cache is not None):
+                        if sharded is not None:
+                            file_name, shard_path = file
+                            sharded.add_shard(file_name, shard_path)
+                            file_data = {file_name: sharded[file_name]}
+                        else:
+                            file_data = file
+                        if journal is not None:
+                            journal.record(file_data)
+                        if cache is not None:
+                            cache.put(file_data, signatures)
+                    results[idx] = file
+                    _report_completed()
+                if token is not None and token.cancelled:
+                    break
+                pending, deferred = _claim_files(
+                    [], deferred, cache, checksums, results, shard_dir
+                )
+                _report_completed()
+            cancelled = len(results) + len(failures) < len(xlsx_files)
+        finally:
+            if cache is not None:
+                cache.release_claims()
+            # a pool given by the caller is theirs to shut down
+            if executor is None:
+                if cancelled:
+                    _terminate_pool(pool)
+                else:
+                    pool.shutdown(wait=True)
+    # retain the order in which the files were given
+    if sharded is not None:
+        data: ALL_IMPORT_DATA = ShardedTemplateData(sharded.store)
+        for idx in sorted(results):
+            data.add_shard(*results[idx])  # type: ignore
+    else:
+        data = {}
+        for idx in sorted(results):
+            data.update(results[idx])  # type: ignore
+    if cancelled:
+        return token.stop(
+            f"Extraction stopped after {len(results)} of {len(xlsx_files)} files.",
+            partial=data,
+        )
     return data
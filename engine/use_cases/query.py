@@ -0,0 +1,150 @@
+"""
+Answer questions about the values in templates without extracting them all first.
+
+ApplyDatamapToExtractionUseCase.query_key() can only answer once every template
+has been parsed. QueryTemplatesUseCase reads a template only when it is asked
+about, and then only the cell asked for, so the first answers arrive at once.
+The rest of the template's datamap cells are read in the background, so that
+further questions about it are answered from memory.
+"""
+
+import logging
+import threading
+from concurrent import futures
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
+from engine.utils.extraction import datamap_cells, template_reader
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s: %(levelname)s - %(message)s",
+    datefmt="%d-%b-%y %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+# values read from each template, by (sheet, cellref), or None for a missing sheet
+_FILE_VALUES = Dict[Tuple[str, str], Any]
+
+
+class QueryTemplatesUseCase:
+    """Look up the value of a datamap key in a template, reading templates on demand.
+
+    datamap_repo - the datamap, e.g. an InMemorySingleDatamapRepository
+    template_files - paths of the templates which can be asked about
+
+    query_key() takes the same arguments as ApplyDatamapToExtractionUseCase.query_key()
+    and raises KeyError in the same cases. Answers are memoised. Once the first
+    question about a template has been answered, a background read of all the
+    cells the datamap refers to in it is started; while that is under way, further
+    questions about the template wait for it rather than reading the file again,
+    and once it is done, no question about the template reads it again. Call
+    close() (or use the use case as a context manager) to stop any background
+    reads which have not started; query_key() raises RuntimeError after close().
+    """
+
+    def __init__(self, datamap_repo, template_files: Iterable[Union[Path, str]]):
+        self._datamap = datamap_repo.compiled
+        self._files = {Path(f).name: Path(f) for f in template_files}
+        self._values: Dict[str, _FILE_VALUES] = {}
+        self._prefetches: Dict[str, futures.Future] = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self._pool = futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="template-prefetch"
+        )
+
+    def __enter__(self) -> "QueryTemplatesUseCase":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            # ThreadPoolExecutor.shutdown() only cancels pending work itself from Python 3.9
+            for future in self._prefetches.values():
+                future.cancel()
+        self._pool.shutdown(wait=False)
+
+    def query_key(self, filename: str, key: str, sheet: str) -> Any:
+        """Given a filename, key and sheet, returns the value in the spreadsheet.
+
+        Raises KeyError if the key or sheet are not in the datamap, if filename is
+        not one of the templates, or if the template has no such sheet. Raises
+        RuntimeError if the use case has been closed.
+        """
+        if self._closed:
+            raise RuntimeError("Cannot query templates after close().")
+        if key not in self._datamap.line_for_key:
+            raise KeyError('No key "{}" in datamap'.format(key))
+        if sheet not in self._datamap.lines_by_sheet:
+            raise KeyError('No sheet "{}" in datamap'.format(sheet))
+        try:
+            cellref = self._datamap.cellref_for[(key, sheet)]
+        except KeyError:
+            raise KeyError('No key "{}" on sheet "{}" in datamap'.format(key, sheet))
+        if filename not in self._files:
+            raise KeyError('No template "{}" to query'.format(filename))
+        values = self._known_values(filename)
+        if (sheet, cellref) not in values:
+            values = self._read(filename, {sheet: {cellref}})
+        self._start_prefetch(filename)
+        if values[(sheet, cellref)] is None:
+            msg = "No sheet named {} in {}. Unable to process.".format(sheet, filename)
+            logger.critical(msg)
+            raise KeyError(msg)
+        return values[(sheet, cellref)]
+
+    def prefetched(self, filename: str) -> bool:
+        "True if all the datamap's cells in filename have been read."
+        future = self._prefetches.get(filename)
+        return (
+            future is not None
+            and future.done()
+            and not future.cancelled()
+            and future.exception() is None
+        )
+
+    def _known_values(self, filename: str) -> _FILE_VALUES:
+        """The values read from filename so far.
+
+        If the background read of filename is under way, it is waited for, as it
+        reads every cell which can be asked about.
+        """
+        future = self._prefetches.get(filename)
+        if future is not None and (future.running() or future.done()):
+            try:
+                future.result()
+            except Exception:  # pylint: disable=broad-except
+                # read the cell asked for, which raises the error if it persists
+                logger.warning(f"Background read of {filename} failed.")
+        with self._lock:
+            return self._values.get(filename, {})
+
+    def _start_prefetch(self, filename: str) -> None:
+        "Start the background read of filename, unless it has already been started."
+        with self._lock:
+            if filename not in self._prefetches and not self._closed:
+                self._prefetches[filename] = self._pool.submit(
+                    self._read, filename, datamap_cells([self._datamap])
+                )
+
+    def _read(self, filename: str, cells) -> _FILE_VALUES:
+        "Read cells from filename, and add them to the values known for it."
+        data = template_reader(self._files[filename], cells=cells)[filename]["data"]
+        read: _FILE_VALUES = {}
+        for sheet, cellrefs in cells.items():
+            sheet_data: Optional[Dict] = data.get(sheet)  # type: ignore
+            for cellref in cellrefs:
+                if sheet_data is None:
+                    read[(sheet, cellref)] = None
+                elif cellref in sheet_data:
+                    read[(sheet, cellref)] = sheet_data[cellref]["value"]
+                else:
+                    read[(sheet, cellref)] = ""
+        with self._lock:
+            values = self._values.setdefault(filename, {})
+            values.update(read)
+            return values
@@ -0,0 +1,98 @@
+"""
+Keep a master up to date with the templates in an input directory.
+
+The directory is watched for changes. Once files stop changing for a short time
+(so that a batch of templates being copied in is handled together, and a file
+is not read while it is still being written) the master is created again. With
+the extraction cache and an incremental master, only the templates which are
+new or have changed are parsed and have the datamap applied to them.
+"""
+
+import logging
+from typing import Any, Callable, Optional, Set
+
+from engine.utils.cancellation import poll_interval
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s: %(levelname)s - %(message)s",
+    datefmt="%d-%b-%y %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+# seconds for which files must stop changing before the master is created again
+DEBOUNCE_INTERVAL = 2.0
+
+
+class WatchAndCreateMasterUseCase:
+    """Call create_master() now, and again each time the watched directory changes.
+
+    watcher - a PollingWatcher or InotifyWatcher (see directory_watcher()) for the input directory
+    create_master - creates the master from the files currently in the directory
+    debounce - seconds for which the directory must be unchanged before create_master() is called
+    token - a CancellationToken; the watch ends when it is cancelled
+    max_cycles - if given, the watch ends after create_master() has been called this many times
+
+    An exception raised by create_master() is logged, and the watch continues:
+    the master is created again when the directory next changes. After execute(),
+    cycles is the number of times create_master() was called.
+    """
+
+    def __init__(
+        self,
+        watcher,
+        create_master: Callable[[], Any],
+        debounce: Optional[float] = None,
+        token=None,
+        max_cycles: Optional[int] = None,
+    ) -> None:
+        self.watcher = watcher
+        self.create_master = create_master
+        self.debounce = debounce if debounce is not None else DEBOUNCE_INTERVAL
+        self.token = token
+        self.max_cycles = max_cycles
+        self.cycles = 0
+
+    def execute(self) -> None:
+        try:
+            self._cycle()
+            while not self._finished():
+                changed = self._wait_for_changes()
+                if changed is None:
+                    break
+                logger.info(
+                    f"Changes in {self.watcher.directory}: "
+                    + ", ".join(sorted(name or "(directory)" for name in changed))
+                )
+                self._cycle()
+        finally:
+            self.watcher.close()
+        logger.info(f"Stopped watching {self.watcher.directory}.")
+
+    def _finished(self) -> bool:
+        if self.token is not None and self.token.cancelled:
+            return True
+        return self.max_cycles is not None and self.cycles >= self.max_cycles
+
+    def _cycle(self) -> None:
+        self.cycles += 1
+        try:
+            self.create_master()
+        except Exception as e:
+            logger.critical(
+                f"Unable to create master: {e}. "
+                "Will try again when the input directory changes."
+            )
+
+    def _wait_for_changes(self) -> Optional[Set[str]]:
+        """Return the names of the files changed once they have settled, or None if cancelled."""
+        changed: Set[str] = set()
+        while not changed:
+            if self.token is not None and self.token.cancelled:
+                return None
+            changed = self.watcher.changes(timeout=poll_interval(self.token))
+        while True:
+            more = self.watcher.changes(timeout=self.debounce)
+            if not more:
+                return changed
+            changed |= more
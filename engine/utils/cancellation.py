@@ -0,0 +1,89 @@
+# utils/cancellation.py
+#
+# Cooperative cancellation for long-running use cases. A CancellationToken
+# is created by the caller and handed to the use cases and repositories,
+# which check it between units of work (typically between files).
+
+import enum
+import logging
+import threading
+import time
+from typing import Any, Optional
+
+from engine.exceptions import OperationCancelledError
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s: %(levelname)s - %(message)s",
+    datefmt="%d-%b-%y %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+
+class RunStatus(enum.Enum):
+    COMPLETE = enum.auto()
+    PARTIAL = enum.auto()
+    CANCELLED = enum.auto()
+
+
+class CancellationToken:
+    """Signals that work should stop, either on request or when a deadline passes.
+
+    timeout - number of seconds from creation after which the token counts as cancelled
+    best_effort - if True, work that is cut short returns whatever it has completed
+        (and sets status to RunStatus.PARTIAL) rather than raising OperationCancelledError
+    """
+
+    def __init__(self, timeout: Optional[float] = None, best_effort: bool = False):
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+        self.best_effort = best_effort
+        self.status = RunStatus.COMPLETE
+        self._event = threading.Event()
+
+    def cancel(self) -> None:
+        """Request cancellation of all work using this token."""
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        if self._event.is_set():
+            return True
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return True
+        return False
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left before the deadline, or None if there is no deadline."""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def stop(self, msg: str, partial: Any = None) -> Any:
+        """Called by work that has been cut short by this token.
+
+        In best effort mode, records the run as partial and returns partial.
+        Otherwise records the run as cancelled and raises OperationCancelledError.
+        """
+        if self.best_effort:
+            self.status = RunStatus.PARTIAL
+            logger.warning(f"{msg} Continuing with partial results.")
+            return partial
+        self.status = RunStatus.CANCELLED
+        logger.critical(msg)
+        raise OperationCancelledError(msg, partial=partial)
+
+    def raise_if_cancelled(self, msg: str = "Operation cancelled.") -> None:
+        """Raise OperationCancelledError if cancelled, whether or not in best effort mode."""
+        if self.cancelled:
+            self.status = RunStatus.CANCELLED
+            raise OperationCancelledError(msg)
+
+
+def poll_interval(token: Optional[CancellationToken]) -> Optional[float]:
+    "How long to wait for a piece of work to complete before checking token again."
+    if token is None:
+        return None
+    remaining = token.remaining()
+    if remaining is None:
+        return 0.5
+    return min(0.5, remaining)
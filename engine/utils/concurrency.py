@@ -0,0 +1,190 @@
+# utils/concurrency.py
+#
+# Controls how much work is given to a process pool at once. Rather than
+# running as many spreadsheets as there are workers, a MemoryBudget admits a
+# new task only while the projected memory use of all tasks in flight stays
+# under a limit. Projections are based on file size, and are corrected by the
+# memory actually used by the workers as tasks complete.
+
+import logging
+import os
+import re
+import sys
+from collections import deque
+from concurrent import futures
+from pathlib import Path
+from typing import Any, Callable, Iterator, List, Optional, Tuple, Union
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None  # type: ignore
+
+from engine.utils.cancellation import poll_interval
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s: %(levelname)s - %(message)s",
+    datefmt="%d-%b-%y %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+# openpyxl typically needs around 50 times the size of the file on disk
+DEFAULT_MEMORY_RATIO = 50.0
+# allow for the interpreter and openpyxl itself, whatever the size of the file
+MINIMUM_TASK_MEMORY = 32 * 1024 * 1024
+
+_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_memory_size(size: Union[int, str]) -> int:
+    """Convert a memory size such as 4096, "512M" or "4G" to a number of bytes."""
+    if isinstance(size, int):
+        return size
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*", str(size).upper())
+    if not match:
+        raise ValueError(f"Cannot understand memory size {size}. Use, e.g. 512M or 4G.")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2)])
+
+
+def _current_rss() -> Optional[int]:
+    "Resident memory of this process in bytes, if it can be determined."
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _peak_rss() -> Optional[int]:
+    "Peak resident memory of this process in bytes, if it can be determined."
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def measured_call(func: Callable, *args: Any) -> Tuple[Any, Optional[int]]:
+    """Call func(*args) in a worker, returning its result and the memory it used.
+
+    The memory used is only known when the call raised the peak memory of the
+    worker; otherwise None is returned in its place.
+    """
+    rss_before = _current_rss()
+    peak_before = _peak_rss()
+    result = func(*args)
+    peak_after = _peak_rss()
+    if rss_before is None or peak_before is None or peak_after is None:
+        return result, None
+    if peak_after <= peak_before:
+        return result, None
+    return result, peak_after - rss_before
+
+
+class MemoryBudget:
+    """Admits tasks while the projected memory of those in flight is within max_memory.
+
+    The memory needed by a task is estimated as the size of its file multiplied by
+    ratio, which is adjusted as the memory used by completed tasks is observed.
+    A task is always admitted if nothing else is in flight, so that a single file
+    larger than the budget can still be processed.
+    """
+
+    def __init__(self, max_memory: int, ratio: float = DEFAULT_MEMORY_RATIO) -> None:
+        self.max_memory = max_memory
+        self.ratio = ratio
+        self.in_flight = 0
+        self.tasks = 0
+
+    def estimate(self, path: Union[Path, str]) -> int:
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+        return max(int(size * self.ratio), MINIMUM_TASK_MEMORY)
+
+    def admit(self, estimate: int) -> bool:
+        if self.tasks and self.in_flight + estimate > self.max_memory:
+            return False
+        self.in_flight += estimate
+        self.tasks += 1
+        return True
+
+    def release(self, estimate: int) -> None:
+        self.in_flight -= estimate
+        self.tasks -= 1
+
+    def observe(self, path: Union[Path, str], used: Optional[int]) -> None:
+        "Adjust ratio given the memory actually used to process the file at path."
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        if used is None or size == 0:
+            return
+        # move halfway towards the observed ratio, but never below it
+        observed = used / size
+        self.ratio = max(observed, (self.ratio + observed) / 2)
+
+
+def completed_within_budget(
+    pool: futures.Executor,
+    calls: List[Tuple[Any, Union[Path, str], Callable, Tuple]],
+    budget: Optional[MemoryBudget] = None,
+    token=None,
+    return_exceptions: bool = False,
+) -> Iterator[Tuple[Any, Any]]:
+    """Run calls in pool, yielding (key, result) for each as it completes.
+
+    calls is a list of (key, path, function, args), where path is the file whose
+    size determines the memory the call needs. If budget is given, calls are only
+    started while it admits them; otherwise they are all started at once. If token
+    is cancelled, calls not yet complete are cancelled and the iterator stops early.
+    If return_exceptions is True, the exception raised by a call is yielded as its
+    result, rather than raised.
+    """
+    queue = deque(calls)
+    running = {}
+
+    def _start_admitted() -> None:
+        while queue:
+            key, path, func, args = queue[0]
+            if budget is None:
+                running[pool.submit(func, *args)] = (key, path, 0)
+            else:
+                estimate = budget.estimate(path)
+                if not budget.admit(estimate):
+                    break
+                running[pool.submit(measured_call, func, *args)] = (key, path, estimate)
+            queue.popleft()
+
+    try:
+        _start_admitted()
+        while running:
+            if token is not None and token.cancelled:
+                return
+            done, _ = futures.wait(
+                running,
+                timeout=poll_interval(token),
+                return_when=futures.FIRST_COMPLETED,
+            )
+            for future in done:
+                key, path, estimate = running.pop(future)
+                if budget is not None:
+                    budget.release(estimate)
+                error = future.exception()
+                if error is not None:
+                    if not return_exceptions:
+                        raise error
+                    yield key, error
+                    continue
+                result = future.result()
+                if budget is not None:
+                    result, used = result
+                    budget.observe(path, used)
+                yield key, result
+            _start_admitted()
+    finally:
+        for future in running:
+            future.cancel()
@@ -11,11 +11,25 @@ import re
 import shutil
 import tempfile
 import zipfile
-from collections import OrderedDict, defaultdict
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from itertools import groupby
 from pathlib import Path
-from typing import Any, Dict, Generator, List, NamedTuple, Union, Tuple
+from typing import (
+    IO,
+    Any,
+    Dict,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 from zipfile import BadZipFile
 
 from engine.config import Config
@@ -33,13 +47,23 @@ from engine.exceptions import (
 )
 from engine.utils import ECHO_FUNC_GREEN, ECHO_FUNC_YELLOW
 from openpyxl import load_workbook
+from openpyxl.utils.cell import coordinate_to_tuple
 from openpyxl.worksheet.cell_range import MultiCellRange
 from openpyxl.worksheet.worksheet import Worksheet
+from openpyxl.xml.constants import PKG_REL_NS, REL_NS, SHEET_MAIN_NS
+from openpyxl.xml.functions import fromstring
 
 FILE_DATA = Dict[str, Union[str, Dict[str, Dict[str, str]]]]
 DAT_DATA = Dict[str, FILE_DATA]
 SHEET_DATA_IN_LST = List[Dict[str, str]]
 ALL_IMPORT_DATA = Dict[str, Dict[str, Dict[str, Dict[str, Dict[str, str]]]]]
+# sheet title to the cellrefs to be read from it
+CELL_FILTER = Dict[str, Set[str]]
+
+# files are hashed a chunk at a time, rather than read into memory whole
+HASH_CHUNK_SIZE = 1024 * 1024
+# parts of an xlsx file on which the values read from every worksheet depend
+SHARED_PARTS = ("xl/sharedStrings.xml", "xl/styles.xml")
 
 logging.basicConfig(
     level=logging.INFO,
@@ -49,78 +73,100 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def _dml_line_check(line: OrderedDict, headers: Dict[str, str]) -> None:
-    """Checks a line from csv.DictReader and raises exception if isn't complete.
-
-    Otherwise passes.
-    """
+def _check_datamap_fields(
+    key: Optional[str], sheet: Optional[str], cellref: Optional[str]
+) -> None:
+    "Raise an exception if the fields of a datamap line are incomplete."
     # Missing sheet field check
     # if we have a blank sheet field
-    missing_fields = [x[0] for x in line.items() if x[1] == ""]
-    if (
-        headers.get("key") in missing_fields
-        and headers.get("sheet") in missing_fields
-        and headers.get("cellref") in missing_fields
-    ):
+    if key == "" and sheet == "" and cellref == "":
         raise MissingLineError(
             "Datamap contains a missing line. Please fix datamap before proceeding."
         )
-    if headers.get("sheet") in missing_fields:
+    if sheet == "":
         raise MissingSheetFieldError(
-            f"Line whose key is {line['cell_key']} is missing a sheet field. Cannot proceed."
+            f"Line whose key is {key} is missing a sheet field. Cannot proceed."
             f" Please fix datamap."
         )
-    if headers.get("key") in missing_fields:
+    if key == "":
         raise MissingCellKeyError(
-            f"Line missing a key field. Contains sheet {line['template_sheet']} and cell reference {line['cellreference']}. "
+            f"Line missing a key field. Contains sheet {sheet} and cell reference {cellref}. "
             f"Cannot proceed."
             f" Please fix datamap."
         )
 
 
-def datamap_reader(dm_file: Union[Path, str]) -> List[DatamapLine]:
-    "Given a datamap csv file, returns a list of DatamapLine objects."
+def read_datamap(
+    dm_file: Union[Path, str], skipped: Optional[List[str]] = None
+) -> Tuple[Dict[str, Optional[str]], Iterator[DatamapLine]]:
+    """Check the header of a datamap csv file, and return it with an iterator over its lines.
+
+    The file is read once, a line at a time, as the iterator is consumed. The
+    header is checked before this returns, raising the exceptions described in
+    datamap_check(); each line is checked as it is read. If skipped is given, a
+    message for each line skipped is appended to it.
+    """
+    if ECHO_FUNC_YELLOW is not None:
+        ECHO_FUNC_YELLOW("Checking datamap file {}\n".format(dm_file))
+    datamap_file = DatamapFile(dm_file)
+    lines = datamap_file.__enter__()
     try:
-        headers = datamap_check(dm_file)
-    except DatamapNotCSVException:
+        headers = _check_datamap_header(next(lines, ""))
+    except BaseException:
+        datamap_file.__exit__(None, None, None)
         raise
-    data = []
+    if ECHO_FUNC_GREEN is not None:
+        ECHO_FUNC_GREEN("{} checked ok\n".format(dm_file))
     logger.info(f"Reading datamap {dm_file}")
     logger.info("Checking that datamap is valid.")
-    with DatamapFile(dm_file) as datamap_file:
-        reader = csv.DictReader(datamap_file)
-        for line in reader:
-            # if dml is correct, this passes silently
-            _dml_line_check(line, headers)
-            try:
-                if headers["type"] is None:
-                    data.append(
-                        DatamapLine(
-                            key=_clean(line[headers["key"]]),
-                            sheet=_clean(line[headers["sheet"]]),
-                            cellref=_clean(line[headers["cellref"]], is_cellref=True),
-                            data_type=None,
-                            filename=str(dm_file),
-                        )
-                    )
-                else:
-                    data.append(
-                        DatamapLine(
-                            key=_clean(line[headers["key"]]),
-                            sheet=_clean(line[headers["sheet"]]),
-                            cellref=_clean(line[headers["cellref"]], is_cellref=True),
-                            data_type=_clean(line[headers["type"]]),
-                            filename=str(dm_file),
-                        )
-                    )
-            except AttributeError as e:
-                if "Cannot clean value other than a string here." in e.args:
-                    logger.warning(
-                        f"{line[headers['key']]} line in datamap may be missing a key field, or"
-                        f" the line is formed unexpectedly. This line will be skipped during import/export."
-                        f" Check your datamap!"
-                    )
-    return data
+    return headers, _datamap_lines(datamap_file, lines, headers, str(dm_file), skipped)
+
+
+def _datamap_lines(
+    datamap_file: DatamapFile,
+    lines: IO[str],
+    headers: Dict[str, Optional[str]],
+    filename: str,
+    skipped: Optional[List[str]],
+) -> Iterator[DatamapLine]:
+    # datamap_check() finds the key, sheet, cellref and type headers in that order
+    n_fields = 3 if headers["type"] is None else 4
+    try:
+        for row in csv.reader(lines):
+            if not row:
+                continue
+            fields = row[:n_fields] + [None] * (n_fields - len(row))
+            _check_datamap_fields(*fields[:3])
+            if any(field is None for field in fields):
+                msg = (
+                    f"{fields[0]} line in datamap may be missing a key field, or"
+                    f" the line is formed unexpectedly. This line will be skipped during import/export."
+                    f" Check your datamap!"
+                )
+                logger.warning(msg)
+                if skipped is not None:
+                    skipped.append(msg)
+                continue
+            yield DatamapLine(
+                key=fields[0].strip(),  # type: ignore
+                sheet=fields[1].strip(),  # type: ignore
+                cellref=fields[2].strip().upper(),  # type: ignore
+                data_type=fields[3].strip() if n_fields == 4 else None,  # type: ignore
+                filename=filename,
+            )
+    finally:
+        datamap_file.__exit__(None, None, None)
+
+
+def datamap_reader(
+    dm_file: Union[Path, str], skipped: Optional[List[str]] = None
+) -> List[DatamapLine]:
+    """Given a datamap csv file, returns a list of DatamapLine objects.
+
+    If skipped is given, a message for each line skipped is appended to it.
+    """
+    _, lines = read_datamap(dm_file, skipped)
+    return list(lines)
 
 
 class CheckType(enum.Enum):
@@ -140,18 +186,36 @@ class Check:
     msg: str = ""
 
 
+class SheetChecks(list):
+    """The result of check_datamap_sheets(): a failing Check for each sheet missing from a file.
+
+    Files which have every sheet in the datamap are not listed, only counted in
+    passed, so that checking thousands of files makes no more records than
+    there are missing sheets.
+    """
+
+    def __init__(self, failures: Iterable[Check] = (), passed: int = 0) -> None:
+        super().__init__(failures)
+        self.passed = passed
+
+    @property
+    def missing_sheets(self) -> Dict[str, List[str]]:
+        "The sheets missing from each failing file."
+        missing: Dict[str, List[str]] = {}
+        for check in self:
+            if check.state == CheckType.FAIL:
+                missing.setdefault(check.filename, []).append(check.sheet)
+        return missing
+
+
 def remove_failing_files(
     lst_of_checks: List[Check], template_data: ALL_IMPORT_DATA
 ) -> ALL_IMPORT_DATA:
     """Given a list of checks, identify files which contain CheckType.FAIL, then remove them from template_data.
 
-    If this results in an empty template_data dict, return None.
+    If this results in an empty template_data dict, raise NoApplicableSheetsInTemplateFiles.
     """
-    failing_files = list(
-        set([(f.filename, f.sheet) for f in lst_of_checks if f.state == CheckType.FAIL])
-    )
-    for f in list(set([x[0] for x in failing_files])):
-        missing_sheets = [x.sheet for x in lst_of_checks if x.filename == f]
+    for f, missing_sheets in SheetChecks(lst_of_checks).missing_sheets.items():
         for ms in missing_sheets:
             logger.warning(
                 f"{ms} sheet missing from {f} - it is required by the datamap."
@@ -172,28 +236,23 @@ def remove_failing_files(
 
 def check_datamap_sheets(
     datamap_data: List[Dict[str, str]], template_data: ALL_IMPORT_DATA
-) -> List[Check]:
-    "Parse data struct for each of datamap and all template data for sheet compliance."
-    checks = []
-    sheets_in_datamap: List[str] = list(set([x["sheet"] for x in datamap_data]))
-    files_in_template_data = list(template_data.keys())
-    sheets_in_template_data = {
-        x: list(template_data[x]["data"].keys()) for x in files_in_template_data
-    }
-    for f in files_in_template_data:
+) -> SheetChecks:
+    """Parse data struct for each of datamap and all template data for sheet compliance.
+
+    Returns a failing Check for each sheet in the datamap missing from a file;
+    files with all the sheets are only counted.
+    """
+    # in datamap order, so that missing sheets are reported in a stable order
+    sheets_in_datamap: List[str] = list(dict.fromkeys(x["sheet"] for x in datamap_data))
+    required = set(sheets_in_datamap)
+    checks = SheetChecks()
+    for f, file_data in template_data.items():
+        missing = required.difference(file_data["data"])  # type: ignore
+        if not missing:
+            checks.passed += 1
+            continue
         for s in sheets_in_datamap:
-            if s in sheets_in_template_data[f]:
-                checks.append(
-                    Check(
-                        filename=f,
-                        sheet=s,
-                        proceed=True,
-                        state=CheckType.PASS,
-                        error_type=CheckType.UNDEFINED,
-                        msg=f"File {f} checked: OK.",
-                    )
-                )
-            else:
+            if s in missing:
                 checks.append(
                     Check(
                         filename=f,
@@ -353,103 +412,205 @@ def _hash_single_file(filepath: Path) -> str:
         raise FileNotFoundError(
             "Cannot find {} in order to calculate checksum".format(filepath)
         )
-    hash_obj = hashlib.md5(open(filepath, "rb").read())
+    hash_obj = hashlib.md5()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            hash_obj.update(chunk)
     return hash_obj.digest().hex()
 
 
+def _hash_files(list_of_files: List[Path]) -> Dict[Path, str]:
+    """Hash each file in list_of_files, in a pool of threads.
+
+    Returns a dict with the path of each file that exists as key and its md5 hash
+    as value. hashlib releases the GIL while hashing, so files are hashed in parallel.
+    """
+    existing = [f for f in list_of_files if os.path.isfile(f)]
+    if len(existing) < 2:
+        return {f: _hash_single_file(f) for f in existing}
+    with ThreadPoolExecutor() as pool:
+        return dict(zip(existing, pool.map(_hash_single_file, existing)))
+
+
 def _hash_target_files(list_of_files: List[Path]) -> Dict[str, str]:
     """Hash each file in list_of_files.
 
     Given a list of files, return a dict containing the file name as
     keys and md5 hash as value for each file.
     """
-    output = {}
-    for file_name in list_of_files:
-        if os.path.isfile(file_name):
-            hash_obj = hashlib.md5(open(file_name, "rb").read())
-            output.update({file_name.name: hash_obj.digest().hex()})
-    return output
+    return {Path(f).name: checksum for f, checksum in _hash_files(list_of_files).items()}
 
 
-def datamap_check(dm_file):
-    """Given a datamap csv file, returns a dict of the headers used in reality...
+def _worksheet_parts(zf: zipfile.ZipFile) -> Tuple[Dict[str, str], bool]:
+    """Map the title of each worksheet in the xlsx file zf to its part in the zip.
 
-    raises IndexError if less than three headers are found (type header can be None)
+    Also returns whether the workbook uses the 1904 date system.
     """
-    if ECHO_FUNC_YELLOW is not None:
-        ECHO_FUNC_YELLOW("Checking datamap file {}\n".format(dm_file))
+    workbook = fromstring(zf.read("xl/workbook.xml"))
+    rels = fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+    targets = {}
+    for rel in rels.iter(f"{{{PKG_REL_NS}}}Relationship"):
+        target = rel.get("Target", "")
+        target = target[1:] if target.startswith("/") else f"xl/{target}"
+        targets[rel.get("Id")] = target
+    parts = {}
+    for sheet in workbook.iter(f"{{{SHEET_MAIN_NS}}}sheet"):
+        part = targets.get(sheet.get(f"{{{REL_NS}}}id"), "")
+        if part.startswith("xl/worksheets/"):
+            parts[sheet.get("name")] = part
+    props = workbook.find(f"{{{SHEET_MAIN_NS}}}workbookPr")
+    date1904 = props is not None and props.get("date1904") in ("1", "true")
+    return parts, date1904
+
+
+def sheet_signatures(template_file: Union[Path, str]) -> Dict[str, str]:
+    """Return a signature for each worksheet in template_file, keyed by sheet title.
+
+    A signature is made from the CRC32 and size recorded in the zip's central
+    directory for the worksheet's part, and for the parts shared by all worksheets,
+    so no worksheet is decompressed. Two worksheets with the same signature hold
+    the same data. Returns an empty dict if template_file is not a readable xlsx file.
+    """
+    try:
+        with zipfile.ZipFile(template_file) as zf:
+            parts, date1904 = _worksheet_parts(zf)
+            infos = {info.filename: info for info in zf.infolist()}
+    except (BadZipFile, KeyError, OSError, SyntaxError, ValueError):
+        return {}
+    shared = ":".join(
+        f"{infos[part].CRC:08x}/{infos[part].file_size}" if part in infos else "-"
+        for part in SHARED_PARTS
+    )
+    shared = f"{shared}:{int(date1904)}"
+    return {
+        title: f"{shared}:{infos[part].CRC:08x}/{infos[part].file_size}"
+        for title, part in parts.items()
+        if part in infos
+    }
+
+
+_ENCODING_ERROR_MSG = (
+    "Incorrect encoding of datamap file. Please ensure "
+    "it is saved in Excel using CSV (Comma delimited) type - not CSV UTF-8 (Comma delimited) type."
+)
+
+
+def _check_datamap_header(header_line: str) -> Dict[str, Optional[str]]:
+    """Return the headers used in the first line of a datamap, or raise an exception."""
     _good_keys = ["cell_key", "cellkey", "key"]
     _good_sheet = ["template_sheet", "sheet", "templatesheet"]
     _good_cellref = ["cell_reference", "cell_ref", "cellref", "cellreference"]
     _good_type = ["type", "value_type", "cell_type", "celltype"]
-    headers = {}
+    headers: Dict[str, Optional[str]] = {}
     using_type = True
+    # initial check - have we got enough headers? If not - raise exception
+    top_row = header_line.rstrip().split(",")
+    if len(top_row) == 1:
+        # test for first char being ascii - if not, likely wrong encoding
+        if top_row[0] and not top_row[0][0].isascii():
+            raise DatamapFileEncodingError(_ENCODING_ERROR_MSG)
+        else:
+            raise MalFormedCSVHeaderException(
+                "Datamap contains only one header - need at least three to proceed. Quitting."
+            )
+    if len(top_row) == 2:
+        raise MalFormedCSVHeaderException(
+            "Datamap contains only two headers - need at least three to proceed. Quitting."
+        )
+    if top_row[0] and not top_row[0][0].isascii():
+        raise DatamapFileEncodingError(_ENCODING_ERROR_MSG)
+    if top_row[-1] not in _good_type:
+        # test if we are using type column here
+        headers.update(type=None)
+        using_type = False
+    if top_row[0] in _good_keys:
+        headers.update(key=top_row[0])
+    if top_row[1] in _good_sheet:
+        headers.update(sheet=top_row[1])
+    if top_row[2] in _good_cellref:
+        headers.update(cellref=top_row[2])
+    if using_type:
+        if top_row[3] in _good_type:
+            headers.update(type=top_row[3])
+    # final test - we don't want to proceed unless we have minimum headers
+    if not all(
+        [x in list(headers.keys()) for x in ["key", "sheet", "cellref", "type"]]
+    ):
+        raise MalFormedCSVHeaderException(
+            "Cannot proceed without required number of headers"
+        )
+    return headers
+
+
+def datamap_check(dm_file):
+    """Given a datamap csv file, returns a dict of the headers used in reality...
+
+    raises IndexError if less than three headers are found (type header can be None)
+    """
+    if ECHO_FUNC_YELLOW is not None:
+        ECHO_FUNC_YELLOW("Checking datamap file {}\n".format(dm_file))
     try:
         with DatamapFile(dm_file) as datamap_file:
-            # initial check - have we got enough headers? If not - raise exception
-            top_row = next(datamap_file).rstrip().split(",")
-            if len(top_row) == 1:
-                # test for first char being ascii - if not, likely wrong encoding
-                if not top_row[0][0].isascii():
-                    raise DatamapFileEncodingError(
-                        "Incorrect encoding of datamap file. Please ensure "
-                        "it is saved in Excel using CSV (Comma delimited) type - not CSV UTF-8 (Comma delimited) type."
-                    )
-                else:
-                    raise MalFormedCSVHeaderException(
-                        "Datamap contains only one header - need at least three to proceed. Quitting."
-                    )
-            if len(top_row) == 2:
-                raise MalFormedCSVHeaderException(
-                    "Datamap contains only two headers - need at least three to proceed. Quitting."
-                )
-            if not top_row[0][0].isascii():
-                raise DatamapFileEncodingError(
-                    "Incorrect encoding of datamap file. Please ensure "
-                    "it is saved in Excel using CSV (Comma delimited) type - not CSV UTF-8 (Comma delimited) type."
-                )
-            if top_row[-1] not in _good_type:
-                # test if we are using type column here
-                headers.update(type=None)
-                using_type = False
-            if top_row[0] in _good_keys:
-                headers.update(key=top_row[0])
-            if top_row[1] in _good_sheet:
-                headers.update(sheet=top_row[1])
-            if top_row[2] in _good_cellref:
-                headers.update(cellref=top_row[2])
-            if using_type:
-                if top_row[3] in _good_type:
-                    headers.update(type=top_row[3])
+            headers = _check_datamap_header(next(datamap_file, ""))
     except DatamapNotCSVException:
         raise
-    if len(headers.keys()) >= 2:
-        # final test - we don't want to proceed unless we have minimum headers
-        if not all(
-            [x in list(headers.keys()) for x in ["key", "sheet", "cellref", "type"]]
-        ):
-            raise MalFormedCSVHeaderException(
-                "Cannot proceed without required number of headers"
-            )
-        if ECHO_FUNC_GREEN is not None:
-            ECHO_FUNC_GREEN("{} checked ok\n".format(dm_file))
-        return headers
-    else:
-        return MalFormedCSVHeaderException(
-            "Datamap does not contain the required headers. Cannot proceed"
-        )
+    if ECHO_FUNC_GREEN is not None:
+        ECHO_FUNC_GREEN("{} checked ok\n".format(dm_file))
+    return headers
 
 
-def template_reader(template_file) -> Dict[str, Dict[str, Dict[Any, Any]]]:
+def _cell_bounds(cellrefs: Set[str]) -> Tuple[int, int]:
+    "The last row and column containing any of cellrefs, ignoring any which are invalid."
+    max_row = max_col = 0
+    for cellref in cellrefs:
+        try:
+            row, col = coordinate_to_tuple(cellref)
+        except (ValueError, TypeError):
+            continue
+        max_row, max_col = max(max_row, row), max(max_col, col)
+    return max_row, max_col
+
+
+def datamap_cells(datamaps) -> CELL_FILTER:
+    """The cells referred to by any of datamaps (CompiledDatamap objects), by sheet.
+
+    Passed to template_reader() when several datamaps are applied to the same
+    templates, so that the cells they need are read in a single pass.
+    """
+    cells: CELL_FILTER = {}
+    for datamap in datamaps:
+        for sheet, cellrefs in datamap.cellrefs_by_sheet.items():
+            cells.setdefault(sheet, set()).update(c for c in cellrefs if c)
+    return cells
+
+
+def template_reader(
+    template_file,
+    reuse: Optional[Dict[str, Dict[str, Dict[str, str]]]] = None,
+    cells: Optional[CELL_FILTER] = None,
+) -> Dict[str, Dict[str, Dict[Any, Any]]]:
     """Given a populated xlsx file, returns all data in a list of TemplateCell objects
 
     This test uses a fully formatted template file.
+
+    reuse may map sheet titles to data already extracted for those sheets (see
+    ExtractionCache.reusable_sheets()), in which case only the other sheets are
+    read from the file.
+
+    If cells is given (see datamap_cells()), only the sheets it names are read, as
+    far as the last row and column of the cells wanted from them, and only those
+    cells are returned.
     ."""
     logger.info(f"Starting import of {template_file}.")
     inner_dict: Dict[str, Dict[Any, Any]] = {"data": {}}
     f_path: Path = Path(template_file)
     try:
-        workbook = load_workbook(template_file, data_only=True)
+        # in read only mode, a worksheet is only parsed if its rows are read
+        workbook = load_workbook(
+            template_file,
+            data_only=True,
+            read_only=bool(reuse) or cells is not None,
+        )
     except TypeError:
         msg = (
             "Unable to open {}. Potential corruption of file. Try resaving "
@@ -468,15 +629,39 @@ def template_reader(template_file) -> Dict[str, Dict[str, Dict[Any, Any]]]:
         raise RuntimeError
     checksum: str = _hash_single_file(f_path)
     holding = []
+    reused = 0
     for sheet in workbook.worksheets:
         sheet_data: SHEET_DATA_IN_LST = []
         sheet_dict: Dict[str, Dict[str, Dict[str, str]]] = {}
+        if reuse and sheet.title in reuse:
+            sheet_dict.update({sheet.title: reuse[sheet.title]})
+            holding.append(sheet_dict)
+            reused += 1
+            continue
+        wanted = None
+        rows = sheet.rows
+        if cells is not None:
+            wanted = cells.get(sheet.title)
+            if wanted is None:
+                continue
+            max_row, max_col = _cell_bounds(wanted)
+            # iter_rows() reads every row if max_row is 0
+            rows = (
+                sheet.iter_rows(
+                    max_row=min(max_row, int(Config.TEMPLATE_ROW_LIMIT) + 1),
+                    max_col=max_col,
+                )
+                if max_row
+                else iter(())
+            )
         rowcnt = 0
-        for row in sheet.rows:
+        for row in rows:
             if rowcnt > int(Config.TEMPLATE_ROW_LIMIT):
                 break
             for cell in row:
                 if cell.value is not None:
+                    if wanted is not None and cell.coordinate not in wanted:
+                        continue
                     try:
                         val = cell.value.rstrip().lstrip()
                         c_type = DatamapLineValueType.TEXT
@@ -500,6 +685,13 @@ def template_reader(template_file) -> Dict[str, Dict[str, Dict[Any, Any]]]:
             rowcnt += 1
         sheet_dict.update({sheet.title: _extract_cellrefs(sheet_data)})
         holding.append(sheet_dict)
+    if reuse or cells is not None:
+        workbook.close()
+    if reuse:
+        logger.info(
+            f"Reused {reused} unchanged sheets and read "
+            f"{len(holding) - reused} from {f_path.name}."
+        )
     for sd in holding:
         inner_dict["data"].update(sd)
         inner_dict.update({"checksum": checksum})  # type: ignore
@@ -0,0 +1,76 @@
+# utils/locking.py
+#
+# Helpers for files which may be shared by several runs at once, in different
+# processes or on different machines using the same network share.
+
+import contextlib
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import IO, Iterator, Optional, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore
+    import msvcrt
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s: %(levelname)s - %(message)s",
+    datefmt="%d-%b-%y %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+
+@contextlib.contextmanager
+def atomic_write(
+    path: Union[Path, str], mode: str = "w", newline: Optional[str] = None
+) -> Iterator[IO]:
+    """Write the file at path so that readers see either the old or the new contents.
+
+    The contents are written to a temporary file, unique to this writer, in the same
+    directory, which then replaces path. If the block raises, path is left as it was.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=f".{path.name}.", suffix=".tmp", dir=path.parent
+    )
+    encoding = None if "b" in mode else "utf-8"
+    try:
+        with os.fdopen(fd, mode, encoding=encoding, newline=newline) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+
+
+@contextlib.contextmanager
+def locked(path: Union[Path, str]) -> Iterator[None]:
+    """Hold an exclusive lock on the lock file at path, waiting for it if necessary.
+
+    POSIX record locks are used, which are honoured across hosts by network file
+    systems that support locking.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a+b") as lock_file:
+        if fcntl is not None:
+            fcntl.lockf(lock_file, fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.lockf(lock_file, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
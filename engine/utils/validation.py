@@ -1,7 +1,13 @@
-from dataclasses import dataclass
-from typing import Dict, List
+import hashlib
+import json
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Tuple
 
 from engine.config import Config
+from engine.serializers.datamap import DatamapEncoder
+
+# increment when the validation rules below change
+VALIDATION_RULES_VERSION = 1
 
 
 @dataclass
@@ -152,19 +158,104 @@ def validate_line(
     return v
 
 
-def validation_checker(dm_data, tmp_data) -> List["ValidationCheck"]:
-    checks = []
-    files = tmp_data.keys()
-    for d in dm_data:
-        sheet = d["sheet"]
-        for f in files:
-            data = tmp_data[f]["data"]
-            sheets = data.keys()
-            for s in sheets:
-                if s == sheet:
-                    sdata = data[sheet]
-                    if not sdata:
-                        continue
-                    vout = validate_line(d, data[sheet])
-                    checks.append(vout.validation_check)
-    return checks
+def validation_key(dm_data) -> str:
+    "Identify the datamap and validation rules which produce a set of checks."
+    return hashlib.md5(
+        json.dumps(
+            [VALIDATION_RULES_VERSION, Config.ACCEPTABLE_VALIDATION_TYPES, dm_data],
+            sort_keys=True,
+            cls=DatamapEncoder,
+        ).encode("utf-8")
+    ).hexdigest()
+
+
+def _file_name_in(data) -> str:
+    for sdata in data.values():
+        for cell in sdata.values():
+            return cell["file_name"]
+    return ""
+
+
+class ValidationCollector:
+    """Collects the checks made by validation_checker(), a file at a time.
+
+    For each file, call from_cache() and, if it returns False, check() for each
+    datamap line with a sheet in the file (or check_file() to check them all),
+    then end_file(). checks then holds the checks for every file, ordered by
+    datamap line, then file. This lets a use case validate each cell in the same
+    pass as it does other work with it.
+
+    If cache is given (see ExtractionCache), the checks for each file are stored
+    in it, and reused for files which are unchanged when validated against the
+    same datamap again.
+    """
+
+    def __init__(self, dm_data, cache=None) -> None:
+        self._checks_by_line: List[List["ValidationCheck"]] = [[] for _ in dm_data]
+        self._cache = cache
+        self._key = validation_key(dm_data) if cache is not None else None
+        self._file_checks: List[Tuple[int, Dict[str, str]]] = []
+        self.lines_by_sheet: Dict[str, List[Tuple[int, Any]]] = {}
+        for idx, d in enumerate(dm_data):
+            self.lines_by_sheet.setdefault(d["sheet"], []).append((idx, d))
+
+    @property
+    def checks(self) -> List["ValidationCheck"]:
+        return [check for line_checks in self._checks_by_line for check in line_checks]
+
+    def from_cache(self, checksum: str, data) -> bool:
+        "Take the checks for the file with checksum and data from the cache, if they are there."
+        if self._cache is None:
+            return False
+        cached = self._cache.get_validation(checksum, self._key)
+        if cached is None:
+            return False
+        file_name = _file_name_in(data)
+        for idx, check in cached:
+            self._checks_by_line[idx].append(
+                ValidationCheck(**dict(check, filename=file_name))
+            )
+        return True
+
+    def check(self, idx: int, dm_line, sheet_data) -> None:
+        "Validate the cell referred to by the datamap line at position idx, on a non-empty sheet."
+        vout = validate_line(dm_line, sheet_data)
+        self._checks_by_line[idx].append(vout.validation_check)
+        if self._cache is not None:
+            self._file_checks.append((idx, asdict(vout.validation_check)))
+
+    def check_file(self, data) -> None:
+        "Validate the cells referred to by every datamap line in a file's data."
+        for sheet, sheet_lines in self.lines_by_sheet.items():
+            sdata = data.get(sheet)
+            if not sdata:
+                continue
+            for idx, d in sheet_lines:
+                self.check(idx, d, sdata)
+
+    def end_file(self, checksum: str) -> None:
+        "Store the checks made since from_cache() for the file with checksum."
+        if self._cache is not None:
+            self._cache.put_validation(checksum, self._key, self._file_checks)
+        self._file_checks = []
+
+
+def validation_checker(dm_data, tmp_data, cache=None) -> List["ValidationCheck"]:
+    """Validate the cell referred to by each datamap line, in every file.
+
+    dm_data is a list of DatamapLine objects, or of the dicts DatamapEncoder makes of them.
+
+    If cache is given (see ExtractionCache), the checks for each file are stored
+    in it, and reused for files which are unchanged when validated against the
+    same datamap again.
+    """
+    # visit each file once, as its data may have to be read from disk, but
+    # return the checks ordered by datamap line, then file
+    collector = ValidationCollector(dm_data, cache)
+    for f in tmp_data.keys():
+        file_data = tmp_data[f]
+        if collector.from_cache(file_data["checksum"], file_data["data"]):
+            continue
+        collector.check_file(file_data["data"])
+        collector.end_file(file_data["checksum"])
+    return collector.checks
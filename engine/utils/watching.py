@@ -0,0 +1,188 @@
+# utils/watching.py
+#
+# Watch a directory for files being added, changed or removed. On Linux the
+# kernel's inotify interface is used, through ctypes, so that waiting for a
+# change costs nothing; elsewhere, or if inotify is unavailable, the
+# directory is listed at intervals and compared with the previous listing.
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Optional, Set, Tuple, Union
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s: %(levelname)s - %(message)s",
+    datefmt="%d-%b-%y %H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+# seconds between listings of a directory by PollingWatcher
+POLL_INTERVAL = 2.0
+
+# from <sys/inotify.h>
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_WATCH_MASK = (
+    _IN_MODIFY
+    | _IN_ATTRIB
+    | _IN_CLOSE_WRITE
+    | _IN_MOVED_FROM
+    | _IN_MOVED_TO
+    | _IN_CREATE
+    | _IN_DELETE
+    | _IN_DELETE_SELF
+    | _IN_MOVE_SELF
+)
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def _is_relevant(name: str) -> bool:
+    """False for hidden files, and the temporary and lock files made by editors."""
+    return not (name.startswith((".", "~$")) or name.endswith((".tmp", "~")))
+
+
+class PollingWatcher:
+    """Reports changes to the files in directory by listing it every interval seconds."""
+
+    def __init__(
+        self, directory: Union[Path, str], interval: Optional[float] = None
+    ) -> None:
+        self.directory = Path(directory)
+        self.interval = interval if interval is not None else POLL_INTERVAL
+        self._snapshot = self._listing()
+
+    def _listing(self) -> Dict[str, Tuple[int, int, int]]:
+        listing = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not _is_relevant(entry.name):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:  # removed while listing
+                    continue
+                listing[entry.name] = (st.st_size, st.st_mtime_ns, st.st_ino)
+        return listing
+
+    def changes(self, timeout: Optional[float] = None) -> Set[str]:
+        """Wait up to timeout seconds (or indefinitely) for changes, and return the names changed."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            listing = self._listing()
+            changed = {
+                name
+                for name in listing.keys() | self._snapshot.keys()
+                if listing.get(name) != self._snapshot.get(name)
+            }
+            self._snapshot = listing
+            if changed:
+                return changed
+            if deadline is None:
+                time.sleep(self.interval)
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return set()
+            time.sleep(min(self.interval, remaining))
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyWatcher:
+    """Reports changes to the files in directory using Linux's inotify.
+
+    Raises OSError if inotify is not available.
+    """
+
+    def __init__(self, directory: Union[Path, str]) -> None:
+        self.directory = Path(directory)
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        try:
+            inotify_init1 = libc.inotify_init1
+            inotify_add_watch = libc.inotify_add_watch
+        except AttributeError:
+            raise OSError(f"inotify is not available in {libc_name}")
+        inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._fd = inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        if inotify_add_watch(self._fd, os.fsencode(self.directory), _WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, os.strerror(errno), str(self.directory))
+
+    def changes(self, timeout: Optional[float] = None) -> Set[str]:
+        """Wait up to timeout seconds (or indefinitely) for changes, and return the names changed."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            remaining = (
+                None if deadline is None else max(0.0, deadline - time.monotonic())
+            )
+            readable, _, _ = select.select([self._fd], [], [], remaining)
+            if not readable:
+                return set()
+            changed = self._read_events()
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+
+    def _read_events(self) -> Set[str]:
+        changed = set()
+        try:
+            buf = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(buf):
+            _wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(buf, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(buf[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & (_IN_DELETE_SELF | _IN_MOVE_SELF):
+                logger.warning(f"Watched directory {self.directory} has been removed.")
+                changed.add("")
+            elif name and _is_relevant(name):
+                changed.add(name)
+        return changed
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def directory_watcher(
+    directory: Union[Path, str], poll_interval: Optional[float] = None
+):
+    """Return an InotifyWatcher for directory on Linux, or a PollingWatcher otherwise.
+
+    A PollingWatcher is also returned if poll_interval is given, which is needed
+    for directories on network file systems, where inotify does not see changes
+    made by other machines.
+    """
+    if sys.platform.startswith("linux") and poll_interval is None:
+        try:
+            return InotifyWatcher(directory)
+        except OSError as e:
+            logger.warning(f"Cannot use inotify ({e}). Polling {directory} instead.")
+    return PollingWatcher(directory, interval=poll_interval)
@@ -1,7 +1,17 @@
+import shutil
+from pathlib import Path
+
 import pytest
 
-from engine.adapters.cli import import_and_create_master, write_master_to_templates
+from engine.adapters.cli import (
+    import_and_create_master,
+    import_and_create_masters_for_datamaps,
+    write_master_to_templates,
+)
 from engine.config import Config
+from engine.repository.journal import RunJournal
+from engine.utils.cancellation import RunStatus
+from engine.utils.extraction import _hash_single_file, template_reader
 
 
 @pytest.mark.skip("Do not run this in the suite - it does not use test config")
@@ -14,3 +24,48 @@ def test_create_master_in_memory():
 def test_populate_blanks_from_master(mock_config, blank_template, datamap, master):
     Config.initialise()
     write_master_to_templates(blank_template, datamap, master)
+
+
+def _echo_funcs(monkeypatch):
+    # the echo functions are set on the parsing module, so restore them afterwards
+    for name in ["GREEN", "RED", "YELLOW", "WHITE"]:
+        monkeypatch.setattr(
+            f"engine.use_cases.parsing.ECHO_FUNC_{name}", None, raising=False
+        )
+    return {
+        f"click_echo_{colour}": lambda *args: None
+        for colour in ["green", "red", "yellow", "white"]
+    }
+
+
+def test_resume_without_cache_checkpoints_whole_templates_for_several_datamaps(
+    mock_config, template, datamap_match_test_template, monkeypatch
+):
+    mock_config.initialise()
+    input_dir = Path(mock_config.PLATFORM_DOCS_DIR) / "input"
+    shutil.copy2(template, input_dir)
+    shutil.copy2(datamap_match_test_template, input_dir / "finance.csv")
+    # keep the journal after the master is written, to see what was checkpointed
+    monkeypatch.setattr(RunJournal, "remove", lambda self: None)
+    status = import_and_create_masters_for_datamaps(
+        _echo_funcs(monkeypatch), ["finance.csv"], nocache=True, resume=True
+    )
+    assert list(status.values()) == [RunStatus.COMPLETE]
+    target = input_dir / "test_template.xlsx"
+    assert RunJournal(input_dir).completed(
+        target, _hash_single_file(target)
+    ) == template_reader(target)
+
+
+def test_resume_with_keys_selected_is_refused(
+    mock_config, template, datamap_match_test_template, monkeypatch
+):
+    mock_config.initialise()
+    input_dir = Path(mock_config.PLATFORM_DOCS_DIR) / "input"
+    shutil.copy2(template, input_dir)
+    shutil.copy2(datamap_match_test_template, input_dir / "finance.csv")
+    with pytest.raises(SystemExit):
+        import_and_create_masters_for_datamaps(
+            _echo_funcs(monkeypatch), ["finance.csv"], keys=["String Key"], resume=True
+        )
+    assert not list((Path(mock_config.PLATFORM_DOCS_DIR) / "output").glob("*.xlsx"))
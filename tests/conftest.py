@@ -355,6 +355,15 @@ def blank_org_template():
     return Path(Path.cwd() / "tests/resources/blank_template_password_removed.xlsm")
 
 
+@pytest.fixture(autouse=True)
+def isolated_data_dir(tmp_path, monkeypatch):
+    """Keep the caches, manifests and journals of every test out of the user's data directory.
+
+    mock_config, where used, points the data directory elsewhere in /tmp instead.
+    """
+    monkeypatch.setattr(Config, "DATAMAPS_LIBRARY_DATA_DIR", tmp_path / "datamaps-data")
+
+
 @pytest.fixture
 def mock_config(monkeypatch):
     monkeypatch.setattr(Config, "PLATFORM_DOCS_DIR", Path("/tmp/Documents/datamaps"))
@@ -379,6 +388,31 @@ def mock_config(monkeypatch):
         pass
 
 
+@pytest.fixture
+def forbid_call(monkeypatch):
+    """Replace a function, as monkeypatch.setattr() would, so that calling it fails the test.
+
+    Use to check that work is taken from a cache rather than done again, alongside
+    checks that the result is the same as if the work had been done.
+    """
+
+    def _forbid(target, name=None):
+        if name is None:
+            label = target
+        else:
+            label = f"{getattr(target, '__name__', target)}.{name}"
+
+        def _fail(*args, **kwargs):
+            raise AssertionError(f"{label} should not have been called.")
+
+        if name is None:
+            monkeypatch.setattr(target, _fail)
+        else:
+            monkeypatch.setattr(target, name, _fail)
+
+    return _forbid
+
+
 @pytest.fixture
 def org_test_files_dir():
     return Path.cwd() / "tests" / "resources" / "org_templates"
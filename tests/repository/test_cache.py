@@ -0,0 +1,188 @@
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from engine.repository.cache import ExtractionCache, extraction_version
+from engine.repository.templates import InMemoryPopulatedTemplatesRepository
+from engine.use_cases.parsing import extract_from_multiple_xlsx_files
+from engine.utils.extraction import (
+    _hash_single_file,
+    sheet_signatures,
+    template_reader,
+)
+from openpyxl import load_workbook
+
+
+def test_cache_returns_stored_extraction(mock_config, template):
+    mock_config.initialise()
+    cache = ExtractionCache()
+    cache.put(template_reader(template))
+    assert len(cache) == 1
+    data = cache.get(template, _hash_single_file(template))
+    assert data == template_reader(template)
+
+
+def test_cache_miss_on_changed_checksum_or_version(mock_config, template):
+    mock_config.initialise()
+    cache = ExtractionCache()
+    cache.put(template_reader(template))
+    assert cache.get(template, "not-the-checksum") is None
+    other = ExtractionCache(version=extraction_version(row_limit=10))
+    assert other.get(template, _hash_single_file(template)) is None
+
+
+def test_cache_entry_shared_by_identical_files(mock_config, template):
+    mock_config.initialise()
+    copy = Path(mock_config.PLATFORM_DOCS_DIR) / "input" / "renamed.xlsx"
+    shutil.copy2(template, copy)
+    cache = ExtractionCache()
+    cache.put(template_reader(template))
+    data = cache.get(copy, _hash_single_file(copy))
+    assert list(data) == ["renamed.xlsx"]
+    assert data["renamed.xlsx"]["data"]["Summary"]["B3"]["file_name"] == (
+        copy.as_posix()
+    )
+
+
+def test_cache_evicts_least_recently_used(mock_config, template):
+    mock_config.initialise()
+    cache = ExtractionCache()
+    first = template_reader(template)["test_template.xlsx"]
+    cache.put({"a.xlsx": dict(first, checksum="a")})
+    cache.put({"b.xlsx": dict(first, checksum="b")})
+    cache.get(template, "a")
+    cache.max_size = cache.size - 1
+    cache.evict()
+    assert cache.get(template, "a") is not None
+    assert cache.get(template, "b") is None
+
+
+def test_cache_evicts_in_batches(mock_config, template):
+    mock_config.initialise()
+    cache = ExtractionCache()
+    first = template_reader(template)["test_template.xlsx"]
+    cache.put({"00.xlsx": dict(first, checksum="00")})
+    cache.max_size = 10 * cache.size
+    for n in range(1, 11):
+        cache.put({f"{n:02}.xlsx": dict(first, checksum=f"{n:02}")})
+    # the cache is reduced to 90% of max_size, so the two oldest entries go at once
+    assert len(cache) == 9
+    assert cache.lookup(template, "00") is None
+    assert cache.lookup(template, "01") is None
+    assert cache.lookup(template, "02") is not None
+
+
+def test_cache_hit_recorded_when_cache_closed(mock_config, template):
+    mock_config.initialise()
+    cache = ExtractionCache()
+    cache.put(template_reader(template))
+    checksum = _hash_single_file(template)
+    query = "SELECT last_used FROM extractions WHERE checksum = ?"
+    (stored,) = cache._conn.execute(query, (checksum,)).fetchone()
+    assert cache.get(template, checksum) is not None
+    assert not cache._conn.in_transaction
+    assert cache._conn.execute(query, (checksum,)).fetchone() == (stored,)
+    cache.close()
+    conn = sqlite3.connect(str(cache.path))
+    try:
+        (used,) = conn.execute(query, (checksum,)).fetchone()
+    finally:
+        conn.close()
+    assert used > stored
+
+
+def test_repeated_import_uses_cache(mock_config, template, forbid_call):
+    mock_config.initialise()
+    input_dir = Path(mock_config.PLATFORM_DOCS_DIR) / "input"
+    shutil.copy2(template, input_dir)
+    expected = template_reader(input_dir / "test_template.xlsx")
+    assert InMemoryPopulatedTemplatesRepository(input_dir).list_as_objs() == expected
+    forbid_call("engine.use_cases.parsing.template_reader")
+    assert InMemoryPopulatedTemplatesRepository(input_dir).list_as_objs() == expected
+
+
+def test_claim_refused_while_another_run_holds_it(mock_config, template):
+    mock_config.initialise()
+    ours = ExtractionCache()
+    theirs = ExtractionCache()
+    assert theirs.claim("abc")
+    assert not ours.claim("abc")
+    theirs.release_claims()
+    assert ours.claim("abc")
+    ours.put(
+        {
+            "a.xlsx": dict(
+                template_reader(template)["test_template.xlsx"], checksum="abc"
+            )
+        }
+    )
+    # once published, nobody needs to extract it
+    assert not theirs.claim("abc")
+
+
+def test_extraction_waits_for_file_claimed_by_another_run(
+    mock_config, template, monkeypatch, forbid_call
+):
+    mock_config.initialise()
+    input_dir = Path(mock_config.PLATFORM_DOCS_DIR) / "input"
+    shutil.copy2(template, input_dir)
+    target = input_dir / "test_template.xlsx"
+    checksum = _hash_single_file(target)
+    expected = template_reader(target)
+    claimed = threading.Event()
+
+    def _other_run():
+        theirs = ExtractionCache()
+        theirs.claim(checksum)
+        claimed.set()
+        time.sleep(0.3)
+        theirs.put(expected)
+        theirs.close()
+
+    forbid_call("engine.use_cases.parsing.template_reader")
+    monkeypatch.setattr("engine.use_cases.parsing.CLAIM_POLL_INTERVAL", 0.05)
+    other = threading.Thread(target=_other_run)
+    other.start()
+    claimed.wait()
+    data = extract_from_multiple_xlsx_files([target], cache=ExtractionCache())
+    other.join()
+    assert data == expected
+
+
+def _resubmitted(template, input_dir):
+    "Save template as it is, and with a value changed on one sheet only."
+    original = input_dir / "original.xlsx"
+    load_workbook(template).save(original)
+    wb = load_workbook(original)
+    wb["Another Sheet"]["B3"].value = "Changed"
+    resubmitted = input_dir / "resubmitted.xlsx"
+    wb.save(resubmitted)
+    return original, resubmitted
+
+
+def test_cache_reuses_unchanged_sheets_of_changed_file(mock_config, template):
+    mock_config.initialise()
+    input_dir = Path(mock_config.PLATFORM_DOCS_DIR) / "input"
+    original, resubmitted = _resubmitted(template, input_dir)
+    before, after = sheet_signatures(original), sheet_signatures(resubmitted)
+    assert before["Summary"] == after["Summary"]
+    assert before["Another Sheet"] != after["Another Sheet"]
+    cache = ExtractionCache()
+    cache.put(template_reader(original), {_hash_single_file(original): before})
+    reuse = cache.reusable_sheets(resubmitted, after)
+    assert list(reuse) == ["Summary"]
+    assert reuse["Summary"]["B3"]["file_name"] == resubmitted.as_posix()
+    assert template_reader(resubmitted, reuse) == template_reader(resubmitted)
+
+
+def test_changed_file_extracted_with_sheets_from_cache(mock_config, template, caplog):
+    mock_config.initialise()
+    input_dir = Path(mock_config.PLATFORM_DOCS_DIR) / "input"
+    original, resubmitted = _resubmitted(template, input_dir)
+    extract_from_multiple_xlsx_files([original], cache=ExtractionCache())
+    data = extract_from_multiple_xlsx_files([resubmitted], cache=ExtractionCache())
+    assert "1 of 2 sheets in resubmitted.xlsx are unchanged" in caplog.text
+    assert data["resubmitted.xlsx"]["data"]["Another Sheet"]["B3"]["value"] == "Changed"
+    assert data == template_reader(resubmitted)
@@ -1,12 +1,19 @@
 # type: ignore
 
 import json
+import os
 import pathlib
+import shutil
 
 import pytest
-from engine.exceptions import DatamapNotCSVException
-from engine.repository.datamap import InMemorySingleDatamapRepository
-from engine.utils.extraction import extract_zip_file_to_tmpdir
+from engine.domain.datamap import CompiledDatamap, KeyFilter
+from engine.exceptions import DatamapNotCSVException, NoKeysSelectedError
+from engine.repository.datamap import (
+    InMemorySingleDatamapRepository,
+    _compiled_path,
+    compile_datamap,
+)
+from engine.utils.extraction import datamap_reader, extract_zip_file_to_tmpdir
 
 
 def test_datamapline_repository_single_file_repo(datamap, datamapline_list_objects):
@@ -27,3 +34,134 @@ def test_template_zip_repo(templates_zipped):
     _, templates = extract_zip_file_to_tmpdir(templates_zipped)
     for t in [x for x in list(templates) if isinstance(x, pathlib.Path)]:
         assert "test_" in t.name
+
+
+def test_compiled_datamap_indexes_lines(mock_config, datamap_match_test_template):
+    mock_config.initialise()
+    compiled = compile_datamap(datamap_match_test_template)
+    assert compiled.is_typed
+    assert compiled.cellref_for[("String Key", "Summary")] == "B3"
+    assert "B2" in compiled.cellrefs_by_sheet["Summary"]
+    assert "Another Sheet" in compiled.sheets
+    line = compiled.line_for_key["String Key"]
+    assert (line.sheet, line["cellref"]) == ("Summary", "B3")
+    assert compiled.key_at[("Summary", "B3")] == "String Key"
+    assert line in compiled.lines_by_sheet["Summary"]
+    with pytest.raises(AttributeError):
+        line.extra = "no __dict__ on a slotted line"
+
+
+def test_compiled_datamap_loaded_from_disk(
+    mock_config, datamap_match_test_template, monkeypatch, forbid_call
+):
+    mock_config.initialise()
+    monkeypatch.setattr("engine.repository.datamap._COMPILED", {})
+    compile_datamap(datamap_match_test_template)
+    monkeypatch.setattr("engine.repository.datamap._COMPILED", {})
+    expected = [x.to_dict() for x in datamap_reader(datamap_match_test_template)]
+    forbid_call("engine.repository.datamap.read_datamap")
+    repo = InMemorySingleDatamapRepository(datamap_match_test_template)
+    assert [x.to_dict() for x in repo.list_as_objs()] == expected
+
+
+def test_compiled_datamap_stored_as_json_and_rebuilt_if_unreadable(
+    mock_config, datamap_match_test_template, monkeypatch
+):
+    mock_config.initialise()
+    monkeypatch.setattr("engine.repository.datamap._COMPILED", {})
+    first = compile_datamap(datamap_match_test_template)
+    compiled_path = _compiled_path(first.source_hash)
+    with open(compiled_path, encoding="utf-8") as f:
+        assert json.load(f)["lines"][0] == first.lines[0].to_dict()
+    compiled_path.write_bytes(b"\x80\x04truncated")
+    monkeypatch.setattr("engine.repository.datamap._COMPILED", {})
+    rebuilt = compile_datamap(datamap_match_test_template)
+    assert [x.to_dict() for x in rebuilt.lines] == [x.to_dict() for x in first.lines]
+    with open(compiled_path, encoding="utf-8") as f:
+        assert CompiledDatamap.from_dict(json.load(f)).keys == first.keys
+
+
+def test_compiled_datamaps_of_earlier_versions_and_beyond_limit_removed(
+    mock_config, datamap_match_test_template, monkeypatch
+):
+    mock_config.initialise()
+    monkeypatch.setattr("engine.repository.datamap._COMPILED", {})
+    monkeypatch.setattr("engine.repository.datamap.COMPILED_DATAMAP_LIMIT", 2)
+    datamaps = []
+    for name in ["a", "b", "c"]:
+        datamap = pathlib.Path(mock_config.PLATFORM_DOCS_DIR) / "input" / f"{name}.csv"
+        shutil.copy2(datamap_match_test_template, datamap)
+        datamaps.append(datamap)
+    first = compile_datamap(datamaps[0])
+    directory = _compiled_path(first.source_hash).parent
+    stale = [directory / f"{'0' * 32}.v1.pickle", directory / f"{'1' * 32}.v2.json"]
+    for path in stale:
+        path.write_bytes(b"stale")
+    os.utime(_compiled_path(first.source_hash), ns=(0, 0))
+    second = compile_datamap(datamaps[1])
+    third = compile_datamap(datamaps[2])
+    assert sorted(p.name for p in directory.iterdir()) == sorted(
+        _compiled_path(c.source_hash).name for c in [second, third]
+    )
+
+
+def test_datamap_lines_not_shared_between_repositories(
+    mock_config, datamap_match_test_template
+):
+    mock_config.initialise()
+    lines = InMemorySingleDatamapRepository(datamap_match_test_template).list_as_objs()
+    expected = [x.to_dict() for x in lines]
+    lines.clear()
+    repo = InMemorySingleDatamapRepository(datamap_match_test_template)
+    assert [x.to_dict() for x in repo.list_as_objs()] == expected
+
+
+def test_compiled_datamap_reported_checked_when_taken_from_cache(
+    mock_config, datamap_match_test_template, monkeypatch
+):
+    mock_config.initialise()
+    echoed = []
+    monkeypatch.setattr("engine.utils.extraction.ECHO_FUNC_YELLOW", echoed.append)
+    monkeypatch.setattr("engine.utils.extraction.ECHO_FUNC_GREEN", echoed.append)
+    monkeypatch.setattr("engine.repository.datamap._COMPILED", {})
+    compile_datamap(datamap_match_test_template)
+    fresh = list(echoed)
+    assert fresh[-1] == f"{datamap_match_test_template} checked ok\n"
+    for _ in range(2):
+        # from memory, then from disk
+        echoed.clear()
+        compile_datamap(datamap_match_test_template)
+        assert echoed == fresh
+        monkeypatch.setattr("engine.repository.datamap._COMPILED", {})
+
+
+def test_compiled_datamap_recompiled_when_changed(
+    mock_config, datamap_match_test_template
+):
+    mock_config.initialise()
+    dm = pathlib.Path(mock_config.PLATFORM_DOCS_DIR) / "input" / "datamap.csv"
+    shutil.copy2(datamap_match_test_template, dm)
+    assert len(compile_datamap(dm).lines) == 4
+    with open(dm, "a") as f:
+        f.write("Extra Key,Summary,B10,TEXT\n")
+    assert len(compile_datamap(dm).lines) == 5
+
+
+def test_datamap_repository_selects_keys(mock_config, datamap_match_test_template):
+    mock_config.initialise()
+    by_glob = InMemorySingleDatamapRepository(
+        datamap_match_test_template, key_filter=KeyFilter(globs=["*Date*"])
+    )
+    assert [x.key for x in by_glob.list_as_objs()] == ["Date Key", "Funny Date"]
+    by_regex = InMemorySingleDatamapRepository(
+        datamap_match_test_template,
+        key_filter=KeyFilter(keys=["String Key"], regex="^Big"),
+    )
+    assert by_regex.compiled.keys == {"String Key", "Big Float"}
+    assert by_regex.is_typed
+    with pytest.raises(NoKeysSelectedError):
+        InMemorySingleDatamapRepository(
+            datamap_match_test_template, key_filter=KeyFilter(keys=["Missing"])
+        )
+    with pytest.raises(ValueError):
+        KeyFilter(regex="(")
@@ -0,0 +1,91 @@
+import shutil
+from pathlib import Path
+
+from engine.repository.datamap import InMemorySingleDatamapRepository
+from engine.repository.journal import RunJournal
+from engine.repository.master import MasterOutputRepository
+from engine.repository.templates import InMemoryPopulatedTemplatesRepository
+from engine.use_cases.parsing import CreateMasterUseCase
+from engine.use_cases.parsing import extract_from_multiple_xlsx_files
+from engine.utils.extraction import _hash_single_file, template_reader
+from openpyxl import load_workbook
+
+
+def test_journal_records_completed_file(mock_config, template):
+    mock_config.initialise()
+    journal = RunJournal(mock_config.PLATFORM_DOCS_DIR / "input")
+    journal.record(template_reader(template))
+    resumed = RunJournal(mock_config.PLATFORM_DOCS_DIR / "input")
+    assert len(resumed) == 1
+    data = resumed.completed(template, _hash_single_file(template))
+    assert data["test_template.xlsx"]["data"]["Summary"]["B3"]["value"] == (
+        "This is a string"
+    )
+
+
+def test_journal_ignores_changed_file(mock_config, template):
+    mock_config.initialise()
+    journal = RunJournal(mock_config.PLATFORM_DOCS_DIR / "input")
+    journal.record(template_reader(template))
+    resumed = RunJournal(mock_config.PLATFORM_DOCS_DIR / "input")
+    assert resumed.completed(template, "not-the-checksum") is None
+
+
+def test_journal_removed_by_another_run_is_not_used(mock_config, template):
+    mock_config.initialise()
+    journal = RunJournal(mock_config.PLATFORM_DOCS_DIR / "input")
+    journal.record(template_reader(template))
+    other = RunJournal(mock_config.PLATFORM_DOCS_DIR / "input")
+    journal.remove()
+    assert not journal.path.exists()
+    assert other.completed(template, _hash_single_file(template)) is None
+
+
+def test_journal_kept_only_for_resumable_import_until_master_written(
+    mock_config, datamap_match_test_template, template
+):
+    mock_config.initialise()
+    input_dir = Path(mock_config.PLATFORM_DOCS_DIR) / "input"
+    shutil.copy2(template, input_dir)
+    dm_repo = InMemorySingleDatamapRepository(datamap_match_test_template)
+    journal_path = RunJournal(input_dir).path
+    tmpl_repo = InMemoryPopulatedTemplatesRepository(input_dir, use_cache=False)
+    tmpl_repo.list_as_objs()
+    assert tmpl_repo.journal is None
+    assert not journal_path.exists()
+
+    tmpl_repo = InMemoryPopulatedTemplatesRepository(
+        input_dir, resume=True, use_cache=False
+    )
+    tmpl_repo.list_as_objs()
+    assert journal_path.exists()
+    CreateMasterUseCase(dm_repo, tmpl_repo, MasterOutputRepository).execute(
+        "master.xlsx"
+    )
+    assert not journal_path.exists()
+    wb = load_workbook(Path(mock_config.PLATFORM_DOCS_DIR) / "output" / "master.xlsx")
+    assert wb["Master"]["B3"].value == "This is a string"
+
+
+def test_journal_tolerates_incomplete_last_entry(mock_config, template):
+    mock_config.initialise()
+    journal = RunJournal(mock_config.PLATFORM_DOCS_DIR / "input")
+    journal.record(template_reader(template))
+    with open(journal.path, "a") as f:
+        f.write('{"file_name": "test_template2.xlsx", "checks')
+    resumed = RunJournal(mock_config.PLATFORM_DOCS_DIR / "input")
+    assert len(resumed) == 1
+
+
+def test_resumed_extraction_skips_completed_files(mock_config, template, forbid_call):
+    mock_config.initialise()
+    input_dir = Path(mock_config.PLATFORM_DOCS_DIR) / "input"
+    shutil.copy2(template, input_dir)
+    target = input_dir / "test_template.xlsx"
+    expected = template_reader(target)
+    journal = RunJournal(input_dir)
+    journal.record(expected)
+    resumed = RunJournal(input_dir)
+    forbid_call("engine.use_cases.parsing.template_reader")
+    data = extract_from_multiple_xlsx_files([target], journal=resumed)
+    assert data == expected
@@ -0,0 +1,106 @@
+import hashlib
+import os
+import shutil
+import zipfile
+from pathlib import Path
+
+from engine.repository.manifest import InputManifest
+from engine.repository.templates import (
+    InMemoryPopulatedTemplatesRepository,
+    InMemoryPopulatedTemplatesZip,
+)
+from engine.utils.extraction import get_xlsx_files
+
+
+def _input_with_templates(config, template, count):
+    input_dir = Path(config.PLATFORM_DOCS_DIR) / "input"
+    for n in range(count):
+        shutil.copy2(template, input_dir / f"template_{n}.xlsx")
+    return input_dir, sorted(get_xlsx_files(input_dir))
+
+
+def test_manifest_hashes_new_files(mock_config, template):
+    mock_config.initialise()
+    input_dir, files = _input_with_templates(mock_config, template, 3)
+    manifest = InputManifest(input_dir)
+    checksums = manifest.scan(files)
+    expected = hashlib.md5(open(template, "rb").read()).digest().hex()
+    assert set(checksums.values()) == {expected}
+    assert manifest.changed == files
+
+
+def test_manifest_skips_unchanged_files(mock_config, template, forbid_call):
+    mock_config.initialise()
+    input_dir, files = _input_with_templates(mock_config, template, 50)
+    first = InputManifest(input_dir).scan(files)
+    forbid_call("engine.utils.extraction._hash_single_file")
+    manifest = InputManifest(input_dir)
+    assert manifest.scan(files) == first
+    assert manifest.changed == []
+
+
+def test_manifest_detects_changed_and_removed_files(mock_config, template):
+    mock_config.initialise()
+    input_dir, files = _input_with_templates(mock_config, template, 3)
+    InputManifest(input_dir).scan(files)
+    with open(files[0], "ab") as f:
+        f.write(b"\0")
+    os.remove(files[2])
+    manifest = InputManifest(input_dir)
+    checksums = manifest.scan(files[:2])
+    assert manifest.changed == [files[0]]
+    assert manifest.removed == [str(files[2])]
+    assert checksums[files[0]] != checksums[files[1]]
+
+
+def test_file_copied_over_with_same_size_and_mtime_is_extracted_again(
+    mock_config, template
+):
+    mock_config.initialise()
+    input_dir = Path(mock_config.PLATFORM_DOCS_DIR) / "input"
+    target = input_dir / "test_template.xlsx"
+    replacement = Path(mock_config.PLATFORM_DOCS_DIR) / "replacement.xlsx"
+    shutil.copy2(template, target)
+    shutil.copy2(template, replacement)
+    # a different zip comment changes the contents but not the size
+    with zipfile.ZipFile(target, "a") as zf:
+        zf.comment = b"1"
+    with zipfile.ZipFile(replacement, "a") as zf:
+        zf.comment = b"2"
+    st = os.stat(target)
+    os.utime(replacement, ns=(st.st_atime_ns, st.st_mtime_ns))
+    first = InMemoryPopulatedTemplatesRepository(input_dir)
+    first.list_as_objs()
+    assert first.cache_misses == [target]
+
+    shutil.copy2(replacement, target)
+    after = os.stat(target)
+    assert (after.st_size, after.st_mtime_ns, after.st_ino) == (
+        st.st_size,
+        st.st_mtime_ns,
+        st.st_ino,
+    )
+    second = InMemoryPopulatedTemplatesRepository(input_dir)
+    data = second.list_as_objs()
+    assert second.cache_misses == [target]
+    expected = hashlib.md5(replacement.read_bytes()).digest().hex()
+    assert data["test_template.xlsx"]["checksum"] == expected
+
+
+def test_manifest_of_zip_keyed_by_member_name(mock_config, template, forbid_call):
+    mock_config.initialise()
+    zip_path = Path(mock_config.PLATFORM_DOCS_DIR) / "input" / "returns.zip"
+    with zipfile.ZipFile(zip_path, "w") as zf:
+        for n in range(3):
+            zf.write(template, f"template_{n}.xlsx")
+    expected = hashlib.md5(open(template, "rb").read()).digest().hex()
+    first = InMemoryPopulatedTemplatesZip(str(zip_path)).list_as_objs()
+    assert first
+    assert {inner["checksum"] for inner in first.values()} == {expected}
+    assert sorted(InputManifest(zip_path).entries) == sorted(first)
+
+    forbid_call("engine.utils.extraction._hash_single_file")
+    second = InMemoryPopulatedTemplatesZip(str(zip_path)).list_as_objs()
+    assert sorted(second) == sorted(first)
+    assert {inner["checksum"] for inner in second.values()} == {expected}
+    assert sorted(InputManifest(zip_path).entries) == sorted(first)
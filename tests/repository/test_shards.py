@@ -0,0 +1,77 @@
+import os
+import shutil
+from pathlib import Path
+
+from engine.repository.datamap import InMemorySingleDatamapRepository
+from engine.repository.journal import RunJournal
+from engine.repository.master import MasterOutputRepository
+from engine.repository.shards import ShardedTemplateData
+from engine.repository.templates import InMemoryPopulatedTemplatesRepository
+from engine.use_cases.parsing import (
+    CreateMasterUseCase,
+    extract_from_multiple_xlsx_files,
+)
+from engine.utils.extraction import template_reader
+from openpyxl import load_workbook
+
+
+def test_sharded_data_reads_back_written_data(template):
+    data = ShardedTemplateData()
+    file_data = template_reader(template)
+    data["test_template.xlsx"] = file_data["test_template.xlsx"]
+    assert len(data) == 1
+    assert "test_template.xlsx" in data
+    assert data["test_template.xlsx"]["data"]["Summary"]["B3"]["value"] == (
+        "This is a string"
+    )
+
+
+def test_sharded_data_copy_unaffected_by_removal(template):
+    data = ShardedTemplateData()
+    data["test_template.xlsx"] = template_reader(template)["test_template.xlsx"]
+    copy = data.copy()
+    del copy["test_template.xlsx"]
+    assert len(copy) == 0
+    assert data["test_template.xlsx"]["checksum"]
+
+
+def test_sharded_data_cleanup_removes_shards(template):
+    data = ShardedTemplateData()
+    data["test_template.xlsx"] = template_reader(template)["test_template.xlsx"]
+    shard_dir = data.shard_dir
+    data.cleanup()
+    assert not os.path.exists(shard_dir)
+
+
+def test_out_of_core_extraction_matches_in_memory(mock_config, template):
+    mock_config.initialise()
+    input_dir = Path(mock_config.PLATFORM_DOCS_DIR) / "input"
+    shutil.copy2(template, input_dir)
+    target = input_dir / "test_template.xlsx"
+    journal = RunJournal(input_dir)
+    data = extract_from_multiple_xlsx_files([target], journal=journal, out_of_core=True)
+    assert isinstance(data, ShardedTemplateData)
+    assert dict(data) == extract_from_multiple_xlsx_files([target])
+    # newly extracted files are journalled as usual, and resumed into shards
+    resumed = RunJournal(input_dir)
+    assert len(resumed) == 1
+    data = extract_from_multiple_xlsx_files([target], journal=resumed, out_of_core=True)
+    assert data["test_template.xlsx"]["data"]["Summary"]["B3"]["value"] == (
+        "This is a string"
+    )
+
+
+def test_create_master_out_of_core(mock_config, datamap_match_test_template, template):
+    mock_config.initialise()
+    shutil.copy2(template, (Path(mock_config.PLATFORM_DOCS_DIR) / "input"))
+    tmpl_repo = InMemoryPopulatedTemplatesRepository(
+        mock_config.PLATFORM_DOCS_DIR / "input", out_of_core=True
+    )
+    dm_repo = InMemorySingleDatamapRepository(datamap_match_test_template)
+    uc = CreateMasterUseCase(dm_repo, tmpl_repo, MasterOutputRepository)
+    uc.execute("master.xlsx")
+    wb = load_workbook(Path(mock_config.PLATFORM_DOCS_DIR) / "output" / "master.xlsx")
+    ws = wb.active
+    assert ws["B1"].value == "test_template"
+    assert ws["B3"].value == "This is a string"
+    assert isinstance(tmpl_repo.state, ShardedTemplateData)
@@ -0,0 +1,116 @@
+import json
+from pathlib import Path
+
+import pytest
+from openpyxl import Workbook
+from openpyxl.worksheet.datavalidation import DataValidation
+
+from engine.domain.datamap import DatamapLine
+from engine.domain.template import SheetStructure, TemplateStructure
+from engine.repository.structure import (
+    _structure_path,
+    check_datamap_against_template,
+    template_structure,
+)
+
+
+@pytest.fixture
+def structured_blank(mock_config) -> Path:
+    mock_config.initialise()
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Summary"
+    ws.merge_cells("B2:D2")
+    dv = DataValidation(type="whole")
+    dv.add("B5:B10")
+    ws.add_data_validation(dv)
+    blank = Path(mock_config.PLATFORM_DOCS_DIR) / "input" / "blank.xlsx"
+    wb.save(blank)
+    return blank
+
+
+def _line(key, sheet, cellref, data_type="TEXT"):
+    return DatamapLine(key, sheet, cellref, data_type, "datamap.csv")
+
+
+def test_datamap_lines_checked_against_blank_template(structured_blank):
+    structure = template_structure(structured_blank)
+    assert structure.sheets["Summary"].merged_ranges == ["B2:D2"]
+    problems = structure.check_datamap(
+        [
+            _line("Good", "Summary", "B2"),
+            _line("Merged", "Summary", "C2"),
+            _line("No Sheet", "Finance", "A1"),
+            _line("Bad Ref", "Summary", "2B"),
+            _line("Wrong Type", "Summary", "B7"),
+            _line("Right Type", "Summary", "B8", "NUMBER"),
+        ]
+    )
+    assert [(p.key, p.fatal) for p in problems] == [
+        ("Merged", True),
+        ("No Sheet", False),
+        ("Bad Ref", True),
+        ("Wrong Type", False),
+    ]
+
+
+def test_template_structure_loaded_from_disk(
+    structured_blank, monkeypatch, forbid_call
+):
+    monkeypatch.setattr("engine.repository.structure._STRUCTURES", {})
+    first = template_structure(structured_blank)
+    monkeypatch.setattr("engine.repository.structure._STRUCTURES", {})
+    forbid_call("engine.repository.structure.load_workbook")
+    again = template_structure(structured_blank)
+    assert again.to_dict() == first.to_dict()
+    assert list(again.sheets) == ["Summary"]
+
+
+def test_template_structure_stored_as_json_and_rebuilt_if_unreadable(
+    structured_blank, monkeypatch
+):
+    monkeypatch.setattr("engine.repository.structure._STRUCTURES", {})
+    first = template_structure(structured_blank)
+    structure_path = _structure_path(first.checksum)
+    with open(structure_path, encoding="utf-8") as f:
+        assert json.load(f)["sheets"]["Summary"]["merged_ranges"] == ["B2:D2"]
+    structure_path.write_bytes(b"\x80\x04truncated")
+    monkeypatch.setattr("engine.repository.structure._STRUCTURES", {})
+    rebuilt = template_structure(structured_blank)
+    assert rebuilt.to_dict() == first.to_dict()
+    assert rebuilt.sheets["Summary"].validation_type(7, 2) == "whole"
+    with open(structure_path, encoding="utf-8") as f:
+        assert TemplateStructure.from_dict(json.load(f)).to_dict() == first.to_dict()
+
+
+def test_validation_type_looked_up_by_column():
+    sheet = SheetStructure(
+        "A1:D20", [], [("whole", "B5:B10 D1:D1048576"), ("date", "B8:C12")]
+    )
+    assert sheet.validation_type(7, 2) == "whole"
+    assert sheet.validation_type(8, 2) == "whole"
+    assert sheet.validation_type(11, 2) == "date"
+    assert sheet.validation_type(12, 3) == "date"
+    assert sheet.validation_type(1000000, 4) == "whole"
+    assert sheet.validation_type(4, 2) is None
+    assert sheet.validation_type(5, 1) is None
+
+
+def test_check_datamap_against_template_logs_problems(structured_blank, caplog):
+    assert check_datamap_against_template(
+        structured_blank, [_line("No Sheet", "Finance", "A1")]
+    )
+    assert not check_datamap_against_template(
+        structured_blank, [_line("Merged", "Summary", "C2")]
+    )
+    assert [(r.levelname, r.message) for r in caplog.records][-2:] == [
+        (
+            "WARNING",
+            "Datamap key No Sheet: Sheet 'Finance' is not in the blank template.",
+        ),
+        (
+            "CRITICAL",
+            "Datamap key Merged: Summary!C2 is inside merged cells B2:D2 "
+            "and cannot hold a value.",
+        ),
+    ]
@@ -1,3 +1,5 @@
+import subprocess
+import sys
 from pathlib import Path
 
 import pytest
@@ -9,7 +11,12 @@ from engine.exceptions import (
     MissingCellKeyError,
     MissingSheetFieldError,
 )
-from engine.utils.extraction import _get_cell_data, datamap_reader, template_reader
+from engine.utils.extraction import (
+    _get_cell_data,
+    datamap_reader,
+    read_datamap,
+    template_reader,
+)
 
 NUMBER = DatamapLineValueType.NUMBER
 DATE = DatamapLineValueType.DATE
@@ -159,3 +166,35 @@ def test_datamap_missing_key_fields(datamap_missing_key_fields):
 
 def test_get_file_suffix_from_path(datamap):
     assert datamap.suffix == ".csv"
+
+
+def test_datamap_read_in_one_pass_with_encoding_sniffed(tmp_path, monkeypatch):
+    monkeypatch.setattr("engine.domain.datamap.ENCODING_SNIFF_SIZE", 64)
+    dm = tmp_path / "datamap.csv"
+    rows = [f"Key {i},Summary,b{i},TEXT" for i in range(1, 1001)]
+    # a byte which is not UTF-8, well beyond the bytes sniffed
+    rows.append("Caf\xe9 Key,Summary,B1001,TEXT")
+    text = "cell_key,template_sheet,cellreference,type\n" + "\n".join(rows)
+    dm.write_bytes(text.encode("latin1"))
+    headers, lines = read_datamap(dm)
+    assert headers["type"] == "type"
+    first = next(lines)
+    assert (first.key, first.cellref) == ("Key 1", "B1")
+    rest = list(lines)
+    assert len(rest) == 1000
+    assert rest[-1].key == "Café Key"
+
+
+def test_importing_datamap_module_registers_no_error_handler():
+    # a fresh interpreter, as reading a datamap in this one registers the handler
+    code = (
+        "import codecs, engine.domain.datamap\n"
+        "try:\n"
+        "    codecs.lookup_error('datamap_latin1')\n"
+        "except LookupError:\n"
+        "    print('unregistered')\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout == "unregistered\n"
@@ -0,0 +1,135 @@
+import asyncio
+import shutil
+from pathlib import Path
+
+from openpyxl import load_workbook
+
+from engine.repository.datamap import InMemorySingleDatamapRepository
+from engine.repository.master import MasterOutputRepository
+from engine.repository.templates import (
+    InMemoryPopulatedTemplatesRepository,
+    InMemoryPopulatedTemplatesZip,
+    MultipleTemplatesWriteRepo,
+)
+from engine.use_cases.asynchronous import (
+    AsyncCreateMasterUseCase,
+    AsyncParsePopulatedTemplatesUseCase,
+    AsyncWriteMasterToTemplates,
+)
+from engine.use_cases.parsing import shared_process_pool
+from engine.utils.extraction import template_reader
+
+
+async def _collect(aiter):
+    return [item async for item in aiter]
+
+
+def test_async_parse_streams_each_file(mock_config, template, templates_zipped):
+    mock_config.initialise()
+    shutil.copy2(template, (Path(mock_config.PLATFORM_DOCS_DIR) / "input"))
+    repo = InMemoryPopulatedTemplatesRepository(mock_config.PLATFORM_DOCS_DIR / "input")
+    uc = AsyncParsePopulatedTemplatesUseCase(repo)
+    streamed = asyncio.run(_collect(uc.stream()))
+    assert [list(x.keys())[0] for x in streamed] == ["test_template.xlsx"]
+    assert (
+        repo.state["test_template.xlsx"]["data"]["Summary"]["B3"]["value"]
+        == "This is a string"
+    )
+
+
+def test_async_parse_zip(mock_config, templates_zipped):
+    mock_config.initialise()
+    repo = InMemoryPopulatedTemplatesZip(templates_zipped)
+    data = asyncio.run(AsyncParsePopulatedTemplatesUseCase(repo).execute())
+    assert (
+        data["test_template_with_introduction_sheet.xlsm"]["data"]["Summary"]["B3"][
+            "value"
+        ]
+        == "This is a string"
+    )
+
+
+def test_async_create_master(mock_config, datamap_match_test_template, template):
+    mock_config.initialise()
+    shutil.copy2(template, (Path(mock_config.PLATFORM_DOCS_DIR) / "input"))
+    tmpl_repo = InMemoryPopulatedTemplatesRepository(
+        mock_config.PLATFORM_DOCS_DIR / "input"
+    )
+    dm_repo = InMemorySingleDatamapRepository(datamap_match_test_template)
+    uc = AsyncCreateMasterUseCase(dm_repo, tmpl_repo, MasterOutputRepository)
+    asyncio.run(uc.execute("master.xlsx"))
+    wb = load_workbook(Path(mock_config.PLATFORM_DOCS_DIR) / "output" / "master.xlsx")
+    ws = wb.active
+    assert ws["B1"].value == "test_template"
+    assert ws["B3"].value == "This is a string"
+
+
+def test_async_write_master_to_templates(mock_config, datamap, master, blank_template):
+    mock_config.initialise()
+    output_repo = MultipleTemplatesWriteRepo(blank_template)
+    uc = AsyncWriteMasterToTemplates(output_repo, datamap, master, blank_template)
+    saved = asyncio.run(uc.execute())
+    result_file = mock_config.PLATFORM_DOCS_DIR / "output" / "Chutney Bridge.xlsm"
+    assert result_file in saved
+    wb = load_workbook(result_file)
+    assert wb["Introduction"]["C9"].value == "Accounting Department"
+
+
+def test_async_parse_uses_extraction_cache_and_options(mock_config, template):
+    mock_config.initialise()
+    input_dir = Path(mock_config.PLATFORM_DOCS_DIR) / "input"
+    shutil.copy2(template, input_dir)
+    asyncio.run(
+        AsyncParsePopulatedTemplatesUseCase(
+            InMemoryPopulatedTemplatesRepository(input_dir)
+        ).execute()
+    )
+    repo = InMemoryPopulatedTemplatesRepository(input_dir)
+    streamed = asyncio.run(_collect(AsyncParsePopulatedTemplatesUseCase(repo).stream()))
+    assert repo.cache_hits == 1
+    assert repo.cache_misses == []
+    assert streamed == [{"test_template.xlsx": repo.state["test_template.xlsx"]}]
+
+    selected = InMemoryPopulatedTemplatesRepository(
+        input_dir, use_cache=False, cells={"Summary": {"B3"}}
+    )
+    data = asyncio.run(AsyncParsePopulatedTemplatesUseCase(selected).execute())
+    assert list(data["test_template.xlsx"]["data"]) == ["Summary"]
+    assert data["test_template.xlsx"]["data"]["Summary"]["B3"]["value"] == (
+        "This is a string"
+    )
+
+
+def test_async_parse_of_empty_directory_is_not_repeated(mock_config):
+    mock_config.initialise()
+    repo = InMemoryPopulatedTemplatesRepository(mock_config.PLATFORM_DOCS_DIR / "input")
+    data = asyncio.run(AsyncParsePopulatedTemplatesUseCase(repo).execute())
+    assert data == {}
+    assert repo.list_as_objs() is data
+
+
+def test_concurrent_async_parses_share_one_process_pool(
+    mock_config, template, forbid_call
+):
+    mock_config.initialise()
+    dirs = []
+    for name in ["first", "second"]:
+        input_dir = Path(mock_config.PLATFORM_DOCS_DIR) / name
+        input_dir.mkdir()
+        shutil.copy2(template, input_dir)
+        dirs.append(input_dir)
+    expected = [template_reader(d / "test_template.xlsx") for d in dirs]
+    shared_process_pool()
+    forbid_call("concurrent.futures.ProcessPoolExecutor")
+
+    async def _both():
+        return await asyncio.gather(
+            *[
+                AsyncParsePopulatedTemplatesUseCase(
+                    InMemoryPopulatedTemplatesRepository(d, use_cache=False)
+                ).execute()
+                for d in dirs
+            ]
+        )
+
+    assert asyncio.run(_both()) == expected
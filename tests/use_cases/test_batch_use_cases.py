@@ -0,0 +1,149 @@
+import shutil
+from pathlib import Path
+
+from openpyxl import load_workbook
+
+from engine.repository.cache import ExtractionCache
+from engine.repository.master import MasterOutputRepository
+from engine.use_cases.batch import BatchCreateMastersUseCase, BatchJob
+from engine.utils.cancellation import RunStatus
+from engine.utils.concurrency import MemoryBudget
+from engine.utils.extraction import _hash_single_file
+
+
+def _project_dir(config, name, template, datamap) -> Path:
+    project = Path(config.PLATFORM_DOCS_DIR) / "input" / name
+    project.mkdir(parents=True)
+    shutil.copy2(template, project)
+    shutil.copy2(datamap, project / "datamap.csv")
+    return project
+
+
+def test_batch_creates_master_per_job(
+    mock_config, template, datamap_match_test_template
+):
+    mock_config.initialise()
+    project_a = _project_dir(mock_config, "a", template, datamap_match_test_template)
+    project_b = _project_dir(mock_config, "b", template, datamap_match_test_template)
+    jobs = [
+        BatchJob(project_a, "datamap.csv", "master_a.xlsx"),
+        BatchJob(project_b, "datamap.csv", "master_b.xlsx"),
+    ]
+    uc = BatchCreateMastersUseCase(jobs, MasterOutputRepository)
+    status = uc.execute()
+    assert status == {jobs[0]: RunStatus.COMPLETE, jobs[1]: RunStatus.COMPLETE}
+    for name in ["master_a.xlsx", "master_b.xlsx"]:
+        wb = load_workbook(Path(mock_config.PLATFORM_DOCS_DIR) / "output" / name)
+        assert wb.active["B3"].value == "This is a string"
+    reports = list(Path(mock_config.FULL_PATH_OUTPUT).glob("validation_report_*"))
+    assert len(reports) == 2
+
+
+def test_batch_failure_in_one_job_does_not_stop_others(
+    mock_config, template, datamap_match_test_template
+):
+    mock_config.initialise()
+    project_a = _project_dir(mock_config, "a", template, datamap_match_test_template)
+    empty = Path(mock_config.PLATFORM_DOCS_DIR) / "input" / "empty"
+    empty.mkdir()
+    shutil.copy2(datamap_match_test_template, empty / "datamap.csv")
+    jobs = [
+        BatchJob(project_a, "datamap.csv", "master_a.xlsx"),
+        BatchJob(empty, "datamap.csv", "master_empty.xlsx"),
+    ]
+    uc = BatchCreateMastersUseCase(jobs, MasterOutputRepository)
+    status = uc.execute()
+    assert status[jobs[0]] == RunStatus.COMPLETE
+    assert status[jobs[1]] == RunStatus.CANCELLED
+    assert jobs[1] in uc.errors
+
+
+def test_batch_extracts_within_memory_budget_and_caches_templates(
+    mock_config, template, datamap_match_test_template, monkeypatch
+):
+    mock_config.initialise()
+    project_a = _project_dir(mock_config, "a", template, datamap_match_test_template)
+    project_b = _project_dir(mock_config, "b", template, datamap_match_test_template)
+    (project_b / "test_template.xlsx").rename(project_b / "second_template.xlsx")
+    admitted = []
+
+    class _RecordingBudget(MemoryBudget):
+        def admit(self, estimate: int) -> bool:
+            admitted.append(estimate)
+            return super().admit(estimate)
+
+    monkeypatch.setattr("engine.use_cases.parsing.MemoryBudget", _RecordingBudget)
+    monkeypatch.setattr(mock_config, "MAX_MEMORY", 1)
+    jobs = [
+        BatchJob(project_a, "datamap.csv", "master_a.xlsx"),
+        BatchJob(project_b, "datamap.csv", "master_b.xlsx"),
+    ]
+    status = BatchCreateMastersUseCase(jobs, MasterOutputRepository).execute()
+    assert set(status.values()) == {RunStatus.COMPLETE}
+    assert admitted
+    wb = load_workbook(Path(mock_config.PLATFORM_DOCS_DIR) / "output" / "master_b.xlsx")
+    assert wb.active["B1"].value == "second_template"
+    assert wb.active["B3"].value == "This is a string"
+    cache = ExtractionCache()
+    try:
+        target = project_b / "second_template.xlsx"
+        cached = cache.lookup(target, _hash_single_file(target))
+    finally:
+        cache.close()
+    assert cached["second_template.xlsx"]["data"]["Summary"]["B3"]["value"] == (
+        "This is a string"
+    )
+
+
+def test_batch_template_which_cannot_be_extracted_fails_only_its_job(
+    mock_config, template, datamap_match_test_template
+):
+    mock_config.initialise()
+    project_a = _project_dir(mock_config, "a", template, datamap_match_test_template)
+    project_b = _project_dir(mock_config, "b", template, datamap_match_test_template)
+    (project_b / "broken.xlsx").write_bytes(b"not a spreadsheet")
+    jobs = [
+        BatchJob(project_a, "datamap.csv", "master_a.xlsx"),
+        BatchJob(project_b, "datamap.csv", "master_b.xlsx"),
+    ]
+    uc = BatchCreateMastersUseCase(jobs, MasterOutputRepository)
+    status = uc.execute()
+    assert status == {jobs[0]: RunStatus.COMPLETE, jobs[1]: RunStatus.CANCELLED}
+    assert jobs[1] in uc.errors
+    wb = load_workbook(Path(mock_config.PLATFORM_DOCS_DIR) / "output" / "master_a.xlsx")
+    assert wb.active["B3"].value == "This is a string"
+    assert not (
+        Path(mock_config.PLATFORM_DOCS_DIR) / "output" / "master_b.xlsx"
+    ).exists()
+
+
+def test_batch_job_with_missing_datamap_fails_only_its_job(
+    mock_config, template, datamap_match_test_template
+):
+    mock_config.initialise()
+    project_a = _project_dir(mock_config, "a", template, datamap_match_test_template)
+    project_b = _project_dir(mock_config, "b", template, datamap_match_test_template)
+    jobs = [
+        BatchJob(project_a, "datamap.csv", "master_a.xlsx"),
+        BatchJob(project_b, "missing.csv", "master_b.xlsx"),
+    ]
+    uc = BatchCreateMastersUseCase(jobs, MasterOutputRepository)
+    status = uc.execute()
+    assert status == {jobs[0]: RunStatus.COMPLETE, jobs[1]: RunStatus.CANCELLED}
+    assert jobs[1] in uc.errors
+    wb = load_workbook(Path(mock_config.PLATFORM_DOCS_DIR) / "output" / "master_a.xlsx")
+    assert wb.active["B3"].value == "This is a string"
+
+
+def test_batch_without_cache_does_not_cache_validation(
+    mock_config, template, datamap_match_test_template
+):
+    mock_config.initialise()
+    project_a = _project_dir(mock_config, "a", template, datamap_match_test_template)
+    jobs = [BatchJob(project_a, "datamap.csv", "master_a.xlsx")]
+    uc = BatchCreateMastersUseCase(jobs, MasterOutputRepository, use_cache=False)
+    assert uc.execute() == {jobs[0]: RunStatus.COMPLETE}
+    assert len(list(Path(mock_config.FULL_PATH_OUTPUT).glob("validation_report_*")))
+    assert not (
+        Path(mock_config.DATAMAPS_LIBRARY_DATA_DIR) / "extraction_cache.sqlite3"
+    ).exists()
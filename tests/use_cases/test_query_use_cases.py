@@ -0,0 +1,80 @@
+import threading
+import time
+
+import pytest
+
+from engine.repository.datamap import InMemorySingleDatamapRepository
+from engine.use_cases.query import QueryTemplatesUseCase
+from engine.utils.extraction import template_reader
+
+
+def test_query_reads_cell_asked_for_then_prefetches_file(
+    mock_config, datamap_match_test_template, template, monkeypatch
+):
+    mock_config.initialise()
+    reads = []
+
+    def _reader(template_file, reuse=None, cells=None):
+        reads.append(cells)
+        return template_reader(template_file, reuse, cells)
+
+    monkeypatch.setattr("engine.use_cases.query.template_reader", _reader)
+    dm_repo = InMemorySingleDatamapRepository(datamap_match_test_template)
+    with QueryTemplatesUseCase(dm_repo, [template]) as uc:
+        assert (
+            uc.query_key("test_template.xlsx", "String Key", "Summary")
+            == "This is a string"
+        )
+        assert {"Summary": {"B3"}} in reads
+        uc._prefetches["test_template.xlsx"].result(timeout=30)
+        assert uc.prefetched("test_template.xlsx")
+        assert uc.query_key("test_template.xlsx", "Big Float", "Another Sheet") == 7.2
+    # one targeted read, and one of all the datamap's cells
+    assert len(reads) == 2
+
+
+def test_query_raises_key_error_as_apply_use_case(
+    mock_config, datamap_match_test_template, template
+):
+    mock_config.initialise()
+    dm_repo = InMemorySingleDatamapRepository(datamap_match_test_template)
+    with QueryTemplatesUseCase(dm_repo, [template]) as uc:
+        with pytest.raises(KeyError):
+            uc.query_key("test_template.xlsx", "Funny Date ", "Another Sheet")
+        with pytest.raises(KeyError):
+            uc.query_key("test_template.xlsx", "Funny Date", "Another Sheet ")
+        with pytest.raises(KeyError):
+            uc.query_key("missing.xlsx", "Funny Date", "Another Sheet")
+
+
+def test_query_waits_for_background_read_under_way(
+    mock_config, datamap_match_test_template, template, monkeypatch
+):
+    mock_config.initialise()
+    reads = []
+    prefetch_started = threading.Event()
+
+    def _reader(template_file, reuse=None, cells=None):
+        reads.append(cells)
+        if len(reads) > 1:
+            prefetch_started.set()
+            time.sleep(0.2)
+        return template_reader(template_file, reuse, cells)
+
+    monkeypatch.setattr("engine.use_cases.query.template_reader", _reader)
+    dm_repo = InMemorySingleDatamapRepository(datamap_match_test_template)
+    with QueryTemplatesUseCase(dm_repo, [template]) as uc:
+        uc.query_key("test_template.xlsx", "String Key", "Summary")
+        assert prefetch_started.wait(timeout=30)
+        assert uc.query_key("test_template.xlsx", "Big Float", "Another Sheet") == 7.2
+        assert uc.prefetched("test_template.xlsx")
+    assert len(reads) == 2
+
+
+def test_query_after_close_raises(mock_config, datamap_match_test_template, template):
+    mock_config.initialise()
+    dm_repo = InMemorySingleDatamapRepository(datamap_match_test_template)
+    uc = QueryTemplatesUseCase(dm_repo, [template])
+    uc.close()
+    with pytest.raises(RuntimeError):
+        uc.query_key("test_template.xlsx", "String Key", "Summary")
@@ -15,14 +15,23 @@ from engine.repository.templates import (
 )
 from engine.use_cases.parsing import (
     ApplyDatamapToExtractionUseCase,
+    ApplyDatamapToExtractionUseCaseWithValidation,
+    CreateMastersForDatamapsUseCase,
     CreateMasterUseCase,
     ParsePopulatedTemplatesUseCase,
 )
-from engine.utils.extraction import _check_file_in_datafile
+from engine.utils.cancellation import RunStatus
+from engine.utils.extraction import (
+    _check_file_in_datafile,
+    datamap_cells,
+    template_reader,
+)
+from engine.utils.validation import validation_checker
 
 
-def test_template_parser_use_case(resources):
-    repo = InMemoryPopulatedTemplatesRepository(resources)
+def test_template_parser_use_case(mock_config, resources):
+    mock_config.initialise()
+    repo = InMemoryPopulatedTemplatesRepository(resources, use_cache=False)
     parse_populated_templates_use_case = ParsePopulatedTemplatesUseCase(repo)
     result = parse_populated_templates_use_case.execute()
     assert (
@@ -32,22 +41,22 @@ def test_template_parser_use_case(resources):
 
 
 def test_query_data_from_data_file(
-    mock_config, dat_file, spreadsheet_same_data_as_dat_file
+    mock_config, dat_file, spreadsheet_same_data_as_dat_file, forbid_call
 ):
     mock_config.initialise()
     shutil.copy2(dat_file, mock_config.DATAMAPS_LIBRARY_DATA_DIR)
     shutil.copy2(
         spreadsheet_same_data_as_dat_file, mock_config.PLATFORM_DOCS_DIR / "input"
     )
-    repo = FSPopulatedTemplatesRepo(mock_config.PLATFORM_DOCS_DIR)
+
+    expected = template_reader(
+        mock_config.PLATFORM_DOCS_DIR / "input" / "test_dat_file_use_case.xlsx"
+    )
+    forbid_call("engine.use_cases.parsing.template_reader")
+    repo = FSPopulatedTemplatesRepo(mock_config.PLATFORM_DOCS_DIR / "input")
     parse_populated_templates_use_case = ParsePopulatedTemplatesUseCase(repo)
     result = parse_populated_templates_use_case.execute()
-    assert (
-        json.loads(result)["test_dat_file_use_case.xlsx"]["data"]["new sheet"]["A1"][
-            "value"
-        ]
-        == "Project/Programme Name"
-    )
+    assert json.loads(result) == expected
 
 
 def test_extract_data_from_templates_in_zip_file(
@@ -151,8 +160,12 @@ def test_in_memory_datamap_generator(
     }
 
 
-def test_create_master_spreadsheet(mock_config, datamap_match_test_template, template):
+def test_create_master_spreadsheet(
+    mock_config, datamap_match_test_template, template, forbid_call
+):
     mock_config.initialise()
+    forbid_call(InMemorySingleDatamapRepository, "list_as_json")
+    forbid_call(InMemoryPopulatedTemplatesRepository, "list_as_json")
     shutil.copy2(template, (Path(mock_config.PLATFORM_DOCS_DIR) / "input"))
     tmpl_repo = InMemoryPopulatedTemplatesRepository(
         mock_config.PLATFORM_DOCS_DIR / "input"
@@ -271,3 +284,139 @@ def test_in_extract_files_from_zipfile_with_deep_structure_raises_exception(
     uc = ApplyDatamapToExtractionUseCase(dm_repo, tmpl_repo)
     with pytest.raises(NestedZipError):
         uc.execute()
+
+
+def _master_values(config, name):
+    "Return the values in each row of a master in the output directory."
+    ws = load_workbook(Path(config.PLATFORM_DOCS_DIR) / "output" / name).active
+    return [list(row) for row in ws.iter_rows(values_only=True)]
+
+
+def test_create_master_incrementally_reuses_unchanged_columns(
+    mock_config, datamap_match_test_template, template, forbid_call
+):
+    mock_config.initialise()
+    input_dir = Path(mock_config.PLATFORM_DOCS_DIR) / "input"
+    shutil.copy2(template, input_dir / "test_template.xlsx")
+    shutil.copy2(template, input_dir / "test_template2.xlsx")
+    dm_repo = InMemorySingleDatamapRepository(datamap_match_test_template)
+    CreateMasterUseCase(
+        dm_repo,
+        InMemoryPopulatedTemplatesRepository(input_dir),
+        MasterOutputRepository,
+        incremental=True,
+    ).execute("master.xlsx")
+    (input_dir / "test_template2.xlsx").unlink()
+    CreateMasterUseCase(
+        dm_repo,
+        InMemoryPopulatedTemplatesRepository(input_dir),
+        MasterOutputRepository,
+    ).execute("expected.xlsx")
+    forbid_call(ApplyDatamapToExtractionUseCase, "_values_for_file")
+    CreateMasterUseCase(
+        dm_repo,
+        InMemoryPopulatedTemplatesRepository(input_dir),
+        MasterOutputRepository,
+        incremental=True,
+    ).execute("master.xlsx")
+    master = _master_values(mock_config, "master.xlsx")
+    assert master == _master_values(mock_config, "expected.xlsx")
+    assert master[0] == ["file name", "test_template"]
+
+
+def test_changed_datamap_applied_without_parsing_templates(
+    mock_config, datamap_match_test_template, template, forbid_call
+):
+    mock_config.initialise()
+    input_dir = Path(mock_config.PLATFORM_DOCS_DIR) / "input"
+    shutil.copy2(template, input_dir)
+    dm_repo = InMemorySingleDatamapRepository(datamap_match_test_template)
+    CreateMasterUseCase(
+        dm_repo,
+        InMemoryPopulatedTemplatesRepository(input_dir),
+        MasterOutputRepository,
+        incremental=True,
+    ).execute("master.xlsx")
+    shorter_datamap = input_dir / "datamap.csv"
+    with open(datamap_match_test_template) as original:
+        shorter_datamap.write_text("".join(original.readlines()[:3]))
+    CreateMasterUseCase(
+        InMemorySingleDatamapRepository(shorter_datamap),
+        InMemoryPopulatedTemplatesRepository(input_dir, use_cache=False),
+        MasterOutputRepository,
+    ).execute("expected.xlsx")
+    forbid_call("engine.use_cases.parsing.template_reader")
+    tmpl_repo = InMemoryPopulatedTemplatesRepository(input_dir)
+    CreateMasterUseCase(
+        InMemorySingleDatamapRepository(shorter_datamap),
+        tmpl_repo,
+        MasterOutputRepository,
+        incremental=True,
+    ).execute("master.xlsx")
+    assert tmpl_repo.cache_hits == 1
+    assert tmpl_repo.cache_misses == []
+    master = _master_values(mock_config, "master.xlsx")
+    assert master == _master_values(mock_config, "expected.xlsx")
+    assert [row[0] for row in master] == ["file name", "Date Key", "String Key"]
+
+
+def test_masters_for_several_datamaps_from_one_extraction(
+    mock_config, template, datamap_match_test_template
+):
+    mock_config.initialise()
+    project = Path(mock_config.PLATFORM_DOCS_DIR) / "input" / "shared"
+    project.mkdir(parents=True, exist_ok=True)
+    shutil.copy2(template, project)
+    subset = project / "subset.csv"
+    subset.write_text(
+        "cell_key,template_sheet,cellreference,type\nString Key,Summary,B3,TEXT\n"
+    )
+    dm_repos = [
+        InMemorySingleDatamapRepository(datamap_match_test_template),
+        InMemorySingleDatamapRepository(subset),
+    ]
+    tmpl_repo = InMemoryPopulatedTemplatesRepository(
+        project,
+        use_cache=False,
+        cells=datamap_cells(dm_repo.compiled for dm_repo in dm_repos),
+    )
+    uc = CreateMastersForDatamapsUseCase(
+        list(zip(dm_repos, ["master_full.xlsx", "master_subset.xlsx"])),
+        tmpl_repo,
+        MasterOutputRepository,
+    )
+    status = uc.execute()
+    assert set(status.values()) == {RunStatus.COMPLETE}
+    # only the cells the datamaps refer to were read
+    data = tmpl_repo.state["test_template.xlsx"]["data"]
+    assert set(data) == {"Summary", "Another Sheet"}
+    assert set(data["Summary"]) == {"B2", "B3"}
+    output = Path(mock_config.PLATFORM_DOCS_DIR) / "output"
+    full = load_workbook(output / "master_full.xlsx").active
+    assert full["B3"].value == "This is a string"
+    assert full.max_row == 5
+    assert full["B4"].value is not None
+    subset_master = load_workbook(output / "master_subset.xlsx").active
+    assert [subset_master["A2"].value, subset_master["B2"].value] == [
+        "String Key",
+        "This is a string",
+    ]
+
+
+def test_validation_made_in_same_pass_as_master(
+    mock_config, datamap_match_test_template, template
+):
+    mock_config.initialise()
+    input_dir = Path(mock_config.PLATFORM_DOCS_DIR) / "input"
+    shutil.copy2(template, input_dir)
+    dm_repo = InMemorySingleDatamapRepository(datamap_match_test_template)
+    tmpl_repo = InMemoryPopulatedTemplatesRepository(input_dir, use_cache=False)
+    plain = ApplyDatamapToExtractionUseCase(dm_repo, tmpl_repo)
+    plain.execute(for_master=True)
+    validated = ApplyDatamapToExtractionUseCaseWithValidation(dm_repo, tmpl_repo)
+    validated.execute(for_master=True)
+    assert validated.data_for_master.columns == plain.data_for_master.columns
+    assert validated.validation_checks == validation_checker(
+        dm_repo.compiled.lines, tmpl_repo.list_as_objs()
+    )
+    assert {c.passes for c in validated.validation_checks} == {"PASS"}
@@ -0,0 +1,72 @@
+import shutil
+import threading
+from pathlib import Path
+
+from openpyxl import load_workbook
+
+from engine.repository.datamap import InMemorySingleDatamapRepository
+from engine.repository.master import MasterOutputRepository
+from engine.repository.templates import InMemoryPopulatedTemplatesRepository
+from engine.use_cases.parsing import CreateMasterUseCase
+from engine.use_cases.watch import WatchAndCreateMasterUseCase
+from engine.utils.cancellation import CancellationToken
+from engine.utils.watching import PollingWatcher
+
+
+def test_watch_creates_master_again_when_templates_arrive(
+    mock_config, datamap_match_test_template, template
+):
+    mock_config.initialise()
+    input_dir = Path(mock_config.PLATFORM_DOCS_DIR) / "input"
+    shutil.copy2(template, input_dir / "test_template.xlsx")
+    dm_repo = InMemorySingleDatamapRepository(datamap_match_test_template)
+    repos = []
+
+    def create_master():
+        tmpl_repo = InMemoryPopulatedTemplatesRepository(input_dir)
+        repos.append(tmpl_repo)
+        CreateMasterUseCase(
+            dm_repo, tmpl_repo, MasterOutputRepository, incremental=True
+        ).execute("master.xlsx")
+        if len(repos) == 1:
+            shutil.copy2(template, input_dir / "test_template2.xlsx")
+
+    uc = WatchAndCreateMasterUseCase(
+        PollingWatcher(input_dir, interval=0.01),
+        create_master,
+        debounce=0.05,
+        max_cycles=2,
+    )
+    uc.execute()
+    assert uc.cycles == 2
+    # the new template has the same contents as the first, so neither is parsed again
+    assert repos[1].cache_hits == 2
+    assert repos[1].cache_misses == []
+    ws = load_workbook(
+        Path(mock_config.PLATFORM_DOCS_DIR) / "output" / "master.xlsx"
+    ).active
+    assert {ws["B1"].value, ws["C1"].value} == {"test_template", "test_template2"}
+
+
+def test_watch_continues_after_failure_and_stops_when_cancelled(tmp_path):
+    token = CancellationToken()
+    calls = []
+
+    def create_master():
+        calls.append(1)
+        if len(calls) == 1:
+            (tmp_path / "template.xlsx").write_text("not a spreadsheet")
+            raise ValueError("bad template")
+        token.cancel()
+
+    uc = WatchAndCreateMasterUseCase(
+        PollingWatcher(tmp_path, interval=0.01),
+        create_master,
+        debounce=0.05,
+        token=token,
+    )
+    worker = threading.Thread(target=uc.execute)
+    worker.start()
+    worker.join(timeout=10)
+    assert not worker.is_alive()
+    assert uc.cycles == 2
@@ -0,0 +1,80 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+from engine.exceptions import OperationCancelledError
+from engine.repository.datamap import InMemorySingleDatamapRepository
+from engine.repository.master import MasterOutputRepository
+from engine.repository.templates import (
+    InMemoryPopulatedTemplatesRepository,
+    MultipleTemplatesWriteRepo,
+)
+from engine.use_cases.output import WriteMasterToTemplates
+from engine.use_cases.parsing import (
+    CreateMasterUseCase,
+    extract_from_multiple_xlsx_files,
+)
+from engine.utils.cancellation import CancellationToken, RunStatus
+from engine.utils.extraction import get_xlsx_files
+
+
+def test_token_cancelled_on_request():
+    token = CancellationToken()
+    assert not token.cancelled
+    token.cancel()
+    assert token.cancelled
+
+
+def test_token_cancelled_after_deadline():
+    token = CancellationToken(timeout=0)
+    assert token.cancelled
+    assert token.remaining() == 0.0
+
+
+def test_cancelled_extraction_raises_with_partial_results(resources):
+    token = CancellationToken()
+    token.cancel()
+    with pytest.raises(OperationCancelledError) as excinfo:
+        extract_from_multiple_xlsx_files(get_xlsx_files(resources), token=token)
+    assert excinfo.value.partial == {}
+    assert token.status == RunStatus.CANCELLED
+
+
+def test_best_effort_extraction_returns_partial_results(resources):
+    token = CancellationToken(timeout=0, best_effort=True)
+    data = extract_from_multiple_xlsx_files(get_xlsx_files(resources), token=token)
+    assert data == {}
+    assert token.status == RunStatus.PARTIAL
+
+
+def test_cancelled_master_is_not_written(
+    mock_config, datamap_match_test_template, template
+):
+    mock_config.initialise()
+    shutil.copy2(template, (Path(mock_config.PLATFORM_DOCS_DIR) / "input"))
+    token = CancellationToken()
+    token.cancel()
+    tmpl_repo = InMemoryPopulatedTemplatesRepository(
+        mock_config.PLATFORM_DOCS_DIR / "input", token=token
+    )
+    dm_repo = InMemorySingleDatamapRepository(datamap_match_test_template)
+    uc = CreateMasterUseCase(dm_repo, tmpl_repo, MasterOutputRepository, token=token)
+    with pytest.raises(OperationCancelledError):
+        uc.execute("master.xlsx")
+    assert uc.status == RunStatus.CANCELLED
+    assert not (Path(mock_config.PLATFORM_DOCS_DIR) / "output" / "master.xlsx").exists()
+
+
+def test_cancelled_write_back_writes_no_templates(
+    mock_config, datamap, master, blank_template
+):
+    mock_config.initialise()
+    token = CancellationToken()
+    output_repo = MultipleTemplatesWriteRepo(blank_template, token=token)
+    uc = WriteMasterToTemplates(output_repo, datamap, master, blank_template)
+    token.cancel()
+    with pytest.raises(OperationCancelledError):
+        uc.execute()
+    assert uc.status == RunStatus.CANCELLED
+    assert list((Path(mock_config.PLATFORM_DOCS_DIR) / "output").iterdir()) == []
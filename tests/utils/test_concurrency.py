@@ -0,0 +1,109 @@
+import threading
+import time
+from concurrent import futures
+
+import pytest
+from openpyxl import load_workbook
+
+from engine.repository.templates import MultipleTemplatesWriteRepo
+from engine.use_cases.output import WriteMasterToTemplates
+from engine.use_cases.parsing import extract_from_multiple_xlsx_files
+from engine.utils.concurrency import (
+    MINIMUM_TASK_MEMORY,
+    MemoryBudget,
+    completed_within_budget,
+    parse_memory_size,
+)
+from engine.utils.extraction import get_xlsx_files
+
+
+@pytest.mark.parametrize(
+    "size,expected",
+    [(4096, 4096), ("4096", 4096), ("512M", 512 * 1024**2), ("4G", 4 * 1024**3)],
+)
+def test_parse_memory_size(size, expected):
+    assert parse_memory_size(size) == expected
+
+
+def test_parse_memory_size_rejects_nonsense():
+    with pytest.raises(ValueError):
+        parse_memory_size("lots")
+
+
+def test_budget_always_admits_first_task():
+    budget = MemoryBudget(max_memory=1)
+    assert budget.admit(MINIMUM_TASK_MEMORY)
+    assert not budget.admit(MINIMUM_TASK_MEMORY)
+    budget.release(MINIMUM_TASK_MEMORY)
+    assert budget.admit(MINIMUM_TASK_MEMORY)
+
+
+def test_budget_ratio_follows_observed_usage(template):
+    budget = MemoryBudget(max_memory=10**9, ratio=10)
+    size = template.stat().st_size
+    budget.observe(template, size * 100)
+    assert budget.ratio == 100
+    budget.observe(template, size * 20)
+    assert budget.ratio == 60
+    budget.observe(template, None)
+    assert budget.ratio == 60
+
+
+def test_calls_run_within_budget(template):
+    budget = MemoryBudget(max_memory=2 * MINIMUM_TASK_MEMORY, ratio=0)
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def _task(n):
+        with lock:
+            running.append(n)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(n)
+        return n
+
+    calls = [(n, template, _task, (n,)) for n in range(6)]
+    with futures.ThreadPoolExecutor(max_workers=6) as pool:
+        results = dict(completed_within_budget(pool, calls, budget))
+    assert results == {n: n for n in range(6)}
+    assert max(peak) == 2
+
+
+def test_extraction_with_memory_limit(mock_config, resources, monkeypatch):
+    monkeypatch.setattr(mock_config, "MAX_MEMORY", 1)
+    data = extract_from_multiple_xlsx_files(get_xlsx_files(resources))
+    assert data["test_template.xlsx"]["data"]["Summary"]["B3"]["value"] == (
+        "This is a string"
+    )
+
+
+def test_write_back_with_memory_limit(
+    mock_config, datamap, master, blank_template, monkeypatch
+):
+    mock_config.initialise()
+    monkeypatch.setattr(mock_config, "MAX_MEMORY", 1)
+    output_repo = MultipleTemplatesWriteRepo(blank_template)
+    WriteMasterToTemplates(output_repo, datamap, master, blank_template).execute()
+    result_file = mock_config.PLATFORM_DOCS_DIR / "output" / "Chutney Bridge.xlsm"
+    assert result_file in output_repo.saved_files
+    assert load_workbook(result_file)["Introduction"]["C10"].value == "Satellite Corp"
+
+
+def test_write_back_shortfall_without_token_does_not_raise(
+    mock_config, datamap, master, blank_template, monkeypatch
+):
+    mock_config.initialise()
+    monkeypatch.setattr(mock_config, "MAX_MEMORY", 1)
+
+    def _first_only(*args, **kwargs):
+        yield next(completed_within_budget(*args, **kwargs))
+
+    monkeypatch.setattr(
+        "engine.repository.templates.completed_within_budget", _first_only
+    )
+    output_repo = MultipleTemplatesWriteRepo(blank_template)
+    WriteMasterToTemplates(output_repo, datamap, master, blank_template).execute()
+    assert len(output_repo.saved_files) == 1
+    assert load_workbook(output_repo.saved_files[0])["Introduction"]["C10"].value
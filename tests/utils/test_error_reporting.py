@@ -1,7 +1,13 @@
 # test_error_reporting.py
 
 
-from engine.utils.extraction import CheckType, check_datamap_sheets
+import logging
+
+from engine.utils.extraction import (
+    CheckType,
+    check_datamap_sheets,
+    remove_failing_files,
+)
 
 """"
 Tests in here to test ensure that files are checked for integrity before importing
@@ -18,6 +24,8 @@ def test_template_checked_for_correct_sheets_which_fails(
     """
     # Because there is no Introduction sheet in template data (template_dict) - should return a fail check
     check_status = check_datamap_sheets(datamap_lst_with_single_sheet, template_dict)
+    assert len(check_status) == len(template_dict)
+    assert check_status.passed == 0
     for f in check_status:
         assert f.state == CheckType.FAIL
         assert f.error_type == CheckType.MISSING_SHEETS_REQUIRED_BY_DATAMAP
@@ -35,8 +43,32 @@ def test_template_checked_for_correct_sheets_which_passes(
     check_status = check_datamap_sheets(
         datamap_lst_with_sheets_same_as_template_dict, template_dict
     )
-    for f in check_status:
-        assert f.state == CheckType.PASS
-        assert f.error_type == CheckType.UNDEFINED
-        assert f.msg == f"File {f.filename} checked: OK."
-        assert f.proceed is True
+    # only failures are recorded; passing files are counted
+    assert list(check_status) == []
+    assert check_status.passed == len(template_dict)
+    assert check_status.missing_sheets == {}
+
+
+def test_failing_files_removed_with_only_missing_sheets_reported(
+    datamap_lst_with_sheets_same_as_template_dict, template_dict, caplog
+):
+    sheets = {line["sheet"] for line in datamap_lst_with_sheets_same_as_template_dict}
+    missing = sorted(sheets)[0]
+    template_dict["missing.xlsm"] = {
+        "data": {s: {} for s in sheets if s != missing},
+        "checksum": "",
+    }
+    checks = check_datamap_sheets(
+        datamap_lst_with_sheets_same_as_template_dict, template_dict
+    )
+    assert checks.passed == len(template_dict) - 1
+    assert checks.missing_sheets == {"missing.xlsm": [missing]}
+    with caplog.at_level(logging.WARNING):
+        remaining = remove_failing_files(checks, template_dict)
+    assert "missing.xlsm" not in remaining
+    missing_reports = [
+        r.message for r in caplog.records if "sheet missing" in r.message
+    ]
+    assert missing_reports == [
+        f"{missing} sheet missing from missing.xlsm - it is required by the datamap."
+    ]
@@ -1,5 +1,6 @@
 import pytest
-from engine.utils.validation import validate_line
+from engine.repository.cache import ExtractionCache
+from engine.utils.validation import validate_line, validation_checker
 
 
 class TestValidation:
@@ -157,3 +158,41 @@ class TestValidation:
         assert v.validation_check.filename == "chutney.xlsx"
         assert v.validation_check.wanted == "NA"
         assert v.validation_check.got == "EMPTY"
+
+
+def test_validation_checker_reuses_cached_checks(mock_config, forbid_call):
+    mock_config.initialise()
+    dm_data = [
+        {
+            "cellref": "A1",
+            "data_type": "TEXT",
+            "filename": "datamap.csv",
+            "key": "Text Key",
+            "sheet": "Sheet A",
+        }
+    ]
+    tmp_data = {
+        "chutney.xlsx": {
+            "checksum": "abc",
+            "data": {
+                "Sheet A": {
+                    "A1": {
+                        "cellref": "A1",
+                        "data_type": "NUMBER",
+                        "file_name": "chutney.xlsx",
+                        "sheet_name": "Sheet A",
+                        "value": 10,
+                    }
+                }
+            },
+        }
+    }
+    expected = validation_checker(dm_data, tmp_data)
+    cache = ExtractionCache()
+    assert validation_checker(dm_data, tmp_data, cache=cache) == expected
+    forbid_call("engine.utils.validation.validate_line")
+    assert validation_checker(dm_data, tmp_data, cache=cache) == expected
+    assert expected[0].passes == "FAIL"
+    dm_data[0]["data_type"] = "NUMBER"
+    with pytest.raises(AssertionError):
+        validation_checker(dm_data, tmp_data, cache=cache)
@@ -0,0 +1,38 @@
+import sys
+
+import pytest
+
+from engine.utils.watching import InotifyWatcher, PollingWatcher
+
+
+def test_polling_watcher_reports_new_changed_and_removed_files(tmp_path):
+    (tmp_path / "kept.xlsx").write_text("a")
+    (tmp_path / "removed.xlsx").write_text("a")
+    watcher = PollingWatcher(tmp_path, interval=0.01)
+    assert watcher.changes(timeout=0) == set()
+    (tmp_path / "kept.xlsx").write_text("changed")
+    (tmp_path / "removed.xlsx").unlink()
+    (tmp_path / "new.xlsx").write_text("a")
+    assert watcher.changes(timeout=1) == {"kept.xlsx", "removed.xlsx", "new.xlsx"}
+    assert watcher.changes(timeout=0) == set()
+
+
+def test_watchers_ignore_lock_and_temporary_files(tmp_path):
+    watcher = PollingWatcher(tmp_path, interval=0.01)
+    (tmp_path / "~$template.xlsx").write_text("a")
+    (tmp_path / ".master.xlsx.abc.tmp").write_text("a")
+    assert watcher.changes(timeout=0.05) == set()
+
+
+@pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="inotify is Linux only"
+)
+def test_inotify_watcher_reports_changed_files(tmp_path):
+    watcher = InotifyWatcher(tmp_path)
+    try:
+        assert watcher.changes(timeout=0) == set()
+        (tmp_path / "~$new.xlsx").write_text("a")
+        (tmp_path / "new.xlsx").write_text("a")
+        assert watcher.changes(timeout=1) == {"new.xlsx"}
+    finally:
+        watcher.close()